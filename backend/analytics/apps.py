@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        # Keep rollups current as usage logs are written
+        from api.writebehind import objects_flushed
+        from .models import UsageLog
+        from .rollups import on_logs_flushed
+        from . import budgets
+        objects_flushed.connect(on_logs_flushed, sender=UsageLog, dispatch_uid='analytics_rollups')
+        objects_flushed.connect(budgets.on_logs_flushed, sender=UsageLog, dispatch_uid='analytics_budgets')
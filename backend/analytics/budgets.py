@@ -0,0 +1,113 @@
+"""
+Month-to-date spend per workspace (or per user for personal chats), for budget checks.
+
+The sum is computed once per month and scope from the daily rollups plus the
+raw logs above the rollup watermark, like the dashboard does, and kept in the
+cache as integer micro-dollars. After that, newly flushed usage logs are
+added with an atomic `incr`, so a budget check costs one cache read instead of
+an aggregate query per chat request.
+
+The cached value is refreshed after BUDGET_SPEND_TTL seconds, which also
+bounds drift from logs that race the initial computation.
+`recompute_usage_costs` calls `reset()` so repriced logs are picked up.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import UsageLog, UsageRollup
+from .rollups import get_watermark
+
+logger = logging.getLogger(__name__)
+
+MICROS = Decimal('1000000')
+VERSION_KEY = 'budget:spend:version'
+
+
+def month_start(now=None):
+    return (now or timezone.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _spend_key(workspace_id, user_id, month):
+    version = cache.get(VERSION_KEY, 0)
+    scope = f"ws:{workspace_id}" if workspace_id else f"user:{user_id}"
+    return f"budget:spend:{version}:{scope}:{month:%Y-%m}"
+
+
+def compute_spend(workspace_id, user_id, since):
+    """Spend since `since` (a day boundary) straight from the database."""
+    rollups = UsageRollup.objects.filter(bucket__gte=since)
+    logs = UsageLog.objects.filter(id__gt=get_watermark(), timestamp__gte=since)
+    if workspace_id:
+        rollups = rollups.filter(workspace_id=workspace_id)
+        logs = logs.filter(workspace_id=workspace_id)
+    else:
+        rollups = rollups.filter(user_id=user_id, workspace__isnull=True)
+        logs = logs.filter(user_id=user_id, workspace__isnull=True)
+    total = rollups.aggregate(cost=Sum('cost'))['cost'] or 0
+    total += logs.aggregate(cost=Sum('cost_estimate'))['cost'] or 0
+    return Decimal(total)
+
+
+def get_month_spend(workspace_id, user_id):
+    """Month-to-date spend in USD for a workspace, or for a user's personal chats."""
+    month = month_start()
+    key = _spend_key(workspace_id, user_id, month)
+    micros = cache.get(key)
+    if micros is None:
+        micros = int(compute_spend(workspace_id, user_id, month) * MICROS)
+        cache.set(key, micros, getattr(settings, 'BUDGET_SPEND_TTL', 600))
+    return Decimal(micros) / MICROS
+
+
+def get_budget(workspace_id):
+    """Monthly budget in USD, or None when unlimited."""
+    if not workspace_id:
+        return getattr(settings, 'PERSONAL_MONTHLY_BUDGET', None)
+    key = f"budget:limit:ws:{workspace_id}"
+    budget = cache.get(key, 'missing')
+    if budget == 'missing':
+        from teams.models import Workspace
+        budget = Workspace.objects.filter(id=workspace_id).values_list('monthly_budget', flat=True).first()
+        cache.set(key, budget, getattr(settings, 'BUDGET_LIMIT_CACHE_TTL', 60))
+    return budget
+
+
+def remaining_budget(workspace_id, user_id):
+    """USD left this month, or None when there is no budget."""
+    budget = get_budget(workspace_id)
+    if budget is None:
+        return None
+    return Decimal(budget) - get_month_spend(workspace_id, user_id)
+
+
+def reset():
+    """Drop every cached running sum (they are recomputed on next use)."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def on_logs_flushed(sender, objects, **kwargs):
+    month = month_start()
+    totals = defaultdict(Decimal)
+    for log in objects:
+        if log.timestamp and log.timestamp < month:
+            continue
+        totals[(log.workspace_id, log.user_id if not log.workspace_id else None)] += Decimal(log.cost_estimate or 0)
+    for (workspace_id, user_id), cost in totals.items():
+        micros = int(cost * MICROS)
+        if not micros:
+            continue
+        try:
+            cache.incr(_spend_key(workspace_id, user_id, month), micros)
+        except ValueError:
+            pass  # not cached yet; the first check computes it from the database
+        except Exception as e:
+            logger.error(f"Budget spend update failed: {e}")
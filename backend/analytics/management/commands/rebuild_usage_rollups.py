@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from analytics import rollups
+
+
+class Command(BaseCommand):
+    help = "Fold pending usage logs into the dashboard rollups, or rebuild them from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Delete all rollups and recompute from raw logs")
+        parser.add_argument('--batch-size', type=int, default=rollups.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            processed = rollups.rebuild()
+        else:
+            processed = rollups.roll_up_pending(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {processed} usage logs (watermark at id {rollups.get_watermark()})"
+        ))
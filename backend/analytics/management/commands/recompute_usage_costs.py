@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from analytics import budgets, pricing
+from analytics.models import UsageLog, PriceSnapshot
+
+
+class Command(BaseCommand):
+    help = "Recompute UsageLog cost estimates with the current (or a given) price version."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--price-version', type=int, help="PriceSnapshot id to apply (default: current catalog prices)")
+        parser.add_argument('--since', help="Only logs on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--model', help="Only logs for this model id")
+        parser.add_argument('--all', action='store_true', help="Also re-price logs already on the target version")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['price_version']:
+            try:
+                table = pricing.get_price_version(options['price_version'])
+            except PriceSnapshot.DoesNotExist:
+                raise CommandError(f"Price version {options['price_version']} does not exist")
+        else:
+            table = pricing.get_price_table()
+
+        logs = UsageLog.objects.only(
+            'id', 'timestamp', 'workspace_id', 'user_id', 'model_name',
+            'input_tokens', 'output_tokens', 'cost_estimate', 'cache_status', 'saved_cost', 'price_version_id',
+        )
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError("--since must be YYYY-MM-DD")
+            logs = logs.filter(timestamp__date__gte=since)
+        if options['model']:
+            logs = logs.filter(model_name=options['model'])
+        if not options['all']:
+            logs = logs.filter(~Q(price_version_id=table.version) | Q(price_version__isnull=True))
+
+        scanned = changed = 0
+        last_id = 0
+        while True:
+            batch = list(logs.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            scanned += len(batch)
+            if options['dry_run']:
+                changed += sum(
+                    1 for log in batch
+                    if table.cost(log.model_name, log.input_tokens, log.output_tokens)
+                    != (log.saved_cost if log.cache_status == 'HIT' else log.cost_estimate)
+                )
+            else:
+                changed += pricing.recompute_batch(batch, table)
+
+        if changed and not options['dry_run']:
+            # Cached month-to-date spend was summed from the old prices
+            budgets.reset()
+
+        verb = "Would re-price" if options['dry_run'] else "Re-priced"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {changed} of {scanned} usage logs with price version {table.version}"
+        ))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_price_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagelog',
+            name='cache_status',
+            field=models.CharField(choices=[('BYPASS', 'Not cached'), ('MISS', 'Miss'), ('HIT', 'Hit')], default='BYPASS', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='usagelog',
+            name='saved_cost',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='cache_hits',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='saved_cost',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=14),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class UsageLog(models.Model):
     # Nullable if tracked before we had workspaces, or for personal playground usage
@@ -9,7 +10,62 @@ class UsageLog(models.Model):
     input_tokens = models.IntegerField(default=0)
     output_tokens = models.IntegerField(default=0)
     cost_estimate = models.DecimalField(max_digits=10, decimal_places=6, default=0.0)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Idempotency key so replayed write-behind records are inserted once
+    request_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    # Prices used for cost_estimate; null for logs written before prices were versioned
+    price_version = models.ForeignKey('PriceSnapshot', on_delete=models.SET_NULL, null=True, blank=True, related_name='usage_logs')
+
+    CACHE_STATUS_CHOICES = [
+        ('BYPASS', 'Not cached'),
+        ('MISS', 'Miss'),
+        ('HIT', 'Hit'),
+    ]
+    cache_status = models.CharField(max_length=6, choices=CACHE_STATUS_CHOICES, default='BYPASS')
+    # What the completion would have cost upstream when served from the completion cache
+    saved_cost = models.DecimalField(max_digits=10, decimal_places=6, default=0)
 
     def __str__(self):
         return f"{self.user.username} - {self.model_name} - ${self.cost_estimate}"
+
+class UsageRollup(models.Model):
+    """Pre-aggregated UsageLog totals per workspace/user/model and day."""
+    bucket = models.DateTimeField(help_text="Start of the day (UTC)")
+    workspace = models.ForeignKey('teams.Workspace', on_delete=models.CASCADE, null=True, blank=True, related_name='usage_rollups')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='usage_rollups')
+    model_name = models.CharField(max_length=50)
+    request_count = models.IntegerField(default=0)
+    input_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+    cache_hits = models.IntegerField(default=0)
+    saved_cost = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+
+    class Meta:
+        unique_together = ('bucket', 'workspace', 'user', 'model_name')
+        indexes = [
+            models.Index(fields=['workspace', 'bucket']),
+            models.Index(fields=['user', 'workspace', 'bucket']),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d} {self.model_name} ({self.request_count})"
+
+class RollupCheckpoint(models.Model):
+    """Highest UsageLog id already folded into UsageRollup."""
+    name = models.CharField(max_length=50, unique=True)
+    last_log_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_log_id}"
+
+class PriceSnapshot(models.Model):
+    """An immutable set of per-model prices; its id is the price version recorded on UsageLog."""
+    digest = models.CharField(max_length=40, unique=True)
+    # {model_id: [input, output]} in USD per 1k tokens, "*" is the default
+    prices = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"v{self.pk} ({len(self.prices)} models)"
@@ -0,0 +1,138 @@
+"""
+Per-model prices for usage cost estimates.
+
+Prices come from the cached OpenRouter catalog (per-token strings, converted
+to USD per 1k tokens here), with a small static table for models the catalog
+doesn't price. Each distinct set of prices is stored once as a PriceSnapshot,
+whose id is recorded on every UsageLog so costs can be traced back and
+recomputed (see the recompute_usage_costs command).
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import PriceSnapshot, UsageLog, UsageRollup, RollupCheckpoint
+from .rollups import CHECKPOINT_NAME, day_bucket
+
+logger = logging.getLogger(__name__)
+
+# Cost per 1k tokens for models the catalog has no pricing for (rough estimates)
+STATIC_PRICING = {
+    'openai/gpt-3.5-turbo': {'input': 0.0005, 'output': 0.0015},
+    'openai/gpt-4': {'input': 0.03, 'output': 0.06},
+    'google/gemini-pro': {'input': 0.000125, 'output': 0.000375},
+    'anthropic/claude-3-opus': {'input': 0.015, 'output': 0.075},
+}
+
+DEFAULT_PRICING = {'input': 0.001, 'output': 0.002}
+
+COST_PLACES = Decimal('0.000001')
+
+
+class PriceTable:
+    def __init__(self, version, prices):
+        self.version = version
+        self.prices = prices
+        self.default = prices.get('*', [DEFAULT_PRICING['input'], DEFAULT_PRICING['output']])
+
+    def get(self, model):
+        """(input, output) USD per 1k tokens."""
+        return self.prices.get(model, self.default)
+
+    def cost(self, model, input_tokens, output_tokens):
+        input_price, output_price = self.get(model)
+        total = Decimal(str(input_price)) * input_tokens / 1000 + Decimal(str(output_price)) * output_tokens / 1000
+        return total.quantize(COST_PLACES)
+
+
+def catalog_prices(models):
+    """Build the {model_id: [input, output]} table (per 1k tokens) for a catalog."""
+    prices = {model: [p['input'], p['output']] for model, p in STATIC_PRICING.items()}
+    prices['*'] = [DEFAULT_PRICING['input'], DEFAULT_PRICING['output']]
+    for model in models:
+        pricing = model.get('pricing') or {}
+        try:
+            prices[model['id']] = [float(pricing['prompt']) * 1000, float(pricing['completion']) * 1000]
+        except (KeyError, TypeError, ValueError):
+            continue
+    return prices
+
+
+def snapshot_for(prices):
+    """Return the PriceSnapshot holding exactly these prices, creating it if new."""
+    body = json.dumps(prices, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha1(body.encode()).hexdigest()
+    snapshot, created = PriceSnapshot.objects.get_or_create(digest=digest, defaults={'prices': prices})
+    if created:
+        logger.info(f"New price version {snapshot.pk} ({len(prices)} models)")
+    return snapshot
+
+
+_current = None  # (catalog etag, PriceTable)
+_current_lock = threading.Lock()
+
+
+def get_price_table():
+    """Prices for the current catalog; only touches the database when the catalog changes."""
+    global _current
+    from api.models_service import get_catalog
+
+    catalog = get_catalog()
+    current = _current
+    if current is not None and current[0] == catalog['etag']:
+        return current[1]
+    with _current_lock:
+        if _current is None or _current[0] != catalog['etag']:
+            snapshot = snapshot_for(catalog_prices(catalog['models']))
+            _current = (catalog['etag'], PriceTable(snapshot.pk, snapshot.prices))
+        return _current[1]
+
+
+def get_price_version(version):
+    snapshot = PriceSnapshot.objects.get(pk=version)
+    return PriceTable(snapshot.pk, snapshot.prices)
+
+
+def recompute_batch(logs, table):
+    """
+    Re-price a batch of UsageLog rows with `table`, keeping already-built
+    rollups consistent by applying the cost difference to them.
+    Returns the number of rows whose cost changed.
+    """
+    changed = []
+    for log in logs:
+        cost = table.cost(log.model_name, log.input_tokens, log.output_tokens)
+        # Cache hits cost nothing; their price goes into saved_cost instead
+        field = 'saved_cost' if log.cache_status == 'HIT' else 'cost_estimate'
+        current = getattr(log, field)
+        if cost != current or log.price_version_id != table.version:
+            changed.append((log, field, cost - current))
+            setattr(log, field, cost)
+            log.price_version_id = table.version
+    if not changed:
+        return 0
+
+    with transaction.atomic():
+        # Hold the checkpoint so a concurrent roll-up can't fold these rows in between
+        checkpoint = RollupCheckpoint.objects.select_for_update().filter(name=CHECKPOINT_NAME).first()
+        watermark = checkpoint.last_log_id if checkpoint else 0
+
+        UsageLog.objects.bulk_update([log for log, _, _ in changed], ['cost_estimate', 'saved_cost', 'price_version'])
+
+        deltas = defaultdict(lambda: {'cost': Decimal('0'), 'saved_cost': Decimal('0')})
+        for log, field, delta in changed:
+            if log.id > watermark or not delta:
+                continue
+            key = (day_bucket(log.timestamp), log.workspace_id, log.user_id, log.model_name)
+            deltas[key]['cost' if field == 'cost_estimate' else 'saved_cost'] += delta
+        for (bucket, workspace_id, user_id, model_name), delta in deltas.items():
+            UsageRollup.objects.filter(
+                bucket=bucket, workspace_id=workspace_id, user_id=user_id, model_name=model_name,
+            ).update(cost=F('cost') + delta['cost'], saved_cost=F('saved_cost') + delta['saved_cost'])
+    return len(changed)
@@ -0,0 +1,119 @@
+"""
+Incremental maintenance of UsageRollup.
+
+UsageLog rows are folded into daily rollups in id order, tracking
+the last processed id in RollupCheckpoint. The dashboard reads rollups and
+only aggregates raw logs above that watermark.
+
+The checkpoint advance is a compare-and-set, so two processes rolling up at
+the same time can't double count: the loser's transaction is rolled back.
+Ids are assumed to become visible in order, which holds for SQLite's single
+writer; on Postgres run `rebuild_usage_rollups --rebuild` periodically if
+concurrent writers may commit out of order.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import UsageLog, UsageRollup, RollupCheckpoint
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'usage'
+BATCH_SIZE = 5000
+
+
+class CheckpointConflict(Exception):
+    pass
+
+
+def day_bucket(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_watermark():
+    checkpoint = RollupCheckpoint.objects.filter(name=CHECKPOINT_NAME).values_list('last_log_id', flat=True).first()
+    return checkpoint or 0
+
+
+def roll_up_batch(batch_size=BATCH_SIZE):
+    """Fold the next batch of unprocessed logs into rollups. Returns rows processed."""
+    with transaction.atomic():
+        checkpoint, _ = RollupCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+        logs = list(
+            UsageLog.objects.filter(id__gt=checkpoint.last_log_id)
+            .order_by('id')
+            .values('id', 'timestamp', 'workspace_id', 'user_id', 'model_name',
+                    'input_tokens', 'output_tokens', 'cost_estimate', 'cache_status', 'saved_cost')[:batch_size]
+        )
+        if not logs:
+            return 0
+
+        totals = defaultdict(lambda: [0, 0, 0, Decimal('0'), 0, Decimal('0')])
+        for log in logs:
+            key = (day_bucket(log['timestamp']), log['workspace_id'], log['user_id'], log['model_name'])
+            row = totals[key]
+            row[0] += 1
+            row[1] += log['input_tokens']
+            row[2] += log['output_tokens']
+            row[3] += log['cost_estimate']
+            row[4] += log['cache_status'] == 'HIT'
+            row[5] += log['saved_cost']
+
+        for (bucket, workspace_id, user_id, model_name), (count, tokens_in, tokens_out, cost, hits, saved) in totals.items():
+            updated = UsageRollup.objects.filter(
+                bucket=bucket, workspace_id=workspace_id, user_id=user_id, model_name=model_name,
+            ).update(
+                request_count=F('request_count') + count,
+                input_tokens=F('input_tokens') + tokens_in,
+                output_tokens=F('output_tokens') + tokens_out,
+                cost=F('cost') + cost,
+                cache_hits=F('cache_hits') + hits,
+                saved_cost=F('saved_cost') + saved,
+            )
+            if not updated:
+                UsageRollup.objects.create(
+                    bucket=bucket, workspace_id=workspace_id, user_id=user_id, model_name=model_name,
+                    request_count=count, input_tokens=tokens_in, output_tokens=tokens_out, cost=cost,
+                    cache_hits=hits, saved_cost=saved,
+                )
+
+        advanced = RollupCheckpoint.objects.filter(
+            pk=checkpoint.pk, last_log_id=checkpoint.last_log_id,
+        ).update(last_log_id=logs[-1]['id'])
+        if not advanced:
+            raise CheckpointConflict("Rollup checkpoint moved concurrently")
+        return len(logs)
+
+
+def roll_up_pending(batch_size=BATCH_SIZE):
+    """Process all pending logs. Returns total rows processed."""
+    total = 0
+    while True:
+        try:
+            processed = roll_up_batch(batch_size)
+        except CheckpointConflict:
+            # Another process is rolling up; it will pick up whatever we leave
+            break
+        total += processed
+        if processed < batch_size:
+            break
+    return total
+
+
+def rebuild():
+    """Drop all rollups and recompute them from the raw logs."""
+    with transaction.atomic():
+        UsageRollup.objects.all().delete()
+        RollupCheckpoint.objects.update_or_create(name=CHECKPOINT_NAME, defaults={'last_log_id': 0})
+    return roll_up_pending()
+
+
+def on_logs_flushed(sender, objects, **kwargs):
+    try:
+        roll_up_pending()
+    except Exception as e:
+        logger.error(f"Usage rollup failed: {e}")
@@ -1,3 +1,203 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from teams.models import Workspace, WorkspaceMember
+
+from . import budgets, pricing
+from .models import PriceSnapshot, RollupCheckpoint, UsageLog, UsageRollup
+from .rollups import CheckpointConflict, day_bucket, get_watermark, rebuild, roll_up_batch, roll_up_pending
+
+
+def catalog(prompt, completion, etag):
+    """A catalog snapshot pricing test/model at `prompt`/`completion` USD per token."""
+    return {
+        "models": [{"id": "test/model", "pricing": {"prompt": prompt, "completion": completion}}],
+        "fallback": False, "etag": etag, "fresh_until": time.time() + 3600,
+    }
+
+
+class PriceTableTests(TestCase):
+    def setUp(self):
+        for patcher in (mock.patch.object(pricing, '_current', None),
+                        mock.patch('api.models_service.get_catalog')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        from api import models_service
+        self.get_catalog = models_service.get_catalog
+
+    def test_catalog_prices_are_per_1k_tokens(self):
+        prices = pricing.catalog_prices([
+            {"id": "test/model", "pricing": {"prompt": "0.000002", "completion": "0.000004"}},
+            {"id": "test/unpriced", "pricing": {"prompt": "n/a"}},
+        ])
+        self.assertEqual(prices['test/model'], [0.002, 0.004])
+        self.assertNotIn('test/unpriced', prices)
+        self.assertEqual(prices['openai/gpt-4'], [0.03, 0.06])
+
+        table = pricing.PriceTable(None, prices)
+        self.assertEqual(table.cost('test/model', 1000, 500), Decimal('0.004000'))
+        self.assertEqual(table.cost('test/unpriced', 1000, 1000), Decimal('0.003000'))  # default prices
+
+    def test_versions_follow_the_prices(self):
+        self.get_catalog.return_value = catalog('0.000001', '0.000002', 'a')
+        first = pricing.get_price_table()
+        # Same catalog: no database work at all
+        with self.assertNumQueries(0):
+            self.assertIs(pricing.get_price_table(), first)
+
+        # A refreshed catalog with the same prices keeps the version
+        self.get_catalog.return_value = catalog('0.000001', '0.000002', 'b')
+        self.assertEqual(pricing.get_price_table().version, first.version)
+
+        self.get_catalog.return_value = catalog('0.000003', '0.000002', 'c')
+        second = pricing.get_price_table()
+        self.assertNotEqual(second.version, first.version)
+        self.assertEqual(PriceSnapshot.objects.count(), 2)
+        self.assertEqual(pricing.get_price_version(first.version).get('test/model'), [0.001, 0.002])
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('roller', password='pw')
+        self.today = day_bucket(timezone.now())
+        self.yesterday = self.today - timedelta(days=1)
+
+    def log(self, model='test/a', cost='0.5', day=None, **fields):
+        return UsageLog.objects.create(user=self.user, model_name=model, input_tokens=10, output_tokens=5,
+                                       cost_estimate=Decimal(cost), timestamp=(day or self.today) + timedelta(hours=3),
+                                       **fields)
+
+    def rollups(self):
+        return {(r.bucket, r.model_name): (r.request_count, r.input_tokens, r.cost, r.cache_hits, r.saved_cost)
+                for r in UsageRollup.objects.all()}
+
+    def test_batches_fold_logs_by_day_and_advance_the_checkpoint(self):
+        first = self.log()
+        second = self.log(cost='0', cache_status='HIT', saved_cost=Decimal('0.25'))
+        self.log(day=self.yesterday)
+
+        self.assertEqual(roll_up_batch(batch_size=2), 2)
+        self.assertEqual(get_watermark(), second.id)
+        self.assertEqual(self.rollups(), {(self.today, 'test/a'): (2, 20, Decimal('0.5'), 1, Decimal('0.25'))})
+
+        self.assertEqual(roll_up_pending(batch_size=2), 1)
+        self.assertEqual(self.rollups()[(self.yesterday, 'test/a')], (1, 10, Decimal('0.5'), 0, Decimal('0')))
+        # Existing rows are added to, not replaced
+        self.log()
+        self.assertEqual(roll_up_pending(), 1)
+        self.assertEqual(self.rollups()[(self.today, 'test/a')][:3], (3, 30, Decimal('1.0')))
+        self.assertGreater(get_watermark(), first.id)
+
+    def test_checkpoint_moved_by_another_process_rolls_the_batch_back(self):
+        self.log()
+        self.log()
+        # Another process advanced the checkpoint after this one read it
+        stale = RollupCheckpoint.objects.create(name='usage', last_log_id=0)
+        RollupCheckpoint.objects.filter(pk=stale.pk).update(last_log_id=UsageLog.objects.earliest('id').id)
+        with mock.patch('analytics.rollups.RollupCheckpoint.objects.get_or_create', return_value=(stale, False)):
+            with self.assertRaises(CheckpointConflict):
+                roll_up_batch()
+            self.assertFalse(UsageRollup.objects.exists())
+            # roll_up_pending leaves the work to the other process
+            self.assertEqual(roll_up_pending(), 0)
+
+    def test_rebuild_recomputes_from_the_logs(self):
+        self.log()
+        self.log(model='test/b', cost='1')
+        roll_up_pending()
+        UsageRollup.objects.update(cost=99)
+
+        self.assertEqual(rebuild(), 2)
+        self.assertEqual({key: value[2] for key, value in self.rollups().items()},
+                         {(self.today, 'test/a'): Decimal('0.5'), (self.today, 'test/b'): Decimal('1')})
+
+
+class UsageDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('viewer', password='pw')
+        self.other = User.objects.create_user('teammate', password='pw')
+        self.workspace = Workspace.objects.create(name='Team', owner=self.user)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.user, role='OWNER')
+        self.client.force_login(self.user)
+
+    def log(self, user, model, cost, workspace=None, **fields):
+        UsageLog.objects.create(user=user, workspace=workspace, model_name=model, cost_estimate=Decimal(cost), **fields)
+
+    def dashboard(self, **params):
+        response = self.client.get('/api/analytics/dashboard/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_totals_add_the_raw_tail_to_the_rollups(self):
+        self.log(self.user, 'test/a', '1', self.workspace)
+        self.log(self.other, 'test/b', '2', self.workspace)
+        roll_up_pending()
+        # Logged after the last rollup
+        self.log(self.user, 'test/a', '0', self.workspace, cache_status='HIT', saved_cost=Decimal('1'))
+        self.log(self.other, 'test/c', '4', self.workspace)
+        self.log(self.user, 'test/private', '8')
+
+        data = self.dashboard(workspace=self.workspace.id)
+        self.assertEqual((Decimal(data['total_cost']), data['total_requests']), (Decimal('7'), 4))
+        self.assertEqual((data['cache_hits'], Decimal(data['total_saved'])), (1, Decimal('1')))
+        self.assertEqual([(row['model_name'], row['request_count']) for row in data['usage_by_model']],
+                         [('test/c', 1), ('test/b', 1), ('test/a', 2)])
+        self.assertEqual({row['user__username']: Decimal(row['total_cost']) for row in data['usage_by_user']},
+                         {'viewer': Decimal('1'), 'teammate': Decimal('6')})
+        # Today's rolled-up and raw requests share one day entry
+        self.assertEqual([entry['requests'] for entry in data['daily_usage']], [4])
+
+        personal = self.dashboard()
+        self.assertEqual((Decimal(personal['total_cost']), personal['total_requests']), (Decimal('8'), 1))
+
+
+class RecomputeUsageCostsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('billing', password='pw')
+        self.old = pricing.snapshot_for({'test/model': [0.001, 0.002]})
+        self.new = pricing.snapshot_for({'test/model': [0.002, 0.004]})
+        old_table = pricing.get_price_version(self.old.pk)
+        self.miss = UsageLog.objects.create(user=self.user, model_name='test/model', input_tokens=1000, output_tokens=1000,
+                                            cost_estimate=old_table.cost('test/model', 1000, 1000), price_version=self.old)
+        self.hit = UsageLog.objects.create(user=self.user, model_name='test/model', input_tokens=1000, output_tokens=1000,
+                                           cache_status='HIT', saved_cost=old_table.cost('test/model', 1000, 1000),
+                                           price_version=self.old)
+        roll_up_pending()
+
+    def recompute(self, *args):
+        out = StringIO()
+        call_command('recompute_usage_costs', '--price-version', str(self.new.pk), *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        self.assertIn('Would re-price 2 of 2', self.recompute('--dry-run'))
+        self.miss.refresh_from_db()
+        self.assertEqual(self.miss.price_version, self.old)
+
+    def test_logs_and_rollups_are_repriced(self):
+        cache.set(budgets.VERSION_KEY, 5)
+        self.addCleanup(cache.delete, budgets.VERSION_KEY)
+        self.assertIn('Re-priced 2 of 2', self.recompute())
+
+        self.miss.refresh_from_db()
+        self.hit.refresh_from_db()
+        self.assertEqual((self.miss.cost_estimate, self.miss.price_version), (Decimal('0.006'), self.new))
+        # Cache hits stay free; their would-be price is repriced instead
+        self.assertEqual((self.hit.cost_estimate, self.hit.saved_cost), (Decimal('0'), Decimal('0.006')))
+        rollup = UsageRollup.objects.get(user=self.user)
+        self.assertEqual((rollup.cost, rollup.saved_cost), (Decimal('0.006'), Decimal('0.006')))
+        # Cached month-to-date spend is invalidated
+        self.assertEqual(cache.get(budgets.VERSION_KEY), 6)
 
-# Create your tests here.
+        # Already on the target version: nothing left to do
+        self.assertIn('Re-priced 0 of 0', self.recompute())
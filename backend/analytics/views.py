@@ -1,68 +1,99 @@
 from rest_framework import viewsets, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Sum, Count
+from django.db.models import Sum, Count, Q
 from django.db.models.functions import TruncDay
 from django.utils import timezone
 from datetime import timedelta
-from .models import UsageLog
-from teams.models import WorkspaceMember
+from .models import UsageLog, UsageRollup
+from .rollups import get_watermark
+from teams.access import IsWorkspaceMember
+from tethrai_backend.db_routers import read_replica
 
 class UsageDashboardViewSet(viewsets.ViewSet):
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsWorkspaceMember]
 
+    @read_replica
     def list(self, request):
         user = request.user
         workspace_id = request.query_params.get('workspace')
         
-        # Base Query
-        logs = UsageLog.objects.all()
+        # Base Query: rollups for everything up to the watermark, raw logs after it
+        rollups = UsageRollup.objects.all()
+        logs = UsageLog.objects.filter(id__gt=get_watermark())
         
         # Filter Logic
         if workspace_id:
-            # Check permission
-            if not WorkspaceMember.objects.filter(workspace_id=workspace_id, user=user).exists():
-                 return Response({"error": "Permission denied"}, status=403)
+            # Membership checked by IsWorkspaceMember
             # Filter logs for this workspace
+            rollups = rollups.filter(workspace_id=workspace_id)
             logs = logs.filter(workspace_id=workspace_id)
         else:
-            # Personal filtering (logs owned by user OR logs from personal usage where workspace is null)
-            # Actually, standard behavior for "Personal View" usually means "My Usage across context" OR "My Personal Workspace Usage".
-            # Let's define "Personal View" as: Logs where correct user is involved. 
-            # If we want ONLY private usage, we filter workspace__isnull=True.
-            # But the user might want "My Cost" across all teams?
-            # Let's stick to "Personal Scope" = Logs where workspace is None.
+            # Personal Scope = Logs where workspace is None.
+            rollups = rollups.filter(user=user, workspace__isnull=True)
             logs = logs.filter(user=user, workspace__isnull=True)
 
         # 1. Total Cost & Requests
-        total_cost = logs.aggregate(Sum('cost_estimate'))['cost_estimate__sum'] or 0
-        total_requests = logs.count()
+        totals = rollups.aggregate(cost=Sum('cost'), requests=Sum('request_count'),
+                                   hits=Sum('cache_hits'), saved=Sum('saved_cost'))
+        tail = logs.aggregate(cost=Sum('cost_estimate'), requests=Count('id'),
+                              hits=Count('id', filter=Q(cache_status='HIT')), saved=Sum('saved_cost'))
+        total_cost = (totals['cost'] or 0) + (tail['cost'] or 0)
+        total_requests = (totals['requests'] or 0) + (tail['requests'] or 0)
+        # Completions served from the completion cache and what they would have cost
+        cache_hits = (totals['hits'] or 0) + (tail['hits'] or 0)
+        total_saved = (totals['saved'] or 0) + (tail['saved'] or 0)
         
         # 2. Usage by User (Relevant for Team view)
-        usage_by_user = logs.values('user__username').annotate(
-            total_cost=Sum('cost_estimate'),
-            request_count=Count('id')
-        ).order_by('-total_cost')
+        usage_by_user = merge_groups(
+            'user__username',
+            rollups.values('user__username').annotate(total_cost=Sum('cost'), request_count=Sum('request_count')),
+            logs.values('user__username').annotate(total_cost=Sum('cost_estimate'), request_count=Count('id')),
+        )
         
         # 3. Usage by Model
-        usage_by_model = logs.values('model_name').annotate(
-            total_cost=Sum('cost_estimate'),
-            request_count=Count('id')
-        ).order_by('-total_cost')
+        usage_by_model = merge_groups(
+            'model_name',
+            rollups.values('model_name').annotate(total_cost=Sum('cost'), request_count=Sum('request_count')),
+            logs.values('model_name').annotate(total_cost=Sum('cost_estimate'), request_count=Count('id')),
+        )
         
         # 4. Daily Usage (Last 30 Days)
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        daily_usage = logs.filter(timestamp__gte=thirty_days_ago).annotate(
+        # Rollups are bucketed by whole days, so the window starts at midnight 30 days ago
+        thirty_days_ago = (timezone.now() - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+        daily = {}
+        for row in rollups.filter(bucket__gte=thirty_days_ago).values('bucket').annotate(
+            cost=Sum('cost'), requests=Sum('request_count')
+        ):
+            daily[row['bucket']] = {"date": row['bucket'], "cost": row['cost'], "requests": row['requests']}
+        for row in logs.filter(timestamp__gte=thirty_days_ago).annotate(
             date=TruncDay('timestamp')
         ).values('date').annotate(
             cost=Sum('cost_estimate'),
             requests=Count('id')
-        ).order_by('date')
+        ):
+            entry = daily.setdefault(row['date'], {"date": row['date'], "cost": 0, "requests": 0})
+            entry['cost'] += row['cost']
+            entry['requests'] += row['requests']
+        daily_usage = sorted(daily.values(), key=lambda entry: entry['date'])
         
         return Response({
             "total_cost": total_cost,
             "total_requests": total_requests,
+            "cache_hits": cache_hits,
+            "total_saved": total_saved,
             "usage_by_user": usage_by_user,
             "usage_by_model": usage_by_model,
             "daily_usage": daily_usage
         })
+
+
+def merge_groups(key, *groups):
+    """Sum total_cost/request_count rows from several grouped queries, sorted by cost."""
+    merged = {}
+    for rows in groups:
+        for row in rows:
+            entry = merged.setdefault(row[key], {key: row[key], "total_cost": 0, "request_count": 0})
+            entry['total_cost'] += row['total_cost'] or 0
+            entry['request_count'] += row['request_count'] or 0
+    return sorted(merged.values(), key=lambda entry: entry['total_cost'], reverse=True)
@@ -1,41 +1,175 @@
-import requests
-import json
-import os
-
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-
-def stream_chat_response(messages, model="google/gemini-2.0-flash-exp:free"):
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:5173", # Client URL
-        "X-Title": "TethrAI",
-    }
-    
-    data = {
+import asyncio
+import logging
+import time
+
+from .sse import SSEDecoder, ContentEvent, UsageEvent, FinishEvent, ErrorEvent, DONE
+from .upstream import (
+    OPENROUTER_API_KEY, OPENROUTER_BASE_URL, HTTP2_AVAILABLE, UpstreamError, RetryPlan,
+    get_session, get_async_client, headers as _headers, check_status, connect_timeout, read_timeout,
+)
+
+OPENROUTER_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+DEFAULT_MODEL = "google/gemini-2.0-flash-exp:free"
+
+logger = logging.getLogger(__name__)
+
+
+def _payload(messages, model):
+    return {
         "model": model,
         "messages": messages,
         "stream": True,
+        # Ask OpenRouter to report token usage in the final chunk
+        "usage": {"include": True},
     }
-    
+
+
+class StreamError(UpstreamError):
+    """Error event reported by the upstream in the middle of a stream."""
+
+
+def _apply_events(events, usage):
+    """
+    Return (content deltas among `events`, whether [DONE] was seen) and record
+    usage/finish_reason into `usage`. Events after [DONE] are ignored.
+    """
+    texts = []
+    for event in events:
+        if type(event) is ContentEvent:
+            texts.append(event.text)
+        elif type(event) is UsageEvent:
+            usage.update(event.usage)
+        elif type(event) is FinishEvent:
+            usage['finish_reason'] = event.reason
+        elif type(event) is ErrorEvent:
+            raise StreamError(event.message, status=event.code if isinstance(event.code, int) else None)
+        elif event is DONE:
+            return texts, True
+    return texts, False
+
+
+def stream_chat_response(messages, model=DEFAULT_MODEL, usage=None):
+    """
+    Yield content deltas from the upstream stream. If `usage` is a dict it is
+    filled with the usage block and finish_reason reported by the upstream and
+    the model that actually served the request; if the request fails it gets
+    an "error" entry instead (nothing is yielded for the error itself).
+
+    Failures before the first content delta are retried and may fall back to
+    another model (see api.upstream).
+    """
+    usage = usage if usage is not None else {}
+    plan = RetryPlan(model)
+    try:
+        for candidate, attempt in plan:
+            if plan.delay:
+                time.sleep(plan.delay)
+            started = False
+            try:
+                response = get_session().post(
+                    OPENROUTER_URL, headers=_headers(), json=_payload(messages, candidate),
+                    stream=True, timeout=(connect_timeout(), read_timeout()),
+                )
+                with response:
+                    check_status(response.status_code, response.headers, response.text if response.status_code >= 400 else '')
+                    decoder = SSEDecoder()
+                    for data in response.iter_content(chunk_size=None):
+                        # The last deltas may share a read with [DONE]: yield them before stopping
+                        texts, done = _apply_events(decoder.feed(data), usage)
+                        for text in texts:
+                            started = True
+                            yield text
+                        if done:
+                            break
+                    else:
+                        for text in _apply_events(decoder.close(), usage)[0]:
+                            started = True
+                            yield text
+            except Exception as e:
+                plan.failed(e, started)
+                if started:
+                    break
+            else:
+                plan.succeeded()
+                usage['model'] = candidate
+                return
+    finally:
+        plan.close()
+    usage['model'] = plan.model
+    usage['error'] = plan.error_message()
+
+
+async def astream_chat_response(messages, model=DEFAULT_MODEL, usage=None):
+    """Async counterpart of stream_chat_response using the pooled client."""
+    usage = usage if usage is not None else {}
+    plan = RetryPlan(model)
+    try:
+        for candidate, attempt in plan:
+            if plan.delay:
+                await asyncio.sleep(plan.delay)
+            started = False
+            try:
+                client = get_async_client()
+                async with client.stream('POST', OPENROUTER_URL, headers=_headers(), json=_payload(messages, candidate)) as response:
+                    body = (await response.aread()).decode(errors='replace') if response.status_code >= 400 else ''
+                    check_status(response.status_code, response.headers, body)
+                    decoder = SSEDecoder()
+                    done = False
+                    async for data in response.aiter_bytes():
+                        texts, done = _apply_events(decoder.feed(data), usage)
+                        for text in texts:
+                            started = True
+                            yield text
+                        if done:
+                            break
+                    if not done:
+                        for text in _apply_events(decoder.close(), usage)[0]:
+                            started = True
+                            yield text
+            except Exception as e:
+                plan.failed(e, started)
+                if started:
+                    break
+            else:
+                plan.succeeded()
+                usage['model'] = candidate
+                return
+    finally:
+        plan.close()
+    usage['model'] = plan.model
+    usage['error'] = plan.error_message()
+
+
+def complete_chat(messages, model=DEFAULT_MODEL, timeout=30, usage=None):
+    """
+    Non-streaming completion; returns the reply text or None on failure. If
+    `usage` is a dict it gets the reported usage and the serving model (or "error").
+    """
+    plan = RetryPlan(model)
     try:
-        response = requests.post(OPENROUTER_URL, headers=headers, json=data, stream=True)
-        response.raise_for_status()
-        
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    if line == 'data: [DONE]':
-                        break
-                    try:
-                        json_str = line[6:] # Remove 'data: '
-                        chunk = json.loads(json_str)
-                        content = chunk['choices'][0]['delta'].get('content', '')
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
-    except Exception as e:
-        yield f"Error: {str(e)}"
+        for candidate, attempt in plan:
+            if plan.delay:
+                time.sleep(plan.delay)
+            try:
+                response = get_session().post(
+                    OPENROUTER_URL, headers=_headers(), json={"model": candidate, "messages": messages},
+                    timeout=(connect_timeout(), timeout),
+                )
+                check_status(response.status_code, response.headers, response.text if response.status_code >= 400 else '')
+                data = response.json()
+                content = data['choices'][0]['message']['content']
+            except Exception as e:
+                plan.failed(e)
+            else:
+                plan.succeeded()
+                if usage is not None:
+                    usage.update(data.get('usage') or {})
+                    usage['model'] = candidate
+                return content
+    finally:
+        plan.close()
+    if usage is not None:
+        usage['model'] = plan.model
+        usage['error'] = plan.error_message()
+    logger.error(f"Error completing chat: {plan.error_message()}")
+    return None
@@ -0,0 +1,260 @@
+"""
+Batch prompt execution.
+
+A BatchJob runs one prompt (usually a library template filled with many
+variable sets) against one or more models. Every job gets a dispatcher
+thread that hands the calls to a process-wide pool of BATCH_WORKERS threads,
+keeping at most BATCH_MODEL_CONCURRENCY calls per model in flight across all
+jobs and interleaving models so a slow one doesn't hold up the others.
+
+The dispatcher collects finished calls and writes them in bulk: BatchResult
+rows with bulk_create, the job's counters with one update, and a UsageLog
+per call through the write-behind queue. That happens every
+BATCH_FLUSH_SIZE results or second. The job's progress is the counters on
+its row, so any worker can report it. Cancelling flips the row's status;
+the dispatcher notices at its next flush and stops dispatching.
+
+Jobs run in the process that accepted them. If that process dies, the job
+stays RUNNING with the results flushed so far.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .ai import complete_chat
+from .models import BatchJob, BatchResult
+from .tokens import resolve_usage
+from .writebehind import save_later
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0  # seconds
+
+
+class Call:
+    __slots__ = ('index', 'model', 'prompt', 'error')
+
+    def __init__(self, index, model, prompt, error=''):
+        self.index = index
+        self.model = model
+        self.prompt = prompt
+        self.error = error
+
+
+class CallResult:
+    __slots__ = ('call', 'output', 'usage', 'latency_ms')
+
+    def __init__(self, call, output, usage, latency_ms):
+        self.call = call
+        self.output = output
+        self.usage = usage
+        self.latency_ms = latency_ms
+
+
+class BatchRunner:
+    def __init__(self, workers=16, per_model=4, flush_size=20, call_timeout=60):
+        self.per_model = per_model
+        self.flush_size = flush_size
+        self.call_timeout = call_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-call')
+        self._slots = {}  # model -> calls in flight (all jobs)
+        self._lock = threading.Lock()
+        self.running_jobs = 0
+        self.calls_total = 0
+
+    def start(self, job, calls, admission=None):
+        """Run `calls` for `job` in the background. `admission` (api.limits) is released at the end."""
+        thread = threading.Thread(target=self._run, args=(job, calls, admission), name=f'batch-{job.id}', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {"running_jobs": self.running_jobs, "calls_total": self.calls_total,
+                    "in_flight": dict(self._slots)}
+
+    # Per-model slots
+
+    def _acquire(self, model):
+        with self._lock:
+            if self._slots.get(model, 0) >= self.per_model:
+                return False
+            self._slots[model] = self._slots.get(model, 0) + 1
+            return True
+
+    def _release(self, model):
+        with self._lock:
+            self._slots[model] -= 1
+
+    # Worker side
+
+    def _call(self, call):
+        usage = {}
+        start = time.perf_counter()
+        try:
+            output = complete_chat([{"role": "user", "content": call.prompt}], call.model, timeout=self.call_timeout, usage=usage)
+        except Exception as e:
+            output, usage['error'] = None, str(e)
+        return CallResult(call, output or '', usage, int((time.perf_counter() - start) * 1000))
+
+    # Dispatcher
+
+    def _run(self, job, calls, admission):
+        from analytics.budgets import remaining_budget
+
+        with self._lock:
+            self.running_jobs += 1
+        done = queue.Queue()
+        buffer = []
+        in_flight = 0
+        stopped = None
+        try:
+            BatchJob.objects.filter(id=job.id).update(status='RUNNING', started_at=timezone.now())
+
+            # Calls that can't run (e.g. missing template variables) are recorded straight away
+            pending = {}
+            for call in calls:
+                if call.error:
+                    buffer.append(CallResult(call, '', {'error': call.error}, 0))
+                else:
+                    pending.setdefault(call.model, deque()).append(call)
+
+            last_flush = time.monotonic()
+            while pending or in_flight:
+                if pending and stopped is None:
+                    remaining = remaining_budget(job.workspace_id, job.user_id)
+                    if remaining is not None and remaining <= 0:
+                        stopped = "Monthly budget exhausted"
+                if pending and stopped:
+                    for model_calls in pending.values():
+                        buffer.extend(CallResult(call, '', {'error': stopped}, 0) for call in model_calls)
+                    pending.clear()
+
+                # Round-robin over models with a free slot
+                dispatched = True
+                while dispatched:
+                    dispatched = False
+                    for model in list(pending):
+                        if not self._acquire(model):
+                            continue
+                        call = pending[model].popleft()
+                        if not pending[model]:
+                            del pending[model]
+                        future = self._executor.submit(self._call, call)
+                        future.add_done_callback(lambda f, m=model: (self._release(m), done.put(f)))
+                        in_flight += 1
+                        dispatched = True
+
+                # Wait briefly for calls to finish, then take everything that has
+                finished = []
+                if in_flight:
+                    try:
+                        finished.append(done.get(timeout=0.2))
+                        while True:
+                            finished.append(done.get_nowait())
+                    except queue.Empty:
+                        pass
+                elif pending:
+                    # Every model is at its limit with other jobs' calls
+                    time.sleep(0.05)
+                in_flight -= len(finished)
+                buffer.extend(future.result() for future in finished)
+
+                if len(buffer) >= self.flush_size or (buffer and time.monotonic() - last_flush >= FLUSH_INTERVAL):
+                    self._flush(job, buffer, admission)
+                    buffer = []
+                    last_flush = time.monotonic()
+                    if stopped is None and BatchJob.objects.filter(id=job.id, status='CANCELLED').exists():
+                        stopped = "Cancelled"
+
+            self._flush(job, buffer, admission)
+            if stopped == "Cancelled":
+                BatchJob.objects.filter(id=job.id).update(finished_at=timezone.now())
+            else:
+                BatchJob.objects.filter(id=job.id).update(status='COMPLETED', error=stopped or '', finished_at=timezone.now())
+        except Exception as e:
+            logger.error(f"Batch job {job.id} failed: {e}")
+            try:
+                # Keep the results that finished before the failure
+                self._flush(job, buffer, admission)
+            except Exception as flush_error:
+                logger.error(f"Batch job {job.id}: could not save {len(buffer)} results: {flush_error}")
+            BatchJob.objects.filter(id=job.id).update(status='FAILED', error=str(e), finished_at=timezone.now())
+        finally:
+            with self._lock:
+                self.running_jobs -= 1
+            if admission is not None:
+                admission.release()
+            close_old_connections()
+
+    def _flush(self, job, results, admission):
+        if not results:
+            return
+        from analytics.models import UsageLog
+        from analytics.pricing import get_price_table
+
+        prices = get_price_table()
+        rows, logs = [], []
+        completed = failed = tokens = 0
+        for result in results:
+            call, usage = result.call, result.usage
+            error = usage.get('error', '')
+            input_tokens = output_tokens = 0
+            cost = 0
+            if not error or result.output:
+                served_model = usage.get('model') or call.model
+                messages = [{"role": "user", "content": call.prompt}]
+                input_tokens, output_tokens = resolve_usage(messages, result.output, served_model, usage)
+                cost = prices.cost(served_model, input_tokens, output_tokens)
+                logs.append(UsageLog(
+                    user_id=job.user_id, workspace_id=job.workspace_id, model_name=served_model,
+                    input_tokens=input_tokens, output_tokens=output_tokens, cost_estimate=cost,
+                    price_version_id=prices.version,
+                ))
+                tokens += input_tokens + output_tokens
+            if error:
+                failed += 1
+            else:
+                completed += 1
+            rows.append(BatchResult(
+                job_id=job.id, input_index=call.index, model=call.model, prompt=call.prompt,
+                output=result.output, error=error, input_tokens=input_tokens, output_tokens=output_tokens,
+                cost_estimate=cost, latency_ms=result.latency_ms,
+            ))
+
+        # All or nothing, so a failed flush can be retried without duplicating results
+        with transaction.atomic():
+            BatchResult.objects.bulk_create(rows)
+            BatchJob.objects.filter(id=job.id).update(completed=F('completed') + completed, failed=F('failed') + failed)
+        if logs:
+            save_later(*logs)
+        if admission is not None:
+            admission.charge_tokens(tokens)
+        with self._lock:
+            self.calls_total += len(results)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = BatchRunner(
+                    workers=getattr(settings, 'BATCH_WORKERS', 16),
+                    per_model=getattr(settings, 'BATCH_MODEL_CONCURRENCY', 4),
+                    flush_size=getattr(settings, 'BATCH_FLUSH_SIZE', 20),
+                    call_timeout=getattr(settings, 'BATCH_CALL_TIMEOUT', 60),
+                )
+    return _runner
@@ -0,0 +1,183 @@
+"""
+Compare mode: one prompt answered by several models side by side.
+
+Every model gets its own producer (a thread under WSGI, a task on the event
+loop under ASGI) streaming into one shared queue, tagged with its branch
+index. The response reads that queue and writes a single SSE stream:
+
+    event: start  {"chat_id", "group_id", "models": [...]}
+    data: {"branch": 1, "text": "..."}
+    event: done   {"branch": 1, "model", "message_id", "finish_reason"[, "error"]}
+    event: end    {}
+
+Chunks that arrive within CHAT_SSE_COALESCE_MS are merged per branch.
+Producers keep running and save their branch if the client goes away.
+Each branch is saved as an assistant message sharing the compare group_id;
+branch 0 is the one later turns of the chat continue from. A branch that
+failed before producing any text isn't saved, and its message_id is null.
+"""
+import asyncio
+import queue
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ai import stream_chat_response, astream_chat_response
+from .generations import format_event, track_producer, HEARTBEAT_SECONDS
+
+FINISHED = object()
+
+
+class Branch:
+    __slots__ = ('index', 'model', 'message_id', 'usage', 'parts', 'saved')
+
+    def __init__(self, index, model):
+        self.index = index
+        self.model = model
+        self.message_id = uuid.uuid4()
+        self.usage = {}  # filled by the upstream stream, see stream_chat_response
+        self.parts = []
+        self.saved = False  # set once finalize has saved the message
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+class Compare:
+    def __init__(self, chat_id, models, messages, finalize, on_complete=None):
+        """
+        `finalize(branch)` saves a finished branch and returns whether it saved a
+        message; `on_complete()` runs once every branch has been finalized.
+        """
+        self.chat_id = str(chat_id)
+        self.group_id = uuid.uuid4()
+        self.branches = [Branch(index, model) for index, model in enumerate(models)]
+        self.messages = messages
+        self.finalize = finalize
+        self.on_complete = on_complete
+        self._left = len(self.branches)
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def _branch_finished(self):
+        with self._lock:
+            self._left -= 1
+            last = self._left == 0
+        if last and self.on_complete:
+            self.on_complete()
+
+    # Producers
+
+    def _produce(self, branch):
+        try:
+            for chunk in stream_chat_response(self.messages, branch.model, branch.usage):
+                branch.parts.append(chunk)
+                self._queue.put((branch.index, chunk))
+        finally:
+            try:
+                branch.saved = bool(self.finalize(branch))
+            finally:
+                self._queue.put((branch.index, FINISHED))
+                self._branch_finished()
+                close_old_connections()
+
+    async def _aproduce(self, branch):
+        try:
+            async for chunk in astream_chat_response(self.messages, branch.model, branch.usage):
+                branch.parts.append(chunk)
+                self._queue.put_nowait((branch.index, chunk))
+        finally:
+            try:
+                branch.saved = bool(await sync_to_async(self.finalize, thread_sensitive=True)(branch))
+            finally:
+                self._queue.put_nowait((branch.index, FINISHED))
+                self._branch_finished()
+
+    # Readers
+
+    def events(self):
+        """Start a thread per branch and yield the multiplexed SSE stream."""
+        self._queue = queue.Queue()
+        for branch in self.branches:
+            thread = threading.Thread(target=self._produce, args=(branch,), name='compare-producer', daemon=True)
+            track_producer(thread)
+            thread.start()
+
+        window = getattr(settings, 'CHAT_SSE_COALESCE_MS', 50) / 1000
+        yield self._start_event()
+        running = len(self.branches)
+        while running:
+            try:
+                items = [self._queue.get(timeout=HEARTBEAT_SECONDS)]
+            except queue.Empty:
+                yield b": keep-alive\n\n"
+                continue
+            # Hold briefly so tokens arriving close together go out as one frame
+            time.sleep(window)
+            items += self._drain()
+            running -= sum(1 for _, item in items if item is FINISHED)
+            yield from self._frames(items)
+        yield format_event({}, event="end")
+
+    async def aevents(self):
+        """Async counterpart of events(), with a task per branch on the running loop."""
+        self._queue = asyncio.Queue()
+        for branch in self.branches:
+            track_producer(asyncio.create_task(self._aproduce(branch)))
+
+        window = getattr(settings, 'CHAT_SSE_COALESCE_MS', 50) / 1000
+        yield self._start_event()
+        running = len(self.branches)
+        while running:
+            try:
+                items = [await asyncio.wait_for(self._queue.get(), HEARTBEAT_SECONDS)]
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            await asyncio.sleep(window)
+            items += self._drain()
+            running -= sum(1 for _, item in items if item is FINISHED)
+            for frame in self._frames(items):
+                yield frame
+        yield format_event({}, event="end")
+
+    def _drain(self):
+        items = []
+        try:
+            while True:
+                items.append(self._queue.get_nowait())
+        except (queue.Empty, asyncio.QueueEmpty):
+            return items
+
+    def _start_event(self):
+        return format_event({
+            "chat_id": self.chat_id,
+            "group_id": str(self.group_id),
+            "models": [branch.model for branch in self.branches],
+        }, event="start")
+
+    def _frames(self, items):
+        """SSE frames for queued items, one delta per branch with its text merged."""
+        pending = {}
+        for index, item in items:
+            if item is not FINISHED:
+                pending[index] = pending.get(index, '') + item
+                continue
+            if index in pending:
+                yield format_event({"branch": index, "text": pending.pop(index)})
+            branch = self.branches[index]
+            data = {
+                "branch": index,
+                "model": branch.usage.get('model') or branch.model,
+                "message_id": str(branch.message_id) if branch.saved else None,
+                "finish_reason": branch.usage.get('finish_reason'),
+            }
+            if branch.usage.get('error'):
+                data["error"] = branch.usage['error']
+            yield format_event(data, event="done")
+        for index, text in pending.items():
+            yield format_event({"branch": index, "text": text})
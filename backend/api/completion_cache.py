@@ -0,0 +1,135 @@
+"""
+Opt-in cache of upstream completions for repeated prompts.
+
+Entries are keyed on a normalized hash of (model, messages, params) and
+scoped to a workspace (or a single user for personal chats), so a cached
+answer is only replayed to people who could have seen the original. The
+cache lives in process memory with a TTL and least-recently-used eviction
+bounded by both entry count and total bytes.
+"""
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Size of each piece when a cached answer is replayed as a stream
+REPLAY_CHUNK_CHARS = 32
+
+# Rough per-entry bookkeeping overhead counted against the byte budget
+ENTRY_OVERHEAD = 200
+
+
+def _normalize(text):
+    text = unicodedata.normalize('NFC', text or '')
+    return '\n'.join(line.rstrip() for line in text.replace('\r\n', '\n').split('\n')).strip()
+
+
+def make_key(scope, model, messages, params=None):
+    """Stable key for a completion request within `scope` (e.g. "ws:<id>" or "user:<id>")."""
+    body = json.dumps({
+        "model": (model or '').strip().lower(),
+        "messages": [[m.get("role"), _normalize(m.get("content"))] for m in messages],
+        "params": params or {},
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return f"{scope}:{hashlib.sha256(body.encode()).hexdigest()}"
+
+
+class CachedCompletion:
+    __slots__ = ('text', 'usage', 'expires_at', 'size')
+
+    def __init__(self, text, usage, expires_at):
+        self.text = text
+        self.usage = usage
+        self.expires_at = expires_at
+        self.size = len(text.encode()) + ENTRY_OVERHEAD
+
+
+class CompletionCache:
+    def __init__(self, ttl=3600, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, text, usage=None):
+        entry = CachedCompletion(text, dict(usage or {}), time.monotonic() + self.ttl)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+def replay(text):
+    """Yield a cached answer in stream-sized pieces."""
+    for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+        yield text[i:i + REPLAY_CHUNK_CHARS]
+
+
+async def areplay(text):
+    for chunk in replay(text):
+        yield chunk
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = CompletionCache(
+                    ttl=getattr(settings, 'COMPLETION_CACHE_TTL', 3600),
+                    max_entries=getattr(settings, 'COMPLETION_CACHE_MAX_ENTRIES', 10000),
+                    max_bytes=getattr(settings, 'COMPLETION_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+                )
+    return _default_cache
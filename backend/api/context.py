@@ -0,0 +1,205 @@
+"""
+Context-window assembly for chat completions.
+
+Instead of sending the whole chat history on every turn we read only the
+newest messages that fit the selected model's context window, and optionally
+stand in a cached rolling summary for the older prefix that was dropped.
+"""
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ai import complete_chat
+from .models import Chat, Message
+from .models_service import get_model
+from .tokens import count_text, TOKENS_PER_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_LENGTH = 8000
+
+
+def get_token_budget(model_id):
+    """Tokens available for the prompt, leaving room for the completion."""
+    model = get_model(model_id) or {}
+    context_length = model.get("context_length") or DEFAULT_CONTEXT_LENGTH
+    reserve = getattr(settings, 'CHAT_CONTEXT_COMPLETION_RESERVE', 0.25)
+    return int(context_length * (1 - reserve))
+
+
+def build_context(chat, model_id):
+    """
+    Return the list of {"role", "content"} dicts to send upstream for `chat`.
+    Only the tail that fits the token budget is loaded from the database.
+    """
+    budget = get_token_budget(model_id)
+    max_messages = getattr(settings, 'CHAT_CONTEXT_MAX_MESSAGES', 200)
+
+    # Newest first, only the columns we need, never more than max_messages rows
+    rows = list(
+        Message.objects.filter(chat_id=chat.id, branch=0)
+        .only('role', 'content', 'created_at')
+        .order_by('-created_at')[:max_messages]
+    )
+
+    selected = []
+    used = 0
+    for msg in rows:
+        cost = count_text(msg.content, model_id) + TOKENS_PER_MESSAGE
+        # Always keep the latest message, even if it alone exceeds the budget
+        if selected and used + cost > budget:
+            break
+        selected.append(msg)
+        used += cost
+
+    selected.reverse()
+    messages = [{"role": msg.role, "content": msg.content} for msg in selected]
+
+    truncated = len(selected) < len(rows) or len(rows) == max_messages
+    if truncated and selected:
+        oldest_kept = selected[0].created_at
+        if chat.summary and chat.summary_through and chat.summary_through < oldest_kept:
+            messages.insert(0, {
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{chat.summary}",
+            })
+        if getattr(settings, 'CHAT_CONTEXT_SUMMARIZE', False):
+            if not chat.summary_through or chat.summary_through < oldest_kept:
+                schedule_summary(chat.id, oldest_kept, model_id)
+
+    return messages
+
+
+class SummaryWorker:
+    """
+    Bounded queue of chats to summarize, served by a fixed pool of daemon
+    worker threads (as for titles). A chat is queued at most once at a time,
+    so consecutive turns don't pile up passes, and when the queue is full the
+    pass is skipped; a later turn asks again.
+    """
+
+    def __init__(self, workers=1, max_pending=100):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = set()  # chat ids queued or being summarized
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+        self.summarized = 0
+        self.dropped = 0
+
+    def submit(self, chat_id, cutoff, model_id):
+        self._ensure_started()
+        with self._lock:
+            if chat_id in self._pending:
+                return False
+            self._pending.add(chat_id)
+        try:
+            self._queue.put_nowait((chat_id, cutoff, model_id))
+        except queue.Full:
+            self._done(chat_id)
+            self.dropped += 1
+            return False
+        return True
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "pending": len(self._pending),
+            "summarized": self.summarized,
+            "dropped": self.dropped,
+        }
+
+    def _ensure_started(self):
+        # Re-start after fork (gunicorn preload) since threads don't survive it
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'summary-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self):
+        while True:
+            chat_id, cutoff, model_id = self._queue.get()
+            try:
+                if summarize_prefix(chat_id, cutoff, model_id):
+                    self.summarized += 1
+            finally:
+                self._done(chat_id)
+                close_old_connections()
+
+    def _done(self, chat_id):
+        with self._lock:
+            self._pending.discard(chat_id)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_summary_worker():
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = SummaryWorker(
+                    workers=getattr(settings, 'CHAT_CONTEXT_SUMMARY_WORKERS', 1),
+                    max_pending=getattr(settings, 'CHAT_CONTEXT_SUMMARY_MAX_PENDING', 100),
+                )
+    return _worker
+
+
+def schedule_summary(chat_id, cutoff, model_id):
+    return get_summary_worker().submit(chat_id, cutoff, model_id)
+
+
+def summarize_prefix(chat_id, cutoff, model_id):
+    """
+    Fold the messages older than `cutoff` into the chat's rolling summary.
+    Only messages not already covered by the previous summary are read.
+    Returns True when the summary was updated.
+    """
+    try:
+        chat = Chat.objects.only('id', 'summary', 'summary_through').get(id=chat_id)
+        pending = Message.objects.filter(chat_id=chat_id, branch=0, created_at__lt=cutoff).only('role', 'content', 'created_at')
+        if chat.summary_through:
+            pending = pending.filter(created_at__gt=chat.summary_through)
+
+        # Bound each summarization pass; the next turn picks up where this one stopped
+        batch = list(pending.order_by('created_at')[:getattr(settings, 'CHAT_CONTEXT_MAX_MESSAGES', 200)])
+        if not batch:
+            return False
+
+        transcript = "\n".join(f"{msg.role}: {msg.content}" for msg in batch)
+        prompt = (
+            "Update the running summary of this conversation. Keep facts, decisions and open questions; "
+            "be concise.\n\n"
+            f"Current summary:\n{chat.summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        summary = complete_chat(
+            [{"role": "user", "content": prompt}],
+            getattr(settings, 'CHAT_CONTEXT_SUMMARY_MODEL', None) or model_id,
+        )
+        if not summary:
+            return False
+        Chat.objects.filter(id=chat_id).update(
+            summary=summary.strip(),
+            summary_through=batch[-1].created_at,
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Error summarizing chat {chat_id}: {e}")
+        return False
@@ -0,0 +1,492 @@
+"""
+Bulk export and import of chats, library items and usage logs.
+
+Exports are NDJSON, one record per line tagged with its "type" (chat,
+message, library_item, usage); usage can also be written as Parquet when
+pyarrow is installed. Rows are read with .values().iterator(chunk_size=...)
+(server-side cursors on PostgreSQL) and written out as they are read, so
+memory stays flat however large the workspace is. The same generators back
+the /api/export/<dataset>/ endpoints and the export_data command; under
+ASGI they are driven chunk by chunk through `aiter_chunks`.
+
+The importer (import_data) reads the same files back in batches of
+bulk_create. Per-row save() and signals are skipped: derived fields are set
+here, search documents are built once per batch (or left for
+rebuild_search_index with index_search=False), and usage rollups and budget
+sums are brought up to date once at the end. Chats and messages keep their
+UUIDs and usage logs their request_id, so importing a file twice doesn't
+duplicate them; library items get new ids.
+"""
+import io
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+try:
+    import orjson
+
+    def dumps(record):
+        return orjson.dumps(record, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    def dumps(record):
+        return (json.dumps(record, default=str) + "\n").encode()
+    loads = json.loads
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+DATASETS = ('chats', 'library', 'usage')
+CHUNK_SIZE = 2000
+# Bytes of NDJSON gathered before handing a chunk to the response
+WRITE_SIZE = 64 * 1024
+
+CHAT_FIELDS = ('id', 'user__username', 'workspace_id', 'title', 'summary', 'summary_through', 'created_at', 'updated_at')
+MESSAGE_FIELDS = ('id', 'chat_id', 'role', 'content', 'created_at', 'group_id', 'branch', 'model')
+LIBRARY_FIELDS = ('id', 'user__username', 'title', 'content', 'item_type', 'visibility', 'workspace_id', 'subteam_id',
+                  'original_message_id', 'created_at', 'updated_at')
+USAGE_FIELDS = ('id', 'user__username', 'workspace_id', 'model_name', 'input_tokens', 'output_tokens', 'cost_estimate',
+                'saved_cost', 'cache_status', 'price_version_id', 'request_id', 'timestamp')
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _record(kind, row):
+    record = {"type": kind}
+    for key, value in row.items():
+        record['user' if key == 'user__username' else key] = value
+    return record
+
+
+# Export
+
+def querysets(dataset, user_id=None, workspace_id=None):
+    """
+    Querysets for a dataset, scoped to a workspace, to a user's personal data
+    (workspace_id None), or to everything when neither is given.
+    """
+    from .models import Chat, Message
+    from knowledge_base.models import LibraryItem
+    from analytics.models import UsageLog
+
+    def scope(queryset, user_field='user_id', workspace_field='workspace_id'):
+        if workspace_id:
+            return queryset.filter(**{workspace_field: workspace_id})
+        if user_id:
+            return queryset.filter(**{user_field: user_id, f"{workspace_field}__isnull": True})
+        return queryset
+
+    # order_by() drops default orderings so large tables are read in index/storage order
+    if dataset == 'chats':
+        return {
+            'chat': scope(Chat.objects.order_by()).values(*CHAT_FIELDS),
+            'message': scope(Message.objects.order_by(), 'chat__user_id', 'chat__workspace_id').values(*MESSAGE_FIELDS),
+        }
+    if dataset == 'library':
+        return {'library_item': scope(LibraryItem.objects.order_by()).values(*LIBRARY_FIELDS)}
+    if dataset == 'usage':
+        return {'usage': scope(UsageLog.objects.order_by('id')).values(*USAGE_FIELDS)}
+    raise ExportError(f"Unknown dataset '{dataset}' (expected one of {', '.join(DATASETS)})")
+
+
+def iter_records(dataset, user_id=None, workspace_id=None, chunk_size=CHUNK_SIZE):
+    """Yield export records as dicts; chats come before their messages."""
+    from knowledge_base.models import LibraryItem
+
+    for kind, queryset in querysets(dataset, user_id, workspace_id).items():
+        for rows in _chunks(queryset.iterator(chunk_size=chunk_size), chunk_size):
+            if kind == 'library_item':
+                # Tag names for the whole chunk in one query
+                tags = {}
+                through = LibraryItem.tags.through.objects.filter(libraryitem_id__in=[row['id'] for row in rows])
+                for item_id, name in through.values_list('libraryitem_id', 'tag__name'):
+                    tags.setdefault(item_id, []).append(name)
+                for row in rows:
+                    row['tags'] = tags.get(row['id'], [])
+            for row in rows:
+                yield _record(kind, row)
+
+
+def iter_ndjson(dataset, user_id=None, workspace_id=None, chunk_size=CHUNK_SIZE):
+    """NDJSON bytes, in chunks of about WRITE_SIZE."""
+    buffer = []
+    size = 0
+    for record in iter_records(dataset, user_id, workspace_id, chunk_size):
+        line = dumps(record)
+        buffer.append(line)
+        size += len(line)
+        if size >= WRITE_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def aiter_chunks(chunks):
+    """
+    Yield from a sync chunk generator without collecting it first (Django
+    lists sync streaming content under ASGI). Every step runs on one
+    dedicated thread, which keeps the generator's server-side cursor on the
+    connection that opened it.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+    step = sync_to_async(next, thread_sensitive=False, executor=executor)
+    done = object()
+
+    def close():
+        try:
+            chunks.close()
+        finally:
+            close_old_connections()
+
+    try:
+        while True:
+            chunk = await step(chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(close, thread_sensitive=False, executor=executor)()
+        executor.shutdown(wait=False)
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file that hands what pyarrow wrote so far to the response."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def usage_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('user', pyarrow.string()),
+        ('workspace_id', pyarrow.int64()),
+        ('model_name', pyarrow.string()),
+        ('input_tokens', pyarrow.int64()),
+        ('output_tokens', pyarrow.int64()),
+        ('cost_estimate', pyarrow.decimal128(10, 6)),
+        ('saved_cost', pyarrow.decimal128(10, 6)),
+        ('cache_status', pyarrow.string()),
+        ('price_version_id', pyarrow.int64()),
+        ('request_id', pyarrow.string()),
+        ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+    ])
+
+
+def iter_usage_parquet(user_id=None, workspace_id=None, chunk_size=CHUNK_SIZE * 10):
+    """Usage logs as a Parquet file, one row group per `chunk_size` rows."""
+    if not PARQUET_AVAILABLE:
+        raise ExportError("Parquet export requires pyarrow")
+    schema = usage_schema()
+    queryset = querysets('usage', user_id, workspace_id)['usage']
+    sink = _StreamSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    for rows in _chunks(queryset.iterator(chunk_size=CHUNK_SIZE), chunk_size):
+        columns = {name: [] for name in schema.names}
+        for row in rows:
+            row['request_id'] = row['request_id'] and str(row['request_id'])
+            for key, value in _record('usage', row).items():
+                if key in columns:
+                    columns[key].append(value)
+        writer.write_table(pyarrow.table(columns, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+# Import
+
+def _bulk_create_keeping_timestamps(model, objs, batch_size, **kwargs):
+    """
+    bulk_create, then put back the exported created_at/updated_at that
+    auto_now(_add) replaced with the current time. Done with a bulk_update
+    rather than by switching auto_now off, since the Field objects are shared
+    by every thread in the process.
+    """
+    fields = [field for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    timestamps = [[getattr(obj, field.attname) for field in fields] for obj in objs]
+    model.objects.bulk_create(objs, batch_size=batch_size, **kwargs)
+    if not objs or not fields:
+        return
+    for obj, values in zip(objs, timestamps):
+        for field, value in zip(fields, values):
+            setattr(obj, field.attname, value)
+    model.objects.bulk_update(objs, [field.name for field in fields], batch_size=batch_size)
+
+
+def _datetime(value, default=None):
+    if not value:
+        return default
+    if isinstance(value, str):
+        return parse_datetime(value) or default
+    return value
+
+
+class Importer:
+    """
+    Feed records with add(), then call finish(). `user` assigns every record
+    to that user instead of matching usernames; `workspace_id` moves them
+    into that workspace (records keep their own workspace if it exists otherwise).
+
+    `counts` has the rows actually inserted. Records that can't be placed
+    (unknown user, missing chat) and chats, messages and usage logs already
+    in the database (same id or request_id) are counted in `skipped`, so
+    importing a file twice is safe. Usage logs without a request_id (older
+    than idempotency keys) and library items have no key to match on and
+    are inserted again on every import.
+    """
+    ORDER = ('chat', 'message', 'library_item', 'usage')
+
+    def __init__(self, user=None, workspace_id=None, batch_size=1000, index_search=True):
+        self.user = user
+        self.workspace_id = int(workspace_id) if workspace_id else None
+        self.batch_size = batch_size
+        self.index_search = index_search
+        self.counts = Counter()
+        self.skipped = Counter()
+        self._pending = {kind: [] for kind in self.ORDER}
+        self._user_ids = {}
+        self._workspace_ids = {}
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind not in self._pending:
+            self.skipped['unknown'] += 1
+            return
+        pending = self._pending[kind]
+        pending.append(record)
+        if len(pending) >= self.batch_size:
+            # Parents first so messages find their chats
+            for earlier in self.ORDER[:self.ORDER.index(kind) + 1]:
+                self._flush(earlier)
+
+    def add_lines(self, lines):
+        for line in lines:
+            line = line.strip()
+            if line:
+                self.add(loads(line))
+
+    def finish(self):
+        for kind in self.ORDER:
+            self._flush(kind)
+        if self.counts['usage']:
+            from analytics import budgets, rollups
+            rollups.roll_up_pending()
+            budgets.reset()
+        return dict(self.counts)
+
+    # Lookups, cached for the whole import
+
+    def _user_id(self, record):
+        if self.user is not None:
+            return self.user.id
+        username = record.get('user')
+        if username not in self._user_ids:
+            from django.contrib.auth.models import User
+            self._user_ids[username] = User.objects.filter(username=username).values_list('id', flat=True).first()
+        return self._user_ids[username]
+
+    def _workspace(self, record):
+        if self.workspace_id:
+            return self.workspace_id
+        workspace_id = record.get('workspace_id')
+        if workspace_id and workspace_id not in self._workspace_ids:
+            from teams.models import Workspace
+            self._workspace_ids[workspace_id] = Workspace.objects.filter(id=workspace_id).exists()
+        return workspace_id if workspace_id and self._workspace_ids[workspace_id] else None
+
+    def _new_only(self, kind, model, objs, key):
+        """Drop objects whose `key` is already in the table (or earlier in the batch), counting them as duplicates."""
+        keys = [getattr(obj, key) for obj in objs if getattr(obj, key) is not None]
+        seen = {str(value) for value in model.objects.filter(**{f'{key}__in': keys}).values_list(key, flat=True)}
+        new = []
+        for obj in objs:
+            value = getattr(obj, key)
+            if value is not None:
+                if str(value) in seen:
+                    continue
+                seen.add(str(value))
+            new.append(obj)
+        if len(new) < len(objs):
+            self.skipped[f'duplicate {kind}'] += len(objs) - len(new)
+        return new
+
+    # Batches
+
+    def _flush(self, kind):
+        records = self._pending[kind]
+        if not records:
+            return
+        self._pending[kind] = []
+        with transaction.atomic():
+            getattr(self, f"_import_{kind}")(records)
+
+    def _import_chat(self, records):
+        from .models import Chat
+
+        chats = []
+        for record in records:
+            user_id = self._user_id(record)
+            if user_id is None:
+                self.skipped['chat'] += 1
+                continue
+            created_at = _datetime(record.get('created_at'), timezone.now())
+            chats.append(Chat(
+                id=record['id'], user_id=user_id, workspace_id=self._workspace(record),
+                title=record.get('title') or '', summary=record.get('summary') or '',
+                summary_through=_datetime(record.get('summary_through')),
+                created_at=created_at, updated_at=_datetime(record.get('updated_at'), created_at),
+            ))
+        chats = self._new_only('chat', Chat, chats, 'id')
+        _bulk_create_keeping_timestamps(Chat, chats, self.batch_size, ignore_conflicts=True)
+        self.counts['chat'] += len(chats)
+
+    def _import_message(self, records):
+        from .models import Chat, Message
+
+        chat_ids = {str(chat_id): chat_id for chat_id in Chat.objects.filter(
+            id__in={record['chat_id'] for record in records}).values_list('id', flat=True)}
+        messages = []
+        for record in records:
+            chat_id = chat_ids.get(str(record['chat_id']))
+            if chat_id is None:
+                self.skipped['message'] += 1
+                continue
+            messages.append(Message(
+                id=record['id'], chat_id=chat_id, role=record['role'], content=record.get('content') or '',
+                created_at=_datetime(record.get('created_at'), timezone.now()), group_id=record.get('group_id'),
+                branch=record.get('branch') or 0, model=record.get('model') or '',
+            ))
+        messages = self._new_only('message', Message, messages, 'id')
+        Message.objects.bulk_create(messages, batch_size=self.batch_size, ignore_conflicts=True)
+        if self.index_search:
+            from search import indexing
+            indexing.index_messages(messages)
+        self.counts['message'] += len(messages)
+
+    def _import_library_item(self, records):
+        from .models import Message
+        from knowledge_base.models import LibraryItem, Tag
+        from knowledge_base.prompt_templates import compile_template, variable_names
+
+        message_ids = {str(message_id) for message_id in Message.objects.filter(
+            id__in={record['original_message_id'] for record in records if record.get('original_message_id')}
+        ).values_list('id', flat=True)}
+        items, item_tags = [], []
+        for record in records:
+            user_id = self._user_id(record)
+            if user_id is None:
+                self.skipped['library_item'] += 1
+                continue
+            workspace_id = self._workspace(record)
+            # Sub-teams only carry over when the workspace did
+            subteam_id = record.get('subteam_id') if workspace_id == record.get('workspace_id') else None
+            visibility = record.get('visibility') or 'PRIVATE'
+            compiled = compile_template(record.get('content') or '')
+            created_at = _datetime(record.get('created_at'), timezone.now())
+            original = record.get('original_message_id')
+            items.append(LibraryItem(
+                user_id=user_id, title=record.get('title') or '', content=record.get('content') or '',
+                item_type=record.get('item_type') or 'PROMPT', visibility=visibility,
+                workspace_id=workspace_id, subteam_id=subteam_id,
+                original_message_id=original if original and str(original) in message_ids else None,
+                compiled=compiled, variables=variable_names(compiled),
+                audience=LibraryItem.audience_for(visibility, workspace_id, subteam_id, user_id),
+                created_at=created_at, updated_at=_datetime(record.get('updated_at'), created_at),
+            ))
+            item_tags.append(record.get('tags') or [])
+        _bulk_create_keeping_timestamps(LibraryItem, items, self.batch_size)
+
+        names = {name for tags in item_tags for name in tags}
+        if names:
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+            tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+            Through = LibraryItem.tags.through
+            Through.objects.bulk_create([
+                Through(libraryitem_id=item.id, tag_id=tag_ids[name])
+                for item, tags in zip(items, item_tags) for name in set(tags)
+            ], batch_size=self.batch_size)
+        if self.index_search:
+            from search import indexing
+            from search.models import SearchDocument
+            SearchDocument.objects.bulk_create([indexing.library_document(item) for item in items], batch_size=self.batch_size)
+        self.counts['library_item'] += len(items)
+
+    def _import_usage(self, records):
+        from analytics.models import PriceSnapshot, UsageLog
+
+        version_ids = set(PriceSnapshot.objects.filter(
+            id__in={record['price_version_id'] for record in records if record.get('price_version_id')}
+        ).values_list('id', flat=True))
+        logs = []
+        for record in records:
+            user_id = self._user_id(record)
+            if user_id is None:
+                self.skipped['usage'] += 1
+                continue
+            logs.append(UsageLog(
+                user_id=user_id, workspace_id=self._workspace(record), model_name=record['model_name'],
+                input_tokens=record.get('input_tokens') or 0, output_tokens=record.get('output_tokens') or 0,
+                cost_estimate=Decimal(str(record.get('cost_estimate') or 0)),
+                saved_cost=Decimal(str(record.get('saved_cost') or 0)),
+                cache_status=record.get('cache_status') or 'BYPASS',
+                price_version_id=record.get('price_version_id') if record.get('price_version_id') in version_ids else None,
+                request_id=record.get('request_id') or None,
+                timestamp=_datetime(record.get('timestamp'), timezone.now()),
+            ))
+        logs = self._new_only('usage', UsageLog, logs, 'request_id')
+        UsageLog.objects.bulk_create(logs, batch_size=self.batch_size, ignore_conflicts=True)
+        self.counts['usage'] += len(logs)
+
+
+def import_parquet(path, importer, batch_size=CHUNK_SIZE):
+    """Feed a Parquet usage export to `importer`, one record batch at a time."""
+    if not PARQUET_AVAILABLE:
+        raise ExportError("Parquet import requires pyarrow")
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size):
+        for row in batch.to_pylist():
+            row['type'] = 'usage'
+            importer.add(row)
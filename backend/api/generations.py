@@ -0,0 +1,303 @@
+"""
+Server-side buffers for in-flight generations, and the SSE output mode.
+
+In SSE mode the upstream completion is consumed by a producer that is
+detached from the client connection (a thread under WSGI, a task on the event
+loop under ASGI) and appended to a Generation buffer. The response only reads
+from that buffer, so a client that drops can reconnect to
+/api/chat/stream/<generation_id>/ with Last-Event-ID and continue from the
+offset it last saw, without the model being called again.
+
+Readers coalesce tokens: an event is written once CHAT_SSE_COALESCE_MS has
+passed since new text arrived or CHAT_SSE_COALESCE_CHARS characters are
+pending. Event ids are character offsets into the generated text.
+
+Buffers live in process memory and are dropped CHAT_GENERATION_TTL seconds after
+the generation finishes, so resuming requires reaching the same worker
+process (sticky sessions when running several).
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_right
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+HEARTBEAT_SECONDS = 15
+
+
+class Generation:
+    def __init__(self, user_id, chat_id):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.chat_id = str(chat_id)
+        self.parts = []
+        self.ends = []  # cumulative end offset of each part
+        self.length = 0
+        self.done = False
+        self.finished_at = None
+        self.finish_reason = None
+        self.error = None
+
+        self._cond = threading.Condition()
+        self._waiters = set()  # (loop, asyncio.Event) of async readers
+
+    # Producer side
+
+    def append(self, text):
+        if not text:
+            return
+        with self._cond:
+            self.parts.append(text)
+            self.length += len(text)
+            self.ends.append(self.length)
+            self._cond.notify_all()
+        self._wake_async()
+
+    def finish(self, finish_reason=None, error=None):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self.finish_reason = finish_reason
+            self.error = error
+            self._cond.notify_all()
+        self._wake_async()
+
+    def _wake_async(self):
+        for loop, event in list(self._waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    # Reader side
+
+    def read(self, offset):
+        """Text generated after character `offset`."""
+        with self._cond:
+            if offset >= self.length:
+                return ''
+            i = bisect_right(self.ends, offset)
+            start = self.ends[i - 1] if i else 0
+            return self.parts[i][offset - start:] + ''.join(self.parts[i + 1:])
+
+    def text(self):
+        return self.read(0)
+
+    def wait(self, offset, timeout):
+        """Block until there is text past `offset` or the generation is done."""
+        with self._cond:
+            if self.length <= offset and not self.done:
+                self._cond.wait(timeout)
+            return self.length > offset or self.done
+
+    async def await_data(self, offset, timeout):
+        if self.length > offset or self.done:
+            return True
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        self._waiters.add(waiter)
+        try:
+            if self.length > offset or self.done:
+                return True
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.length > offset or self.done
+        finally:
+            self._waiters.discard(waiter)
+
+
+class GenerationRegistry:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def create(self, user_id, chat_id):
+        generation = Generation(user_id, chat_id)
+        with self._lock:
+            self._evict()
+            self._generations[generation.id] = generation
+        return generation
+
+    def get(self, generation_id):
+        with self._lock:
+            self._evict()
+            return self._generations.get(generation_id)
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.ttl
+        expired = [gid for gid, g in self._generations.items() if g.done and g.finished_at < cutoff]
+        for gid in expired:
+            del self._generations[gid]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = GenerationRegistry(ttl=getattr(settings, 'CHAT_GENERATION_TTL', 300))
+    return _registry
+
+
+# Producers
+
+# Strong references to running producers: keeps ASGI tasks from being garbage
+# collected mid-stream and lets shutdown wait for them (see drain_producers).
+_producers = set()
+_producers_lock = threading.Lock()
+
+
+def track_producer(producer):
+    """Register an asyncio task or a not yet started thread producing a generation."""
+    with _producers_lock:
+        _producers.add(producer)
+    if isinstance(producer, threading.Thread):
+        target = producer.run
+
+        def run():
+            try:
+                target()
+            finally:
+                with _producers_lock:
+                    _producers.discard(producer)
+        producer.run = run
+    else:
+        producer.add_done_callback(lambda task: _producers.discard(task))
+    return producer
+
+
+def active_producers():
+    return len(_producers)
+
+
+def drain_producers(timeout):
+    """Wait up to `timeout` seconds for producer threads to finish. Returns how many are left."""
+    deadline = time.monotonic() + timeout
+    for producer in list(_producers):
+        if isinstance(producer, threading.Thread):
+            producer.join(max(deadline - time.monotonic(), 0))
+    return sum(1 for p in list(_producers) if isinstance(p, threading.Thread) and p.is_alive())
+
+
+async def adrain_producers(timeout):
+    """Wait up to `timeout` seconds for producer tasks on this loop. Returns how many are left."""
+    tasks = [p for p in list(_producers) if isinstance(p, asyncio.Task) and not p.done()]
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+    return sum(1 for task in tasks if not task.done())
+
+
+# SSE formatting
+
+def format_event(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def _start_event(generation):
+    return format_event({"generation_id": generation.id, "chat_id": generation.chat_id}, event="start")
+
+
+def _delta_event(text, offset):
+    return format_event({"text": text}, event_id=offset)
+
+
+def _done_event(generation):
+    data = {"finish_reason": generation.finish_reason, "length": generation.length}
+    if generation.error:
+        data["error"] = generation.error
+    return format_event(data, event="done", event_id=generation.length)
+
+
+def _coalesce_settings():
+    return (
+        getattr(settings, 'CHAT_SSE_COALESCE_MS', 50) / 1000,
+        getattr(settings, 'CHAT_SSE_COALESCE_CHARS', 1024),
+    )
+
+
+def sse_events(generation, offset=0):
+    """Sync SSE writer for a generation, starting after character `offset`."""
+    window, max_chars = _coalesce_settings()
+    yield _start_event(generation)
+    while True:
+        if not generation.wait(offset, HEARTBEAT_SECONDS):
+            yield b": keep-alive\n\n"
+            continue
+        # Hold briefly so tokens arriving close together go out as one frame
+        deadline = time.monotonic() + window
+        while not generation.done and generation.length - offset < max_chars:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            generation.wait(generation.length, remaining)
+        text = generation.read(offset)
+        if text:
+            offset += len(text)
+            yield _delta_event(text, offset)
+        if generation.done and offset >= generation.length:
+            yield _done_event(generation)
+            return
+
+
+async def asse_events(generation, offset=0):
+    """Async counterpart of sse_events."""
+    window, max_chars = _coalesce_settings()
+    yield _start_event(generation)
+    while True:
+        if not await generation.await_data(offset, HEARTBEAT_SECONDS):
+            yield b": keep-alive\n\n"
+            continue
+        deadline = time.monotonic() + window
+        while not generation.done and generation.length - offset < max_chars:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await generation.await_data(generation.length, remaining)
+        text = generation.read(offset)
+        if text:
+            offset += len(text)
+            yield _delta_event(text, offset)
+        if generation.done and offset >= generation.length:
+            yield _done_event(generation)
+            return
+
+
+def parse_offset(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF accept `Accept: text/event-stream`; only error responses are rendered through it."""
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event(data, event='error')
+
+
+def sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
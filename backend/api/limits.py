@@ -0,0 +1,301 @@
+"""
+Admission control for chat_send: rate limits, concurrent streams and budgets.
+
+Each request is checked, before anything is written, against token buckets
+for requests per minute and model tokens per minute, a cap on concurrent
+streams, and the monthly budget of the workspace (or PERSONAL_MONTHLY_BUDGET
+for personal chats). Limits apply per user and per workspace and are set in
+CHAT_RATE_LIMITS; rejected requests get a 429 with Retry-After.
+
+Tokens aren't known until the completion ends, so the token bucket works on
+debt: a request is admitted while the bucket is positive and the tokens it
+actually used are charged afterwards (possibly driving it negative, which then
+holds back the next requests until it refills).
+
+LocalLimiter keeps state in process memory. CacheLimiter keeps it in the
+Django cache so several workers share limits (use Redis/Memcached); it
+serialises updates of a bucket with a short `cache.add` lock.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Concurrency slots expire on their own in case a worker dies without releasing them
+SLOT_TTL = 15 * 60
+
+# How often LocalLimiter drops buckets that have refilled (seconds)
+SWEEP_INTERVAL = 60
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LocalLimiter:
+    """
+    Token buckets and counters in process memory, guarded by one lock.
+
+    A bucket that has refilled to capacity is the same as no bucket, so those
+    are dropped every SWEEP_INTERVAL; memory follows the users active in the
+    last minute or so rather than every user ever seen. Stream slots expire
+    after SLOT_TTL like the cache backend's, since a request cancelled on
+    disconnect under ASGI never gets to release its slot.
+    """
+
+    def __init__(self):
+        self._buckets = {}  # key -> [tokens, updated_at, capacity]
+        self._slots = {}  # key -> acquire times, oldest first
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _refill(self, key, capacity, now):
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._sweep(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(capacity), now, capacity]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * capacity / 60)
+            bucket[1] = now
+            bucket[2] = capacity
+        return bucket
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        full = [key for key, (tokens, updated_at, capacity) in self._buckets.items()
+                if tokens + (now - updated_at) * capacity / 60 >= capacity]
+        for key in full:
+            del self._buckets[key]
+        for key in list(self._slots):
+            self._held(key, now)
+
+    def take(self, key, per_minute, amount=1, check_only=False):
+        """
+        Take `amount` from the bucket. Returns 0 when allowed, otherwise the
+        seconds until it would be. With `check_only`, only require a positive balance.
+        """
+        with self._lock:
+            bucket = self._refill(key, per_minute, time.monotonic())
+            needed = 0 if check_only else min(amount, per_minute)
+            if bucket[0] < needed or bucket[0] <= 0:
+                return (max(needed, 1) - bucket[0]) * 60 / per_minute
+            if not check_only:
+                bucket[0] -= amount
+            return 0
+
+    def charge(self, key, per_minute, amount):
+        """Debit (or refund, if negative) `amount` unconditionally."""
+        with self._lock:
+            bucket = self._refill(key, per_minute, time.monotonic())
+            bucket[0] = min(per_minute, bucket[0] - amount)
+
+    def _held(self, key, now):
+        """Acquire times of the unexpired slots of `key`."""
+        held = [acquired for acquired in self._slots.get(key, ()) if now - acquired < SLOT_TTL]
+        if held:
+            self._slots[key] = held
+        else:
+            self._slots.pop(key, None)
+        return held
+
+    def acquire(self, key, limit):
+        with self._lock:
+            now = time.monotonic()
+            held = self._held(key, now)
+            if len(held) >= limit:
+                return False
+            self._slots[key] = held + [now]
+            return True
+
+    def release(self, key):
+        with self._lock:
+            held = self._held(key, time.monotonic())
+            if held:
+                held.pop(0)
+                if not held:
+                    del self._slots[key]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {"buckets": len(self._buckets), "active_streams": sum(len(self._held(key, now)) for key in list(self._slots))}
+
+
+class CacheLimiter:
+    """Same buckets in the Django cache, shared by every worker using it."""
+
+    LOCK_TIMEOUT = 2
+
+    def __init__(self, prefix='ratelimit'):
+        self.prefix = prefix
+
+    def _locked(self, key, fn):
+        lock_key = f"{self.prefix}:lock:{key}"
+        # The lock holds a token so we only ever delete a lock we own
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + 0.5
+        while not cache.add(lock_key, token, self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                # Lock holder died or the cache is overloaded: fail open rather than block the request
+                logger.warning(f"Rate limit lock timeout for {key}")
+                token = None
+                break
+            time.sleep(0.005)
+        try:
+            return fn()
+        finally:
+            # get + delete isn't atomic; that only matters if our lock expires in between
+            if token is not None and cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    def _update(self, key, per_minute, change):
+        def update():
+            now = time.time()
+            tokens, updated_at = cache.get(f"{self.prefix}:bucket:{key}") or (float(per_minute), now)
+            tokens = min(per_minute, tokens + max(now - updated_at, 0) * per_minute / 60)
+            tokens, result = change(tokens)
+            cache.set(f"{self.prefix}:bucket:{key}", (tokens, now), 120 + int(max(-tokens, 0) * 60 / per_minute))
+            return result
+        return self._locked(key, update)
+
+    def take(self, key, per_minute, amount=1, check_only=False):
+        def change(tokens):
+            needed = 0 if check_only else min(amount, per_minute)
+            if tokens < needed or tokens <= 0:
+                return tokens, (max(needed, 1) - tokens) * 60 / per_minute
+            return (tokens if check_only else tokens - amount), 0
+        return self._update(key, per_minute, change)
+
+    def charge(self, key, per_minute, amount):
+        self._update(key, per_minute, lambda tokens: (min(per_minute, tokens - amount), None))
+
+    def acquire(self, key, limit):
+        slot_key = f"{self.prefix}:slots:{key}"
+        cache.add(slot_key, 0, SLOT_TTL)
+        try:
+            count = cache.incr(slot_key)
+        except ValueError:
+            # Expired between add and incr
+            cache.add(slot_key, 1, SLOT_TTL)
+            count = 1
+        if count > limit:
+            self.release(key)
+            return False
+        cache.touch(slot_key, SLOT_TTL)
+        return True
+
+    def release(self, key):
+        try:
+            cache.decr(f"{self.prefix}:slots:{key}")
+        except ValueError:
+            pass
+
+    def stats(self):
+        return {}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = import_string(getattr(settings, 'CHAT_RATE_LIMIT_BACKEND', 'api.limits.LocalLimiter'))()
+    return _limiter
+
+
+def _limits(scope):
+    return (getattr(settings, 'CHAT_RATE_LIMITS', {}) or {}).get(scope) or {}
+
+
+class Admission:
+    """
+    Slots and buckets held by one admitted request. Call `charge_tokens()`
+    once usage is known and `release()` when the stream ends (idempotent).
+    """
+
+    def __init__(self, limiter, scopes):
+        self.limiter = limiter
+        self.scopes = scopes  # [(key, limits)]
+        self.slots = []
+        self.released = False
+
+    def charge_tokens(self, tokens):
+        for key, limits in self.scopes:
+            if limits.get('tokens_per_minute') and tokens:
+                self.limiter.charge(f"{key}:tokens", limits['tokens_per_minute'], tokens)
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        for key in self.slots:
+            self.limiter.release(key)
+
+
+def admit(user_id, workspace_id):
+    """
+    Check budget, request rate, token rate and concurrency for a chat request.
+    Returns an Admission or raises RateLimited. Nothing is held on rejection.
+    """
+    from analytics.budgets import remaining_budget, month_start
+    remaining = remaining_budget(workspace_id, user_id)
+    if remaining is not None and remaining <= 0:
+        now = timezone.now()
+        next_month = (month_start(now) + timedelta(days=32)).replace(day=1)
+        raise RateLimited(
+            "Monthly budget exhausted" if workspace_id else "Monthly personal budget exhausted",
+            (next_month - now).total_seconds(),
+        )
+
+    limiter = get_limiter()
+    scopes = [(f"user:{user_id}", _limits('user'))]
+    if workspace_id:
+        scopes.append((f"ws:{workspace_id}", _limits('workspace')))
+    admission = Admission(limiter, scopes)
+
+    taken = []
+    try:
+        for key, limits in scopes:
+            label = "workspace" if key.startswith('ws:') else "user"
+            if limits.get('requests_per_minute'):
+                wait = limiter.take(f"{key}:requests", limits['requests_per_minute'])
+                if wait:
+                    raise RateLimited(f"Too many requests for this {label}, slow down", wait)
+                taken.append((f"{key}:requests", limits['requests_per_minute']))
+            if limits.get('tokens_per_minute'):
+                wait = limiter.take(f"{key}:tokens", limits['tokens_per_minute'], check_only=True)
+                if wait:
+                    raise RateLimited(f"Token rate limit reached for this {label}", wait)
+        for key, limits in scopes:
+            if limits.get('concurrent_streams'):
+                if not limiter.acquire(f"{key}:streams", limits['concurrent_streams']):
+                    label = "workspace" if key.startswith('ws:') else "user"
+                    raise RateLimited(f"Too many responses in progress for this {label}", 1)
+                admission.slots.append(f"{key}:streams")
+    except RateLimited:
+        # Give back what this request took so a rejection doesn't count against later ones
+        for bucket_key, per_minute in taken:
+            limiter.charge(bucket_key, per_minute, -1)
+        admission.release()
+        raise
+    return admission
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds))) if seconds else None
@@ -0,0 +1,89 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction, OperationalError
+
+from analytics.models import UsageLog
+from api.models import Chat, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent chat writes (user message, assistant message, usage log per turn) "
+        "against the configured database, with optional concurrent readers. Compare configurations "
+        "by re-running with different settings, e.g. SQLITE_WAL=False, or POSTGRES_DB=... set."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--turns', type=int, default=200, help="Chat turns per writer thread")
+        parser.add_argument('--readers', type=int, default=2, help="Threads listing chats while writers run")
+
+    def handle(self, *args, **options):
+        db = connection.settings_dict
+        self.stdout.write(f"Database:      {connection.vendor} {db['NAME']} {db.get('OPTIONS') or ''}")
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.stdout.write(f"Journal mode:  {cursor.fetchone()[0]}")
+
+        user = User.objects.create_user(f"bench-db-{uuid.uuid4().hex[:8]}")
+        chats = [Chat.objects.create(user=user, title=f"bench {i}") for i in range(options['threads'])]
+        latencies, errors, reads = [], [], [0]
+        stop = threading.Event()
+
+        def writer(chat):
+            try:
+                for i in range(options['turns']):
+                    start = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            Message.objects.create(chat=chat, role='user', content=f"question {i} " * 20)
+                        with transaction.atomic():
+                            Message.objects.create(chat=chat, role='assistant', content=f"answer {i} " * 80)
+                            UsageLog.objects.create(user=user, model_name='bench/model', input_tokens=100,
+                                                    output_tokens=400, cost_estimate=0)
+                    except OperationalError as e:
+                        errors.append(str(e))
+                        continue
+                    latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                connections.close_all()
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    list(Chat.objects.filter(user=user).order_by('-updated_at')[:50])
+                    list(Message.objects.filter(chat=chats[0]).order_by('-created_at')[:50])
+                    reads[0] += 1
+            except OperationalError as e:
+                errors.append(str(e))
+            finally:
+                connections.close_all()
+
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        writers = [threading.Thread(target=writer, args=(chat,)) for chat in chats]
+        start = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+        try:
+            turns = len(latencies)
+            self.stdout.write(f"Writers:       {options['threads']} x {options['turns']} turns, {options['readers']} readers")
+            self.stdout.write(f"Wall time:     {elapsed:.2f}s ({turns / elapsed:.1f} turns/s, {reads[0] / elapsed:.1f} reads/s)")
+            self.stdout.write(f"Errors:        {len(errors)}{f' (first: {errors[0]})' if errors else ''}")
+            if len(latencies) > 1:
+                q = statistics.quantiles(latencies, n=100)
+                self.stdout.write(f"Turn latency:  p50 {q[49]:.1f}ms  p95 {q[94]:.1f}ms  p99 {q[98]:.1f}ms")
+        finally:
+            user.delete()
@@ -0,0 +1,109 @@
+import json
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.sse import SSEDecoder, ContentEvent
+
+
+def synthesize_stream(size_bytes, seed=0):
+    """A recorded-style OpenRouter stream of roughly `size_bytes`, with keep-alive comments and a usage chunk."""
+    rng = random.Random(seed)
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(400)]
+    parts = [b": OPENROUTER PROCESSING\n\n"]
+    total = 0
+    i = 0
+    while total < size_bytes:
+        text = ' '.join(rng.choices(words, k=rng.randint(1, 4))) + rng.choice([' ', '\n', '. ', ', "q" '])
+        chunk = {
+            "id": "gen-bench", "provider": "bench", "model": "bench/model", "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}],
+        }
+        line = f"data: {json.dumps(chunk)}\n\n".encode()
+        parts.append(line)
+        total += len(line)
+        i += 1
+        if i % 500 == 0:
+            parts.append(b": OPENROUTER PROCESSING\n\n")
+    final = {
+        "id": "gen-bench", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": i, "total_tokens": 10 + i},
+    }
+    parts.append(f"data: {json.dumps(final)}\n\n".encode())
+    parts.append(b"data: [DONE]\n\n")
+    return b''.join(parts), i
+
+
+def legacy_parse(pieces):
+    """The previous path: decode every line, json.loads every chunk, += accumulation."""
+    buffer = b''
+    full_response = ""
+    for piece in pieces:
+        buffer += piece
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            line = line.decode('utf-8')
+            if not line.startswith('data: '):
+                continue
+            if line == 'data: [DONE]':
+                return full_response
+            try:
+                chunk = json.loads(line[6:])
+            except json.JSONDecodeError:
+                continue
+            content = chunk['choices'][0]['delta'].get('content', '')
+            if content:
+                full_response += content
+    return full_response
+
+
+def decoder_parse(pieces):
+    decoder = SSEDecoder()
+    parts = []
+    for piece in pieces:
+        for event in decoder.feed(piece):
+            if type(event) is ContentEvent:
+                parts.append(event.text)
+    decoder.close()
+    return ''.join(parts)
+
+
+class Command(BaseCommand):
+    help = "Benchmark SSE decoding of a large completion stream (per-chunk overhead, old vs new parser)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help="Raw recorded SSE body to replay (default: synthesize one)")
+        parser.add_argument('--size-mb', type=float, default=4)
+        parser.add_argument('--read-size', type=int, default=1400, help="Bytes per simulated socket read")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['file']:
+            with open(options['file'], 'rb') as f:
+                body = f.read()
+            chunks = body.count(b'\ndata: ') + body.startswith(b'data: ')
+        else:
+            body, chunks = synthesize_stream(int(options['size_mb'] * 1024 * 1024))
+
+        size = options['read_size']
+        pieces = [body[i:i + size] for i in range(0, len(body), size)]
+        self.stdout.write(f"{len(body) / 1024 / 1024:.1f} MB, {chunks} chunks, {len(pieces)} reads of {size} bytes")
+
+        results = {}
+        for name, parse in (("legacy", legacy_parse), ("decoder", decoder_parse)):
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                text = parse(pieces)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = text
+            self.stdout.write(
+                f"{name:<8} {best * 1000:8.1f} ms total  {best * 1e6 / max(chunks, 1):6.2f} us/chunk  "
+                f"{len(body) / best / 1024 / 1024:7.1f} MB/s"
+            )
+        if results["legacy"] != results["decoder"]:
+            self.stderr.write("Parsers disagree on the decoded text")
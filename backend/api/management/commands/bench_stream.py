@@ -0,0 +1,62 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import ai, upstream
+
+
+class Command(BaseCommand):
+    help = "Load benchmark for the async streaming engine (run against fake_openrouter)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8765/api/v1')
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ai.OPENROUTER_URL = f"{options['base_url'].rstrip('/')}/chat/completions"
+        results = asyncio.run(self.run(options['concurrency'], options['requests']))
+        elapsed, first_byte, totals, errors = results
+
+        self.stdout.write(f"Requests:      {options['requests']} (concurrency {options['concurrency']})")
+        self.stdout.write(f"Errors:        {errors}")
+        self.stdout.write(f"Wall time:     {elapsed:.2f}s ({options['requests'] / elapsed:.1f} streams/s)")
+        if first_byte:
+            self.stdout.write(f"First chunk:   p50 {self.pct(first_byte, 50):.1f}ms  p95 {self.pct(first_byte, 95):.1f}ms")
+            self.stdout.write(f"Full stream:   p50 {self.pct(totals, 50):.1f}ms  p95 {self.pct(totals, 95):.1f}ms")
+
+    async def run(self, concurrency, total):
+        semaphore = asyncio.Semaphore(concurrency)
+        first_byte, totals = [], []
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                first = None
+                usage = {}
+                async for chunk in ai.astream_chat_response([{"role": "user", "content": "ping"}], "fake/model", usage):
+                    if first is None:
+                        first = time.perf_counter()
+                if usage.get('error'):
+                    errors += 1
+                    return
+                end = time.perf_counter()
+                if first is not None:
+                    first_byte.append((first - start) * 1000)
+                    totals.append((end - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        await upstream.get_async_client().aclose()
+        return elapsed, first_byte, totals, errors
+
+    @staticmethod
+    def pct(values, p):
+        if len(values) < 2:
+            return values[0]
+        return statistics.quantiles(values, n=100)[p - 1]
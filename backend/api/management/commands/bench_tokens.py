@@ -0,0 +1,39 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import tokens
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark for token counting (per-message cost per tokenizer family)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--length', type=int, default=800, help="Characters per message")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(500)]
+        messages = []
+        for _ in range(options['messages']):
+            text = ''
+            while len(text) < options['length']:
+                text += rng.choice(words) + rng.choice([' ', ' ', ', ', '. '])
+            messages.append({"role": "user", "content": text})
+
+        for model in ["openai/gpt-4o", "anthropic/claude-3.5-sonnet"]:
+            family = tokens.get_family(model)
+            loaded = tokens.get_encoder(family) is not None
+
+            start = time.perf_counter()
+            total = sum(tokens.count_text(m["content"], model) for m in messages)
+            elapsed = time.perf_counter() - start
+
+            per_message_ms = elapsed * 1000 / len(messages)
+            self.stdout.write(
+                f"{model:<32} {family:<12} {'tiktoken' if loaded else 'estimate':<9} "
+                f"{total:>9} tokens  {per_message_ms:.4f} ms/message"
+            )
@@ -0,0 +1,50 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream chats, library items or usage logs to NDJSON (usage also to Parquet), "
+        "for everything or one workspace/user. Read back with import_data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=exports.DATASETS)
+        parser.add_argument('--output', '-o', default='-', help="File to write (default: stdout)")
+        parser.add_argument('--format', choices=['ndjson', 'parquet'], default='ndjson')
+        parser.add_argument('--workspace', type=int, help="Only this workspace")
+        parser.add_argument('--user', help="Only this user's personal (non-workspace) data")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            user_id = User.objects.filter(username=options['user']).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f"Unknown user '{options['user']}'")
+
+        try:
+            if options['format'] == 'parquet':
+                if options['dataset'] != 'usage':
+                    raise CommandError("Parquet is only available for usage")
+                chunks = exports.iter_usage_parquet(user_id, options['workspace'])
+            else:
+                chunks = exports.iter_ndjson(options['dataset'], user_id, options['workspace'], options['chunk_size'])
+
+            out = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+            written = 0
+            try:
+                for chunk in chunks:
+                    out.write(chunk)
+                    written += len(chunk)
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+        except exports.ExportError as e:
+            raise CommandError(str(e))
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
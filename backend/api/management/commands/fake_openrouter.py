@@ -0,0 +1,167 @@
+import asyncio
+import collections
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local fake OpenRouter server that streams SSE completions (for load testing), "
+        "optionally injecting upstream failures to exercise retries, fallbacks and the circuit breaker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--tokens', type=int, default=50, help="Content chunks per completion")
+        parser.add_argument('--delay', type=float, default=0.02, help="Seconds between chunks")
+        # Failure injection
+        parser.add_argument('--fail-rate', type=float, default=0, help="Fraction of completions answered with --fail-status")
+        parser.add_argument('--fail-status', type=int, default=503)
+        parser.add_argument('--fail-models', default='', help="Comma-separated model ids that always fail")
+        parser.add_argument('--retry-after', type=float, help="Retry-After seconds sent with failures")
+        parser.add_argument('--drop-after', type=int, help="Close the connection after this many chunks")
+        parser.add_argument('--error-after', type=int, help="Send an in-stream error event after this many chunks")
+        parser.add_argument('--first-byte-delay', type=float, default=0, help="Seconds before the response starts")
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        self.tokens = options['tokens']
+        self.delay = options['delay']
+        self.fail_rate = options['fail_rate']
+        self.fail_status = options['fail_status']
+        self.fail_models = {m for m in options['fail_models'].split(',') if m}
+        self.retry_after = options['retry_after']
+        self.drop_after = options['drop_after']
+        self.error_after = options['error_after']
+        self.first_byte_delay = options['first_byte_delay']
+        self.rng = random.Random(options['seed'])
+        self.requests_by_model = collections.Counter()
+        self.stdout.write(
+            f"Fake OpenRouter listening on http://{options['host']}:{options['port']}\n"
+            f"Point the backend at it with OPENROUTER_BASE_URL=http://{options['host']}:{options['port']}/api/v1"
+        )
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive and chunked responses
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'POST' and path.endswith('/chat/completions'):
+                    data = json.loads(body or b'{}')
+                    model = data.get('model', 'fake/model')
+                    self.requests_by_model[model] += 1
+                    if self.first_byte_delay:
+                        await asyncio.sleep(self.first_byte_delay)
+                    if model in self.fail_models or self.rng.random() < self.fail_rate:
+                        await self.fail(writer, model)
+                    elif data.get('stream'):
+                        if not await self.stream_completion(writer, data):
+                            break
+                    else:
+                        await self.complete(writer, data)
+                elif method == 'GET' and path.endswith('/models'):
+                    payload = json.dumps({"data": []}).encode()
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                        b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload
+                    )
+                    await writer.drain()
+                else:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def fail(self, writer, model):
+        payload = json.dumps({"error": {"message": f"Fake upstream failure for {model}", "code": self.fail_status}}).encode()
+        retry_after = f"Retry-After: {self.retry_after:g}\r\n".encode() if self.retry_after is not None else b""
+        writer.write(
+            f"HTTP/1.1 {self.fail_status} Fake Failure\r\nContent-Type: application/json\r\n".encode()
+            + retry_after + b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload
+        )
+        await writer.drain()
+
+    async def complete(self, writer, data):
+        content = "".join(f"tok{i} " for i in range(self.tokens)).strip()
+        payload = json.dumps({
+            "id": "gen-fake",
+            "model": data.get('model', 'fake/model'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": self.tokens * 2, "total_tokens": 10 + self.tokens * 2},
+        }).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload
+        )
+        await writer.drain()
+
+    async def stream_completion(self, writer, data):
+        """Stream one completion; returns False if the connection was dropped on purpose."""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        created = int(time.time())
+        model = data.get('model', 'fake/model')
+        for i in range(self.tokens):
+            if self.drop_after is not None and i == self.drop_after:
+                return False
+            if self.error_after is not None and i == self.error_after:
+                error = {"error": {"message": "Fake mid-stream failure", "code": 502}}
+                self.write_chunk(writer, f"data: {json.dumps(error)}\n\n".encode())
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+                return True
+            chunk = {
+                "id": "gen-fake",
+                "model": model,
+                "created": created,
+                "choices": [{"index": 0, "delta": {"content": f"tok{i} "}, "finish_reason": None}],
+            }
+            self.write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        if data.get('usage', {}).get('include'):
+            usage = {
+                "id": "gen-fake",
+                "model": model,
+                "created": created,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": self.tokens * 2, "total_tokens": 10 + self.tokens * 2},
+            }
+            self.write_chunk(writer, f"data: {json.dumps(usage)}\n\n".encode())
+        self.write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    def write_chunk(self, writer, data):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
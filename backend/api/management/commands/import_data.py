@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Load an export_data file (NDJSON, or Parquet usage) with batched bulk inserts. "
+        "Search documents are built per batch unless --no-search-index (then run rebuild_search_index)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON or .parquet file, or - for NDJSON on stdin")
+        parser.add_argument('--user', help="Assign every record to this user instead of matching usernames")
+        parser.add_argument('--workspace', type=int, help="Import into this workspace")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-search-index', action='store_true', help="Skip search indexing during the import")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Unknown user '{options['user']}'")
+
+        importer = exports.Importer(
+            user=user, workspace_id=options['workspace'], batch_size=options['batch_size'],
+            index_search=not options['no_search_index'],
+        )
+        start = time.perf_counter()
+        try:
+            if options['path'].endswith('.parquet'):
+                exports.import_parquet(options['path'], importer, options['batch_size'])
+            elif options['path'] == '-':
+                importer.add_lines(sys.stdin.buffer)
+            else:
+                with open(options['path'], 'rb') as lines:
+                    importer.add_lines(lines)
+            counts = importer.finish()
+        except exports.ExportError as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - start
+        summary = ", ".join(f"{count} {kind}" for kind, count in counts.items()) or "nothing"
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary} in {elapsed:.1f}s"))
+        if importer.skipped:
+            self.stdout.write(self.style.WARNING(
+                "Skipped (unknown user, missing chat or already imported): " + ", ".join(f"{n} {k}" for k, n in importer.skipped.items())
+            ))
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test a running server with concurrent chat_send streams and report throughput and "
+        "latency per concurrency level. Reproducible setup:\n"
+        "  manage.py fake_openrouter --port 8765 --tokens 40 --delay 0.02\n"
+        "  OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 CHAT_USER_REQUESTS_PER_MINUTE=0 \\\n"
+        "    CHAT_USER_CONCURRENT_STREAMS=0 CHAT_USER_TOKENS_PER_MINUTE=0 GUNICORN_WORKERS=1 \\\n"
+        "    gunicorn -c gunicorn.conf.py\n"
+        "  manage.py load_chat_streams --levels 50,200,800 --cores 1"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--username', default='loadtest')
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--levels', default='50,200,800', help="Comma-separated concurrency levels")
+        parser.add_argument('--requests', type=int, default=0, help="Streams per level (default: 3x the level)")
+        parser.add_argument('--sse', action='store_true', help="Use the SSE output mode")
+        parser.add_argument('--cores', type=int, default=os.cpu_count(), help="CPU cores given to the server")
+        parser.add_argument('--slo-ms', type=float, default=1000, help="p95 time-to-first-byte target")
+
+    def handle(self, *args, **options):
+        # The server shares this database, so the load user can be created directly
+        if not User.objects.filter(username=options['username']).exists():
+            User.objects.create_user(options['username'], password=options['password'])
+
+        self.stdout.write(f"{'streams':>8} {'ok':>6} {'errors':>6} {'streams/s':>10} "
+                          f"{'ttfb p50':>9} {'ttfb p95':>9} {'total p95':>10} {'per core':>9}")
+        best = None
+        for level in [int(x) for x in options['levels'].split(',') if x]:
+            total = options['requests'] or level * 3
+            ok, errors, elapsed, first_byte, totals = asyncio.run(self.run(options, level, total))
+            ttfb95 = self.pct(first_byte, 95)
+            self.stdout.write(
+                f"{level:>8} {ok:>6} {errors:>6} {ok / elapsed:>10.1f} {self.pct(first_byte, 50):>7.0f}ms "
+                f"{ttfb95:>7.0f}ms {self.pct(totals, 95):>8.0f}ms {level / options['cores']:>9.0f}"
+            )
+            if not errors and ttfb95 <= options['slo_ms']:
+                best = level
+        if best:
+            self.stdout.write(self.style.SUCCESS(
+                f"Sustained {best} concurrent streams ({best / options['cores']:.0f} per core) "
+                f"within a {options['slo_ms']:.0f}ms p95 first byte"
+            ))
+        else:
+            self.stdout.write(self.style.WARNING("No level met the first-byte target without errors"))
+
+    async def run(self, options, concurrency, total):
+        semaphore = asyncio.Semaphore(concurrency)
+        first_byte, totals = [], []
+        ok = errors = 0
+        url = f"{options['url'].rstrip('/')}/api/chat/send/" + ('?stream=sse' if options['sse'] else '')
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(10, read=120)) as client:
+            # Log in once: basic auth would hash the password on every request and dominate the results
+            login = await client.post(f"{options['url'].rstrip('/')}/api/auth/login/",
+                                      json={"username": options['username'], "password": options['password']})
+            login.raise_for_status()
+            client.headers['X-CSRFToken'] = client.cookies.get('csrftoken', '')
+
+            async def one(i):
+                nonlocal ok, errors
+                async with semaphore:
+                    start = time.perf_counter()
+                    first = None
+                    try:
+                        async with client.stream('POST', url, json={"content": f"load test message {i}"}) as response:
+                            if response.status_code != 200:
+                                errors += 1
+                                return
+                            async for chunk in response.aiter_bytes():
+                                if first is None and chunk:
+                                    first = time.perf_counter()
+                    except httpx.HTTPError:
+                        errors += 1
+                        return
+                    ok += 1
+                    end = time.perf_counter()
+                    first_byte.append(((first or end) - start) * 1000)
+                    totals.append((end - start) * 1000)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(total)))
+            elapsed = time.perf_counter() - start
+        return ok, errors, elapsed, first_byte, totals
+
+    @staticmethod
+    def pct(values, p):
+        if len(values) < 2:
+            return values[0] if values else 0
+        return statistics.quantiles(values, n=100)[p - 1]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_message_created_at_default'),
+        ('teams', '0002_alter_workspace_slug'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', 'workspace', 'updated_at'], name='api_chat_user_id_33981a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['workspace', 'updated_at'], name='api_chat_workspa_1bdce2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'created_at'], name='api_message_chat_id_a6af35_idx'),
+        ),
+    ]
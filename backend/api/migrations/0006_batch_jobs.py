@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:33
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_chat_message_indexes'),
+        ('knowledge_base', '0004_compiled_templates'),
+        ('teams', '0003_workspace_monthly_budget'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('prompt', models.TextField()),
+                ('model_names', models.JSONField(default=list)),
+                ('inputs', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batch_jobs', to='knowledge_base.libraryitem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_jobs', to=settings.AUTH_USER_MODEL)),
+                ('workspace', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batch_jobs', to='teams.workspace')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BatchResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_index', models.PositiveIntegerField()),
+                ('model', models.CharField(max_length=100)),
+                ('prompt', models.TextField()),
+                ('output', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('input_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('cost_estimate', models.DecimalField(decimal_places=6, default=0, max_digits=10)),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='api.batchjob')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='batchjob',
+            index=models.Index(fields=['user', 'workspace', '-created_at'], name='api_batchjo_user_id_cb536c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batchresult',
+            index=models.Index(fields=['job', 'input_index', 'model'], name='api_batchre_job_id_e70d7a_idx'),
+        ),
+    ]
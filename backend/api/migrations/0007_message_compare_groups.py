@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_batch_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='branch',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='group_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='model',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,122 @@
+"""
+In-memory index over the model catalog for /api/models/ filtering.
+
+Built once per catalog snapshot (keyed by its etag) so requests only do
+integer bit operations and bisects: every capability is a bitset over the
+catalog positions, and prices / context lengths are kept sorted with prefix
+bitsets so `max_price` and `min_context` resolve to a single AND.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+
+CAPABILITIES = ("vision", "fast", "code", "free")
+
+# Fields returned in listings; raw pricing is only included on request
+LIST_FIELDS = ("id", "name", "description", "context_length", "capabilities")
+
+SORTS = ("name", "context", "price")
+
+
+def prompt_price(model):
+    """USD per 1M prompt tokens, or None when the catalog has no pricing for the model."""
+    pricing = model.get("pricing") or {}
+    try:
+        return float(pricing["prompt"]) * 1_000_000
+    except (KeyError, TypeError, ValueError):
+        if (model.get("capabilities") or {}).get("free"):
+            return 0.0
+        return None
+
+
+class ModelIndex:
+    def __init__(self, models, etag=None):
+        self.etag = etag
+        self.models = models
+        self.by_id = {m["id"]: i for i, m in enumerate(models)}
+        self.all = (1 << len(models)) - 1
+
+        self.capabilities = {cap: 0 for cap in CAPABILITIES}
+        for i, model in enumerate(models):
+            caps = model.get("capabilities") or {}
+            for cap in CAPABILITIES:
+                if caps.get(cap):
+                    self.capabilities[cap] |= 1 << i
+
+        self.listing = [{key: m.get(key) for key in LIST_FIELDS} for m in models]
+        self.search_text = [
+            f"{m.get('id', '')} {m.get('name', '')} {m.get('description', '')}".lower() for m in models
+        ]
+
+        # Models with known pricing, cheapest first; price_masks[k] = the k cheapest
+        priced = sorted((p, i) for i, m in enumerate(models) if (p := prompt_price(m)) is not None)
+        self.prices = [p for p, _ in priced]
+        self.price_masks = self._prefix_masks(i for _, i in priced)
+
+        # Largest context first; context_masks[k] = the k largest windows
+        by_context = sorted(((m.get("context_length") or 0, i) for i, m in enumerate(models)), reverse=True)
+        self.contexts = [-c for c, _ in by_context]  # negated so it's ascending for bisect
+        self.context_masks = self._prefix_masks(i for _, i in by_context)
+
+        self.orders = {
+            "name": sorted(range(len(models)), key=lambda i: (models[i].get("name") or "").lower()),
+            "context": [i for _, i in by_context],
+            "price": [i for _, i in priced] + [i for i, m in enumerate(models) if prompt_price(m) is None],
+        }
+
+    @staticmethod
+    def _prefix_masks(positions):
+        masks = [0]
+        for i in positions:
+            masks.append(masks[-1] | (1 << i))
+        return masks
+
+    def get(self, model_id):
+        i = self.by_id.get(model_id)
+        return self.models[i] if i is not None else None
+
+    def filter(self, capabilities=(), max_price=None, min_context=None, q=None):
+        """Return the bitset of models matching every given condition."""
+        mask = self.all
+        for cap in capabilities:
+            mask &= self.capabilities.get(cap, 0)
+        if max_price is not None:
+            mask &= self.price_masks[bisect_right(self.prices, max_price)]
+        if min_context is not None:
+            mask &= self.context_masks[bisect_right(self.contexts, -min_context)]
+        if q:
+            terms = q.lower().split()
+            for i, text in enumerate(self.search_text):
+                if mask >> i & 1 and not all(term in text for term in terms):
+                    mask &= ~(1 << i)
+        return mask
+
+    def query(self, capabilities=(), max_price=None, min_context=None, q=None, sort=None,
+              offset=0, limit=None, include_pricing=False):
+        """Filter, sort and page the catalog. Returns (rows, total_matches)."""
+        mask = self.filter(capabilities, max_price, min_context, q)
+        order = self.orders.get(sort) or range(len(self.models))
+        matched = [i for i in order if mask >> i & 1]
+        end = None if limit is None else offset + limit
+        rows = []
+        for i in matched[offset:end]:
+            row = dict(self.listing[i])
+            if include_pricing:
+                row["pricing"] = self.models[i].get("pricing", {})
+            rows.append(row)
+        return rows, len(matched)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(snapshot):
+    """Index for a catalog snapshot, rebuilt only when the snapshot's etag changes."""
+    global _index
+    index = _index
+    if index is not None and index.etag == snapshot.get("etag"):
+        return index
+    with _index_lock:
+        if _index is None or _index.etag != snapshot.get("etag"):
+            _index = ModelIndex(snapshot["models"], snapshot.get("etag"))
+        return _index
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 class Chat(models.Model):
@@ -7,9 +8,19 @@ class Chat(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chats')
     workspace = models.ForeignKey('teams.Workspace', on_delete=models.SET_NULL, null=True, blank=True, related_name='chats')
     title = models.CharField(max_length=255, blank=True)
+    # Rolling summary of the history that no longer fits in the model context window
+    summary = models.TextField(blank=True)
+    summary_through = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Sidebar listings (personal and workspace), paginated by updated_at
+            models.Index(fields=['user', 'workspace', 'updated_at']),
+            models.Index(fields=['workspace', 'updated_at']),
+        ]
+
     def __str__(self):
         return self.title or str(self.id)
 
@@ -23,10 +34,73 @@ class Message(models.Model):
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: imports and write-behind replays keep the time the message was produced
+    created_at = models.DateTimeField(default=timezone.now)
+    # Compare mode (api.compare): replies to the same prompt share a group, one branch per model.
+    # Only branch 0 is part of the conversation sent upstream on later turns.
+    group_id = models.UUIDField(null=True, blank=True)
+    branch = models.PositiveSmallIntegerField(default=0)
+    model = models.CharField(max_length=100, blank=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['chat', 'created_at']),
+        ]
 
     def __str__(self):
         return f"{self.role}: {self.content[:50]}"
+
+
+class BatchJob(models.Model):
+    """A prompt (or library template) run over many variable sets and/or models (see api.batches)."""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+        ('CANCELLED', 'Cancelled'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='batch_jobs')
+    workspace = models.ForeignKey('teams.Workspace', on_delete=models.SET_NULL, null=True, blank=True, related_name='batch_jobs')
+    template = models.ForeignKey('knowledge_base.LibraryItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='batch_jobs')
+    # The prompt as submitted (template content at submission time)
+    prompt = models.TextField()
+    model_names = models.JSONField(default=list)
+    inputs = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    error = models.TextField(blank=True)
+    total = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'workspace', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"Batch {self.id} ({self.status})"
+
+
+class BatchResult(models.Model):
+    job = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='results')
+    input_index = models.PositiveIntegerField()
+    model = models.CharField(max_length=100)
+    prompt = models.TextField()
+    output = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    input_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    cost_estimate = models.DecimalField(max_digits=10, decimal_places=6, default=0)
+    latency_ms = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['job', 'input_index', 'model']),
+        ]
@@ -1,15 +1,29 @@
-import requests
 import os
+import json
+import time
+import random
+import hashlib
+import threading
+from pathlib import Path
 from typing import List, Dict, Optional
+from django.conf import settings
 from django.core.cache import cache
 import logging
 
+from . import upstream
+
 logger = logging.getLogger(__name__)
 
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
-CACHE_KEY = "openrouter_models"
-CACHE_TTL = 3600  # 1 hour
+OPENROUTER_MODELS_URL = f"{upstream.OPENROUTER_BASE_URL}/models"
+CACHE_KEY = "openrouter_models:snapshot"
+CACHE_TTL = 3600  # 1 hour until a background refresh is due
+CACHE_TTL_JITTER = 0.1  # +/-10% so processes don't all refresh at once
+SNAPSHOT_MAX_AGE = 7 * 24 * 3600  # stale snapshots are still served for up to a week
+REFRESH_LOCK_KEY = "openrouter_models:refresh"
+REFRESH_LOCK_TTL = 30
+FAILURE_BACKOFF_BASE = 30  # seconds, doubled per consecutive failure
+FAILURE_BACKOFF_MAX = 900
+FALLBACK_ERROR = "Failed to fetch latest models from OpenRouter. Using cached model list."
 
 # Fallback models list in case API fails
 DEFAULT_MODELS = [
@@ -125,50 +139,178 @@ def format_model_data(model: Dict) -> Dict:
     }
 
 
+def fetch_openrouter_models() -> List[Dict]:
+    """Fetch and format the catalog from OpenRouter. Raises on failure."""
+    logger.info("Fetching models from OpenRouter API")
+    response = upstream.get_session().get(
+        OPENROUTER_MODELS_URL, headers=upstream.headers(), timeout=(upstream.connect_timeout(), 10),
+    )
+    upstream.check_status(response.status_code, response.headers, response.text if response.status_code >= 400 else '')
+    
+    data = response.json()
+    models_data = data.get("data", [])
+    
+    # Format models
+    formatted_models = [format_model_data(model) for model in models_data]
+    
+    # Filter out models without proper ID or name
+    formatted_models = [m for m in formatted_models if m.get("id") and m.get("name")]
+    if not formatted_models:
+        raise ValueError("OpenRouter returned an empty model list")
+    
+    logger.info(f"Successfully fetched {len(formatted_models)} models from OpenRouter")
+    return formatted_models
+
+
+# Catalog snapshot
+#
+# The last good catalog is kept in process memory, the Django cache and a JSON
+# file on disk (for cold starts). Requests are always answered from the
+# snapshot; once it is older than its jittered TTL a single background refresh
+# is started. Failed refreshes are remembered with exponential backoff so an
+# upstream outage costs one timeout per backoff window, not one per request.
+
+_snapshot = None
+_refresh_lock = threading.Lock()
+
+
+def _jittered(seconds: float) -> float:
+    return seconds * random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)
+
+
+def _etag(models: List[Dict]) -> str:
+    body = json.dumps(models, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha1(body).hexdigest()
+
+
+def _snapshot_path() -> Path:
+    return Path(getattr(settings, 'MODEL_CATALOG_SNAPSHOT_PATH', settings.BASE_DIR / 'var' / 'openrouter_models.json'))
+
+
+def _load_snapshot() -> Optional[Dict]:
+    global _snapshot
+    if _snapshot is not None:
+        return _snapshot
+
+    snapshot = cache.get(CACHE_KEY)
+    if snapshot is None:
+        try:
+            with open(_snapshot_path(), encoding='utf-8') as f:
+                snapshot = json.load(f)
+            logger.info("Loaded OpenRouter model snapshot from disk")
+        except (OSError, ValueError):
+            return None
+    _snapshot = snapshot
+    return snapshot
+
+
+def _store_snapshot(snapshot: Dict, persist: bool = True) -> None:
+    global _snapshot
+    _snapshot = snapshot
+    cache.set(CACHE_KEY, snapshot, SNAPSHOT_MAX_AGE)
+    if not persist:
+        return
+    path = _snapshot_path()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not persist model snapshot: {e}")
+
+
+def _is_fresh(snapshot: Dict) -> bool:
+    return time.time() < snapshot.get("fresh_until", 0)
+
+
+def refresh_catalog() -> Dict:
+    """Fetch the catalog now and store the resulting snapshot (good or negative)."""
+    previous = _load_snapshot()
+    now = time.time()
+    try:
+        models = fetch_openrouter_models()
+    except Exception as e:
+        logger.error(f"Failed to fetch OpenRouter models: {str(e)}")
+        failures = (previous or {}).get("failures", 0) + 1
+        backoff = min(FAILURE_BACKOFF_BASE * 2 ** (failures - 1), FAILURE_BACKOFF_MAX)
+        snapshot = {
+            # Keep serving the last good catalog; fall back to the static list only if there is none
+            "models": previous["models"] if previous and not previous.get("fallback") else DEFAULT_MODELS,
+            "fallback": not previous or previous.get("fallback", True),
+            "etag": (previous or {}).get("etag") or _etag(DEFAULT_MODELS),
+            "fetched_at": (previous or {}).get("fetched_at"),
+            "fresh_until": now + _jittered(backoff),
+            "failures": failures,
+        }
+        # Negative results only live in memory/cache; the disk copy stays the last good one
+        _store_snapshot(snapshot, persist=False)
+        return snapshot
+
+    snapshot = {
+        "models": models,
+        "fallback": False,
+        "etag": _etag(models),
+        "fetched_at": now,
+        "fresh_until": now + _jittered(CACHE_TTL),
+        "failures": 0,
+    }
+    _store_snapshot(snapshot)
+    return snapshot
+
+
+def _refresh_in_background() -> None:
+    # Single flight: one refresh per process, and one across processes sharing the cache
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    if not cache.add(REFRESH_LOCK_KEY, True, REFRESH_LOCK_TTL):
+        _refresh_lock.release()
+        return
+
+    def run():
+        try:
+            refresh_catalog()
+        finally:
+            cache.delete(REFRESH_LOCK_KEY)
+            _refresh_lock.release()
+
+    threading.Thread(target=run, name='model-catalog-refresh', daemon=True).start()
+
+
+def get_catalog() -> Dict:
+    """
+    Return the current catalog snapshot without waiting on the upstream,
+    except on a completely cold start (no memory, cache or disk copy).
+    """
+    global _snapshot
+    snapshot = _load_snapshot()
+    if snapshot is None:
+        with _refresh_lock:
+            snapshot = _load_snapshot()
+            if snapshot is None:
+                snapshot = refresh_catalog()
+        return snapshot
+
+    # Pick up a refresh done by another process
+    shared = cache.get(CACHE_KEY)
+    if shared is not None and shared.get("fresh_until", 0) > snapshot.get("fresh_until", 0):
+        _snapshot = snapshot = shared
+
+    if not _is_fresh(snapshot):
+        _refresh_in_background()
+    return snapshot
+
+
 def get_openrouter_models(use_cache: bool = True) -> Optional[List[Dict]]:
     """
     Fetch available models from OpenRouter API.
     Returns None if API fails, allowing caller to use fallback.
     """
-    # Check cache first
-    if use_cache:
-        cached_models = cache.get(CACHE_KEY)
-        if cached_models:
-            logger.info("Returning cached OpenRouter models")
-            return cached_models
-    
-    # Fetch from API
-    try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-        }
-        
-        logger.info("Fetching models from OpenRouter API")
-        response = requests.get(OPENROUTER_MODELS_URL, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        models_data = data.get("data", [])
-        
-        # Format models
-        formatted_models = [format_model_data(model) for model in models_data]
-        
-        # Filter out models without proper ID or name
-        formatted_models = [m for m in formatted_models if m.get("id") and m.get("name")]
-        
-        # Cache the results
-        cache.set(CACHE_KEY, formatted_models, CACHE_TTL)
-        
-        logger.info(f"Successfully fetched {len(formatted_models)} models from OpenRouter")
-        return formatted_models
-        
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch OpenRouter models: {str(e)}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error fetching OpenRouter models: {str(e)}")
+    snapshot = get_catalog() if use_cache else refresh_catalog()
+    if snapshot.get("fallback"):
         return None
+    return snapshot["models"]
 
 
 def get_models_with_fallback() -> tuple[List[Dict], Optional[str]]:
@@ -181,7 +323,17 @@ def get_models_with_fallback() -> tuple[List[Dict], Optional[str]]:
     
     if models is None:
         logger.warning("Using fallback model list")
-        error_msg = "Failed to fetch latest models from OpenRouter. Using cached model list."
-        return DEFAULT_MODELS, error_msg
+        return DEFAULT_MODELS, FALLBACK_ERROR
     
     return models, None
+
+
+def get_model_index():
+    """Filterable index over the current catalog (see api.model_index)."""
+    from .model_index import get_index
+    return get_index(get_catalog())
+
+
+def get_model(model_id: str) -> Optional[Dict]:
+    """Look up a single model entry (live catalog or fallback list) by id."""
+    return get_model_index().get(model_id)
@@ -0,0 +1,44 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ChatCursorPagination(CursorPagination):
+    """Keyset pagination for the chat sidebar, most recently active first."""
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+    ordering = ('-updated_at', '-id')
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a chat's messages, newest first. The "next" page
+    holds older messages; views reverse each page back to chronological order.
+    """
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+
+class LibraryCursorPagination(CursorPagination):
+    """Keyset pagination for the prompt library, newest first."""
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+
+class BatchJobCursorPagination(CursorPagination):
+    """Keyset pagination for a user's batch jobs, newest first."""
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+
+class BatchResultCursorPagination(CursorPagination):
+    """Keyset pagination over a batch job's results, in input order."""
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    ordering = ('input_index', 'id')
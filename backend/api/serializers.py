@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Chat, Message
+from .models import Chat, Message, BatchJob, BatchResult
 from knowledge_base.models import LibraryItem
 
 class UserSerializer(serializers.ModelSerializer):
@@ -13,9 +13,13 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ['id', 'role', 'content', 'created_at', 'is_saved']
+        fields = ['id', 'role', 'content', 'created_at', 'is_saved', 'group_id', 'branch', 'model']
 
     def get_is_saved(self, obj):
+        # Views resolve saved ids for the whole page in one query (see saved_message_ids)
+        saved_ids = self.context.get('saved_message_ids')
+        if saved_ids is not None:
+            return obj.id in saved_ids
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return LibraryItem.objects.filter(original_message=obj, user=request.user).exists()
@@ -27,3 +31,46 @@ class ChatSerializer(serializers.ModelSerializer):
     class Meta:
         model = Chat
         fields = ['id', 'title', 'created_at', 'updated_at', 'messages']
+
+class ChatDetailSerializer(serializers.ModelSerializer):
+    """Chat with one window of messages, passed in by the view as context['messages']."""
+    messages = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'title', 'created_at', 'updated_at', 'messages']
+
+    def get_messages(self, obj):
+        return MessageSerializer(self.context['messages'], many=True, context=self.context).data
+
+class ChatListSerializer(serializers.ModelSerializer):
+    """Sidebar entry: no nested messages, just a preview annotated by the queryset."""
+    last_message = serializers.CharField(read_only=True, default='')
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'title', 'created_at', 'updated_at', 'last_message']
+
+class BatchJobSerializer(serializers.ModelSerializer):
+    models = serializers.ListField(source='model_names', read_only=True)
+
+    class Meta:
+        model = BatchJob
+        fields = ['id', 'template', 'prompt', 'models', 'status', 'error', 'total', 'completed', 'failed',
+                  'created_at', 'started_at', 'finished_at']
+
+class BatchResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BatchResult
+        fields = ['input_index', 'model', 'prompt', 'output', 'error', 'input_tokens', 'output_tokens',
+                  'cost_estimate', 'latency_ms', 'created_at']
+
+
+def saved_message_ids(user, chat):
+    """Ids of the chat's messages the user has starred into their library, in one query."""
+    if not user.is_authenticated:
+        return set()
+    return set(
+        LibraryItem.objects.filter(user=user, original_message__chat_id=chat.id)
+        .values_list('original_message_id', flat=True)
+    )
@@ -0,0 +1,128 @@
+"""
+Incremental decoder for the upstream's server-sent event stream.
+
+Bytes are fed in as they arrive from the socket and split into lines at the
+bytes level, so nothing is decoded to str except the JSON payloads
+themselves. Each OpenRouter chunk is turned into typed events: content
+deltas, the finish reason, the usage block, mid-stream errors and the final
+[DONE] marker.
+"""
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.JSONDecoder().decode
+
+
+class ContentEvent:
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FinishEvent:
+    __slots__ = ('reason',)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+class UsageEvent:
+    __slots__ = ('usage',)
+
+    def __init__(self, usage):
+        self.usage = usage
+
+
+class ErrorEvent:
+    __slots__ = ('message', 'code')
+
+    def __init__(self, message, code=None):
+        self.message = message
+        self.code = code
+
+
+class DoneEvent:
+    __slots__ = ()
+
+
+DONE = DoneEvent()
+
+
+class SSEDecoder:
+    """Feed raw bytes with `feed()`; call `close()` at end of stream for any trailing event."""
+
+    def __init__(self):
+        self._buffer = b''
+        self._data = []
+
+    def feed(self, chunk):
+        events = []
+        if self._buffer:
+            chunk = self._buffer + chunk
+        lines = chunk.split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._line(line, events)
+        return events
+
+    def close(self):
+        events = []
+        if self._buffer:
+            self._line(self._buffer, events)
+            self._buffer = b''
+        self._dispatch(events)
+        return events
+
+    def _line(self, line, events):
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        if not line:
+            self._dispatch(events)
+        elif line.startswith(b'data:'):
+            value = line[5:]
+            self._data.append(value[1:] if value.startswith(b' ') else value)
+        # Comments (": OPENROUTER PROCESSING" keep-alives) and other fields are ignored
+
+    def _dispatch(self, events):
+        if not self._data:
+            return
+        payload = self._data[0] if len(self._data) == 1 else b'\n'.join(self._data)
+        self._data = []
+        if payload == b'[DONE]':
+            events.append(DONE)
+            return
+        try:
+            chunk = _loads(payload)
+        except ValueError:
+            return
+        if not isinstance(chunk, dict):
+            return
+        decode_chunk(chunk, events)
+
+
+def decode_chunk(chunk, events):
+    """Append the events carried by one decoded completion chunk."""
+    error = chunk.get('error')
+    if error:
+        if isinstance(error, dict):
+            events.append(ErrorEvent(error.get('message') or 'Upstream error', error.get('code')))
+        else:
+            events.append(ErrorEvent(str(error)))
+        return
+
+    choices = chunk.get('choices')
+    if choices:
+        choice = choices[0]
+        delta = choice.get('delta')
+        if delta:
+            content = delta.get('content')
+            if content:
+                events.append(ContentEvent(content))
+        if choice.get('finish_reason'):
+            events.append(FinishEvent(choice['finish_reason']))
+
+    if chunk.get('usage'):
+        events.append(UsageEvent(chunk['usage']))
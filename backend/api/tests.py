@@ -1,3 +1,1304 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from urllib.parse import urlencode
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from knowledge_base.models import LibraryItem
+from teams.models import Workspace, WorkspaceMember
+
+from .ai import astream_chat_response, get_async_client, stream_chat_response
+from .batches import BatchRunner, Call
+from .compare import FINISHED, Compare
+from .completion_cache import CompletionCache
+from .context import DEFAULT_CONTEXT_LENGTH, SummaryWorker, build_context, get_token_budget, summarize_prefix
+from .exports import Importer
+from .generations import get_registry
+from .limits import SLOT_TTL, SWEEP_INTERVAL, CacheLimiter, LocalLimiter, RateLimited, admit
+from .model_index import ModelIndex
+from .models import BatchJob, Chat, Message
+from .pagination import ChatCursorPagination
+from .sse import DONE, ErrorEvent, SSEDecoder
+from .titles import InProcessTitleBackend, generate_titles
+from . import completion_cache, models_service, tokens
+from .upstream import RetryPlan, Trial, UpstreamError, get_breaker
+from .writebehind import WriteBehindQueue, objects_flushed
+
+
+def sse_response(*texts):
+    """An OpenRouter-style event stream sending `texts` as content deltas, one event per read."""
+    async def events():
+        for text in texts:
+            yield f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+    return httpx.Response(200, content=events())
+
+
+def upstream_client(handler):
+    """An async client whose requests are answered by `handler(request)` instead of the network."""
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+# Small context windows so trimming shows with short histories
+TEST_MODELS = [
+    {"id": "test/small", "name": "Small", "context_length": 100, "capabilities": {"fast": True},
+     "pricing": {"prompt": "0.000001", "completion": "0.000002"}},
+    {"id": "test/large", "name": "Large", "context_length": 1000, "capabilities": {"code": True, "vision": True},
+     "pricing": {"prompt": "0.00001", "completion": "0.00003"}},
+    {"id": "test/free", "name": "Free", "context_length": 400, "capabilities": {"free": True}},
+]
+
+
+def catalog_snapshot(models=TEST_MODELS, etag='test-catalog'):
+    """A model catalog snapshot fresh for the whole test, so get_catalog() never calls OpenRouter."""
+    return {"models": models, "fallback": False, "etag": etag, "fetched_at": time.time(),
+            "fresh_until": time.time() + 24 * 3600, "failures": 0}
+
+
+class OfflineMixin:
+    """
+    Answers the model catalog from TEST_MODELS instead of fetching it from
+    OpenRouter, and counts tokens with the estimator instead of downloading
+    tiktoken's BPE files, so counts don't depend on the network.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (mock.patch('api.models_service._snapshot', catalog_snapshot()),
+                        mock.patch('api.tokens.get_encoder', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class AsyncChatSendTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('async', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Chat')
+        Message.objects.create(chat=self.chat, role='user', content='earlier question')
+        Message.objects.create(chat=self.chat, role='assistant', content='earlier answer')
+
+    async def test_asgi_send_streams_through_the_async_client(self):
+        requests = []
+
+        def handler(request):
+            requests.append(json.loads(request.content))
+            return sse_response('Hello', ' world')
+
+        client = upstream_client(handler)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with mock.patch('api.ai.get_async_client', return_value=client), \
+                mock.patch('analytics.pricing.get_price_table') as prices, \
+                mock.patch('api.views.save_later'):
+            prices.return_value.cost.return_value = 0
+            prices.return_value.version = None
+            response = await self.async_client.post('/api/chat/send/', {'chatId': str(self.chat.id), 'content': 'hello',
+                                                                        'model': 'test/async'},
+                                                    content_type='application/json')
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        await client.aclose()
+
+        self.assertEqual(body, b'Hello world')
+        self.assertEqual(requests[0]['model'], 'test/async')
+        self.assertTrue(requests[0]['stream'])
+        self.assertEqual(requests[0]['messages'][-1], {'role': 'user', 'content': 'hello'})
+        reply = await Message.objects.filter(chat=self.chat, role='assistant').order_by('-created_at').afirst()
+        self.assertEqual(reply.content, 'Hello world')
+
+    async def test_client_is_shared_within_an_event_loop(self):
+        client = get_async_client()
+        self.assertIs(get_async_client(), client)
+        await client.aclose()
+        self.assertIsNot(get_async_client(), client)
+        await get_async_client().aclose()
+
+
+# Above the kernel's pid_max, so never a live process
+DEAD_PID = 4194305
+
+
+class WriteBehindReplayTests(TestCase):
+    def test_orphaned_spools_are_replayed_once(self):
+        from analytics.models import UsageLog
+        user = User.objects.create_user('spooled', password='pw')
+        with tempfile.TemporaryDirectory() as spool_dir:
+            queue = WriteBehindQueue(spool_dir)
+            record = queue._serialize(UsageLog(user=user, model_name='test/spool', input_tokens=7))
+            # A worker died with the log unflushed; a second copy of its spool was restored next to it
+            for pid in (DEAD_PID, DEAD_PID + 1):
+                Path(spool_dir, f"spool-{pid}.jsonl").write_text(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+
+            queue._pid = os.getpid()
+            queue._spool_path = Path(spool_dir, f"spool-{queue._pid}.jsonl")
+            queue._spool = open(queue._spool_path, 'a', encoding='utf-8')
+            try:
+                queue._replay_orphaned_spools()
+                replayed = [queue._queue.get_nowait() for _ in range(queue._queue.qsize())]
+                queue._insert(replayed)
+            finally:
+                queue._spool.close()
+
+            self.assertEqual(len(replayed), 2)
+            self.assertEqual(sorted(path.name for path in Path(spool_dir).iterdir()), [queue._spool_path.name])
+        logs = UsageLog.objects.filter(model_name='test/spool')
+        self.assertEqual(logs.count(), 1)
+        self.assertEqual(logs.get().input_tokens, 7)
+
+    def test_spool_left_by_a_process_with_our_pid_is_replayed_at_start(self):
+        from analytics.models import UsageLog
+        user = User.objects.create_user('restarted', password='pw')
+        with tempfile.TemporaryDirectory() as spool_dir:
+            def started():
+                queue = WriteBehindQueue(spool_dir)
+                # Keep the rows queued for the test's thread to insert
+                with mock.patch.object(queue, '_run'):
+                    queue.start()
+                self.addCleanup(queue._spool.close)
+                self.addCleanup(queue._unflushed.clear)  # nothing for the atexit flush to wait on
+                return queue
+
+            live = started()
+            live.enqueue(UsageLog(user=user, model_name='test/live', input_tokens=1))
+            # The container restarted and this process got the pid of the one that crashed
+            record = json.dumps(live._serialize(UsageLog(user=user, model_name='test/crashed', input_tokens=3)))
+            for name in (f"spool-{os.getpid()}.jsonl", f"spool-{os.getpid()}-0123456789ab.jsonl"):
+                Path(spool_dir, name).write_text(record + '\n', encoding='utf-8')
+
+            queue = started()
+            replayed = [queue._queue.get_nowait() for _ in range(queue._queue.qsize())]
+            self.assertEqual([r['fields']['model_name'] for r in replayed], ['test/crashed', 'test/crashed'])
+            # The live worker's spool is left alone; the leftovers are gone, not adopted
+            self.assertEqual(sorted(path.name for path in Path(spool_dir).iterdir()),
+                             sorted([live._spool_path.name, queue._spool_path.name]))
+            self.assertEqual(len(live._spool_path.read_text().splitlines()), 1)
+            self.assertEqual(len(queue._spool_path.read_text().splitlines()), 2)
+
+            queue._insert(replayed)
+            queue._commit(replayed)
+            self.assertEqual(queue._spool_path.read_text(), '')
+        self.assertEqual(UsageLog.objects.filter(model_name='test/crashed').count(), 1)
+
+
+class ChatQueryCountTests(TestCase):
+    """The sidebar and chat views stay at a fixed number of queries however much history there is."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('history', password='pw')
+        self.client.force_login(self.user)
+
+    def make_chats(self, count, messages):
+        Chat.objects.filter(user=self.user).delete()
+        for i in range(count):
+            chat = Chat.objects.create(user=self.user, title=f'Chat {i}')
+            Message.objects.bulk_create([
+                Message(chat=chat, role='user' if j % 2 == 0 else 'assistant', content=f'message {j}')
+                for j in range(messages)
+            ])
+        return chat
+
+    def test_chat_history_queries(self):
+        for count in (2, 60):
+            with self.subTest(chats=count):
+                self.make_chats(count, messages=count // 2)
+                # session, user, chats with their last-message preview
+                with self.assertNumQueries(3):
+                    response = self.client.get('/api/chat/history/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), min(count, ChatCursorPagination.page_size))
+                self.assertTrue(all(chat['last_message'] for chat in response.json()['results']))
+
+    def test_get_chat_queries(self):
+        for size in (2, 30):
+            with self.subTest(messages=size):
+                chat = self.make_chats(1, messages=size)
+                saved = Message.objects.filter(chat=chat).order_by('-created_at')[:2]
+                for message in saved:
+                    LibraryItem.objects.create(user=self.user, title='Saved', content=message.content, original_message=message)
+                # session, user, chat, message window, saved message ids
+                with self.assertNumQueries(5):
+                    response = self.client.get(f'/api/chat/{chat.id}/')
+                self.assertEqual(response.status_code, 200)
+                flags = {m['id']: m['is_saved'] for m in response.json()['messages']}
+                self.assertEqual(sum(flags.values()), 2)
+                self.assertTrue(all(flags[str(message.id)] for message in saved))
+
+
+class GenerationResumeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('resumer', password='pw')
+        self.client.force_login(self.user)
+        self.generation = get_registry().create(self.user.id, 'chat')
+        for part in ('Hello', ', ', 'world'):
+            self.generation.append(part)
+        self.generation.finish('stop')
+
+    def test_reconnect_continues_after_last_event_id(self):
+        response = self.client.get(f'/api/chat/stream/{self.generation.id}/', HTTP_LAST_EVENT_ID='5')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+
+        # The rest of the text in one coalesced event, ids being character offsets
+        self.assertIn('id: 12\ndata: {"text": ", world"}\n\n', body)
+        self.assertNotIn('Hello', body)
+        self.assertIn('event: done\ndata: {"finish_reason": "stop", "length": 12}', body)
+
+    def test_other_users_cannot_resume(self):
+        other = User.objects.create_user('other', password='pw')
+        self.client.force_login(other)
+        response = self.client.get(f'/api/chat/stream/{self.generation.id}/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(UPSTREAM_MAX_RETRIES=1, UPSTREAM_BACKOFF_BASE=0,
+                   UPSTREAM_FALLBACK_MODELS={'test/flaky': ['test/steady']})
+class UpstreamFallbackTests(SimpleTestCase):
+    async def test_retries_then_falls_back_before_the_first_byte(self):
+        tried = []
+
+        def handler(request):
+            model = json.loads(request.content)['model']
+            tried.append(model)
+            if model == 'test/flaky':
+                return httpx.Response(503, text='overloaded')
+            return sse_response('from ', 'fallback')
+
+        client = upstream_client(handler)
+        usage = {}
+        with mock.patch('api.ai.get_async_client', return_value=client):
+            text = ''.join([chunk async for chunk in astream_chat_response(
+                [{"role": "user", "content": "hi"}], 'test/flaky', usage)])
+        await client.aclose()
+
+        self.assertEqual(text, 'from fallback')
+        self.assertEqual(tried, ['test/flaky', 'test/flaky', 'test/steady'])
+        self.assertEqual(usage['model'], 'test/steady')
+        self.assertNotIn('error', usage)
+        self.assertEqual(get_breaker('test/flaky').failures, 2)
+
+
+@override_settings(CHAT_RATE_LIMITS={'user': {'requests_per_minute': 2, 'concurrent_streams': 1}})
+class ChatGatewayLimitTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('limited', password='pw')
+        self.client.force_login(self.user)
+        limiter = mock.patch('api.limits._limiter', LocalLimiter())
+        limiter.start()
+        self.addCleanup(limiter.stop)
+
+    def test_request_rate_is_rejected_with_retry_after(self):
+        admit(self.user.id, None).release()
+        admit(self.user.id, None).release()
+        response = self.client.post('/api/chat/send/', {'content': 'hello', 'model': 'test/limited'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        # One request refills every 30 seconds at 2 per minute
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(response.json()['retry_after'], 30)
+        # Rejected before anything was written
+        self.assertFalse(Chat.objects.exists())
+        self.assertFalse(Message.objects.exists())
+
+    def test_concurrent_streams_are_capped_until_released(self):
+        held = admit(self.user.id, None)
+        with self.assertRaises(RateLimited):
+            admit(self.user.id, None)
+        held.release()
+        admit(self.user.id, None).release()
+
+
+@override_settings(WRITE_BEHIND_ENABLED=False)
+class BatchRunTests(OfflineMixin, TestCase):
+    def test_job_runs_every_input_on_every_model(self):
+        from analytics.models import UsageLog
+        user = User.objects.create_user('batcher', password='pw')
+        job = BatchJob.objects.create(user=user, prompt='Summarize {{text}}', model_names=['test/a', 'test/b'], total=4)
+        calls = [Call(index, model, f'Summarize {text}')
+                 for index, text in enumerate(['one', 'two']) for model in job.model_names]
+
+        def complete(messages, model, timeout=None, usage=None):
+            return f"{model} on {messages[0]['content']}"
+
+        with mock.patch('api.batches.complete_chat', side_effect=complete), \
+                mock.patch('analytics.pricing.get_price_table') as prices, \
+                mock.patch('api.batches.close_old_connections'):
+            prices.return_value.cost.return_value = 0
+            prices.return_value.version = None
+            BatchRunner(workers=2, per_model=1)._run(job, calls, admission=None)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'COMPLETED')
+        self.assertEqual((job.completed, job.failed), (4, 0))
+        self.assertEqual(set(job.results.values_list('input_index', 'model', 'output')), {
+            (0, 'test/a', 'test/a on Summarize one'), (0, 'test/b', 'test/b on Summarize one'),
+            (1, 'test/a', 'test/a on Summarize two'), (1, 'test/b', 'test/b on Summarize two'),
+        })
+        self.assertEqual(UsageLog.objects.filter(user=user).count(), 4)
+
+
+class ExportImportTests(TestCase):
+    def test_chats_round_trip_through_ndjson(self):
+        user = User.objects.create_user('exporter', password='pw')
+        chat = Chat.objects.create(user=user, title='Exported')
+        Message.objects.create(chat=chat, role='user', content='question')
+        Message.objects.create(chat=chat, role='assistant', content='answer')
+        original = list(Message.objects.filter(chat=chat).order_by('created_at').values_list('id', 'role', 'content', 'created_at'))
+
+        self.client.force_login(user)
+        response = self.client.get('/api/export/chats/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(Counter(json.loads(line)['type'] for line in lines), {'chat': 1, 'message': 2})
+
+        Chat.objects.all().delete()
+        importer = Importer(index_search=False)
+        importer.add_lines(lines)
+        self.assertEqual(importer.finish(), {'chat': 1, 'message': 2})
+
+        restored = Chat.objects.get(id=chat.id)
+        self.assertEqual((restored.user, restored.title, restored.created_at), (user, 'Exported', chat.created_at))
+        self.assertEqual(list(restored.messages.order_by('created_at').values_list('id', 'role', 'content', 'created_at')), original)
+
+
+@override_settings(BATCH_PROGRESS_INTERVAL=0.01)
+class BatchStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('batch', password='pw')
+        self.job = BatchJob.objects.create(user=self.user, prompt='hi', model_names=['m/a'], total=4,
+                                           status='RUNNING', completed=1)
+
+    async def test_asgi_stream_sends_progress_before_job_finishes(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(f'/api/batches/{self.job.id}/stream/')
+        self.assertEqual(response.status_code, 200)
+        events = aiter(response.streaming_content)
+
+        first = await anext(events)
+        self.assertIn(b'event: progress', first)
+        self.assertIn(b'"completed": 1', first)
+
+        await BatchJob.objects.filter(id=self.job.id).aupdate(status='COMPLETED', completed=4, finished_at=timezone.now())
+        rest = b''.join([chunk async for chunk in events])
+        self.assertIn(b'"completed": 4', rest)
+        self.assertIn(b'event: done', rest)
+
+
+CHUNK = b'data: {"choices": [{"delta": {"content": "hi"}}]}\n\n'
+
+
+def half_open_breaker(model):
+    breaker = get_breaker(model)
+    breaker.failures = breaker.threshold
+    breaker.opened_at = time.monotonic() - breaker.cooldown - 1
+    breaker.trial_in_flight = False
+    return breaker
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    text = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size=None):
+        yield CHUNK
+        yield CHUNK
+
+
+class FakeAsyncResponse:
+    status_code = 200
+    headers = {}
+
+    async def aiter_bytes(self):
+        yield CHUNK
+        await asyncio.Event().wait()  # the upstream stalls until the client goes away
+
+
+class FakeAsyncClient:
+    def stream(self, *args, **kwargs):
+        class Stream:
+            async def __aenter__(self):
+                return FakeAsyncResponse()
+
+            async def __aexit__(self, *exc):
+                return False
+        return Stream()
+
+
+class BreakerTrialTests(SimpleTestCase):
+    def test_sync_disconnect_during_trial_releases_it(self):
+        breaker = half_open_breaker('test/sync-trial')
+        with mock.patch('api.ai.get_session') as session:
+            session.return_value.post.return_value = FakeResponse()
+            stream = stream_chat_response([{"role": "user", "content": "hi"}], 'test/sync-trial')
+            self.assertEqual(next(stream), 'hi')
+            self.assertTrue(breaker.trial_in_flight)
+            stream.close()  # GeneratorExit: the client dropped
+        self.assertFalse(breaker.trial_in_flight)
+        self.assertIsInstance(breaker.allow(), Trial)
+
+    async def test_async_cancel_during_trial_releases_it(self):
+        breaker = half_open_breaker('test/async-trial')
+        first = asyncio.Event()
+
+        async def client():
+            async for _ in astream_chat_response([{"role": "user", "content": "hi"}], 'test/async-trial'):
+                first.set()
+
+        with mock.patch('api.ai.get_async_client', return_value=FakeAsyncClient()):
+            task = asyncio.create_task(client())
+            await asyncio.wait_for(first.wait(), 5)
+            self.assertTrue(breaker.trial_in_flight)
+            task.cancel()  # CancelledError: the client dropped
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertFalse(breaker.trial_in_flight)
+        self.assertIsInstance(breaker.allow(), Trial)
+
+
+    def test_late_failure_keeps_another_requests_trial(self):
+        # Started while the breaker was closed, fails only after it has tripped
+        late = RetryPlan('test/late-failure')
+        late_attempts = iter(late)  # kept referenced: dropping the generator closes the plan
+        next(late_attempts)
+        breaker = half_open_breaker('test/late-failure')
+        trial = RetryPlan('test/late-failure')
+        trial_attempts = iter(trial)
+        next(trial_attempts)
+        self.assertIsInstance(breaker.trial_in_flight, Trial)
+
+        late.failed(UpstreamError("Upstream returned 400", status=400))
+        late.close()
+        # Still one probe at a time
+        self.assertFalse(breaker.allow())
+        trial.close()
+        self.assertIsInstance(breaker.allow(), Trial)
+
+class ChatSendPersistenceTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('sender', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Chat')
+        self.client.force_login(self.user)
+
+    def test_reply_is_readable_as_soon_as_the_stream_ends(self):
+        with mock.patch('api.ai.get_session') as session, \
+                mock.patch('analytics.pricing.get_price_table') as prices, \
+                mock.patch('api.views.save_later') as save_later:
+            session.return_value.post.return_value = FakeResponse()
+            prices.return_value.cost.return_value = 0
+            prices.return_value.version = None
+            response = self.client.post('/api/chat/send/', {'chatId': str(self.chat.id), 'content': 'hello', 'model': 'test/send'},
+                                        content_type='application/json')
+            self.assertEqual(b''.join(response.streaming_content), b'hihi')
+
+        # Nothing has been flushed yet, but the reply is already there
+        messages = self.client.get(f'/api/chat/{self.chat.id}/').json()['messages']
+        self.assertEqual([(m['role'], m['content']) for m in messages], [('user', 'hello'), ('assistant', 'hihi')])
+        (logs,), _ = save_later.call_args
+        self.assertEqual(save_later.call_count, 1)
+        self.assertEqual(type(logs).__name__, 'UsageLog')
+
+
+class WriteBehindInsertTests(TestCase):
+    def test_receivers_get_only_new_rows_with_their_pk(self):
+        from analytics.models import UsageLog
+        user = User.objects.create_user('flush', password='pw')
+        queue = WriteBehindQueue(spool_dir='unused')
+        record = queue._serialize(UsageLog(user=user, model_name='test/flush', input_tokens=3))
+        received = []
+
+        def receiver(sender, objects, **kwargs):
+            received.append(objects)
+        objects_flushed.connect(receiver, sender=UsageLog)
+        try:
+            queue._insert([record])
+            queue._insert([record])  # replayed from a spool
+        finally:
+            objects_flushed.disconnect(receiver, sender=UsageLog)
+
+        self.assertEqual(UsageLog.objects.filter(model_name='test/flush').count(), 1)
+        self.assertEqual(len(received), 1)
+        (log,) = received[0]
+        self.assertIsNotNone(log.pk)
+        self.assertEqual(str(log.request_id), record['fields']['request_id'])
+
+
+class ImporterTests(TestCase):
+    def records(self):
+        chat_id, request_id = '6f1c7a52-1d7e-4c5e-9d43-1d8e3f1f0a01', 'b3c1a7e2-5f0d-4a47-8d0e-8c1b7f3e2d10'
+        return [
+            {'type': 'chat', 'id': chat_id, 'user': 'importer', 'title': 'Imported'},
+            {'type': 'message', 'id': '0d9e2f8a-3b4c-4d5e-8f60-7a8b9c0d1e2f', 'chat_id': chat_id, 'role': 'user', 'content': 'hi'},
+            {'type': 'message', 'id': '0d9e2f8a-3b4c-4d5e-8f60-7a8b9c0d1e2f', 'chat_id': chat_id, 'role': 'user', 'content': 'hi'},
+            {'type': 'usage', 'user': 'importer', 'model_name': 'test/import', 'request_id': request_id},
+            {'type': 'usage', 'user': 'importer', 'model_name': 'test/import', 'request_id': None},
+        ]
+
+    def run_import(self):
+        importer = Importer(index_search=False)
+        for record in self.records():
+            importer.add(record)
+        return importer.finish(), importer.skipped
+
+    def test_reimport_counts_only_new_rows(self):
+        User.objects.create_user('importer', password='pw')
+        counts, skipped = self.run_import()
+        self.assertEqual(counts, {'chat': 1, 'message': 1, 'usage': 2})
+        self.assertEqual(skipped, {'duplicate message': 1})
+
+        counts, skipped = self.run_import()
+        # The log without a request_id has nothing to match on and goes in again
+        self.assertEqual(counts, {'chat': 0, 'message': 0, 'usage': 1})
+        self.assertEqual(skipped, {'duplicate chat': 1, 'duplicate message': 2, 'duplicate usage': 1})
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_exported_timestamps_are_kept(self):
+        user = User.objects.create_user('importer', password='pw')
+        importer = Importer(index_search=False)
+        importer.add({'type': 'chat', 'id': '6f1c7a52-1d7e-4c5e-9d43-1d8e3f1f0a02', 'user': 'importer', 'title': 'Old',
+                      'created_at': '2024-01-02T03:04:05Z', 'updated_at': '2024-02-03T04:05:06Z'})
+        importer.add({'type': 'library_item', 'user': 'importer', 'title': 'Old prompt', 'content': 'hi',
+                      'created_at': '2024-01-02T03:04:05Z'})
+        importer.finish()
+
+        chat = Chat.objects.get(title='Old')
+        self.assertEqual((chat.created_at.isoformat(), chat.updated_at.isoformat()),
+                         ('2024-01-02T03:04:05+00:00', '2024-02-03T04:05:06+00:00'))
+        item = LibraryItem.objects.get(title='Old prompt')
+        self.assertEqual((item.created_at, item.updated_at), (chat.created_at, chat.created_at))
+        # The model fields themselves were never touched, so saves elsewhere still stamp the time
+        self.assertTrue(Chat._meta.get_field('updated_at').auto_now)
+        self.assertGreater(Chat.objects.create(user=user, title='New').created_at.year, 2024)
+
+
+class BatchRunnerTests(OfflineMixin, TestCase):
+    def test_failed_job_keeps_buffered_results(self):
+        user = User.objects.create_user('runner', password='pw')
+        job = BatchJob.objects.create(user=user, prompt='{{x}}', model_names=['test/batch'], total=3)
+        calls = [Call(0, 'test/batch', '', error='Missing variable: x'), Call(1, 'test/batch', '', error='Missing variable: x'),
+                 Call(2, 'test/batch', 'hi')]
+        runner = BatchRunner(workers=1, flush_size=100)
+        with mock.patch('analytics.budgets.remaining_budget', side_effect=RuntimeError('budget lookup failed')), \
+                mock.patch('analytics.pricing.get_price_table'), \
+                mock.patch('api.batches.close_old_connections'):
+            runner._run(job, calls, admission=None)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertEqual(job.error, 'budget lookup failed')
+        self.assertEqual(job.failed, 2)
+        self.assertEqual(sorted(job.results.values_list('input_index', flat=True)), [0, 1])
+        self.assertEqual(runner.stats()['running_jobs'], 0)
+
+
+class LimiterTests(SimpleTestCase):
+    def test_local_limiter_drops_refilled_buckets(self):
+        limiter = LocalLimiter()
+        now = time.monotonic()
+        with mock.patch('api.limits.time.monotonic', return_value=now):
+            for user in range(100):
+                limiter.take(f'user:{user}', 60)
+            limiter.charge('user:heavy', 60, 600)  # ten minutes in debt
+        self.assertEqual(limiter.stats()['buckets'], 101)
+
+        with mock.patch('api.limits.time.monotonic', return_value=now + SWEEP_INTERVAL):
+            limiter.take('user:new', 60)
+        self.assertEqual(set(limiter._buckets), {'user:heavy', 'user:new'})
+
+    def test_local_stream_slots_expire(self):
+        limiter = LocalLimiter()
+        now = time.monotonic()
+        with mock.patch('api.limits.time.monotonic', return_value=now):
+            # Never released: the request was cancelled when its client went away
+            self.assertTrue(limiter.acquire('user:1:streams', 1))
+            self.assertFalse(limiter.acquire('user:1:streams', 1))
+        with mock.patch('api.limits.time.monotonic', return_value=now + SLOT_TTL + 1):
+            self.assertEqual(limiter.stats()['active_streams'], 0)
+            self.assertTrue(limiter.acquire('user:1:streams', 1))
+            limiter.release('user:1:streams')
+            self.assertEqual(limiter._slots, {})
+
+    def test_cache_limiter_leaves_a_lock_it_does_not_own(self):
+        limiter = CacheLimiter(prefix='test-lock')
+        cache.set('test-lock:lock:user:1', 'other-worker', 10)
+        try:
+            self.assertEqual(limiter.take('user:1', 60), 0)  # fails open after waiting
+            self.assertEqual(cache.get('test-lock:lock:user:1'), 'other-worker')
+        finally:
+            cache.delete('test-lock:lock:user:1')
+        limiter.take('user:1', 60)
+        self.assertIsNone(cache.get('test-lock:lock:user:1'))
+
+
+class CompletionCacheTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('cacher', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Chat')
+        self.client.force_login(self.user)
+
+    @override_settings(UPSTREAM_FALLBACK_MODELS={'test/primary': ['test/backup']})
+    def test_fallback_answer_is_not_cached_for_the_requested_model(self):
+        missing = FakeResponse()
+        missing.status_code = 404
+        with mock.patch('api.ai.get_session') as session, \
+                mock.patch('analytics.pricing.get_price_table') as prices, \
+                mock.patch('api.views.save_later'), \
+                mock.patch('api.views.completion_cache.get_cache') as get_cache:
+            session.return_value.post.side_effect = [missing, FakeResponse()]
+            prices.return_value.cost.return_value = 0
+            get_cache.return_value.get.return_value = None
+            response = self.client.post('/api/chat/send/', {'chatId': str(self.chat.id), 'content': 'hello',
+                                                            'model': 'test/primary', 'cache': True},
+                                        content_type='application/json')
+            self.assertEqual(b''.join(response.streaming_content), b'hihi')
+
+        self.assertEqual(Message.objects.get(role='assistant').model, 'test/backup')
+        get_cache.return_value.set.assert_not_called()
+
+    def prime(self, scope, content='hello', model='test/small'):
+        """Cache an answer for a chat whose only message is `content`, as if an earlier chat had asked it."""
+        self.cache = CompletionCache()
+        # A price table remembered from another test would point at a rolled-back snapshot
+        for patcher in (mock.patch('api.completion_cache._default_cache', self.cache),
+                        mock.patch('analytics.pricing._current', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        asked = Chat.objects.create(user=self.user, title='Earlier')
+        Message.objects.create(chat=asked, role='user', content=content)
+        key = completion_cache.make_key(scope, model, build_context(asked, model))
+        self.cache.set(key, 'a cached answer that spans several replay chunks', {'prompt_tokens': 5, 'completion_tokens': 7})
+
+    def send(self, chat, **params):
+        return self.client.post(f'/api/chat/send/?{urlencode(params)}', {
+            'chatId': str(chat.id), 'content': 'hello', 'model': 'test/small', 'cache': True,
+        }, content_type='application/json')
+
+    def assert_hit_logged(self):
+        from analytics.models import UsageLog
+        log = UsageLog.objects.get()
+        # 5 prompt and 7 completion tokens of test/small at $0.001 / $0.002 per 1k
+        self.assertEqual((log.cache_status, log.cost_estimate, log.saved_cost), ('HIT', 0, Decimal('0.000019')))
+        self.assertEqual((log.input_tokens, log.output_tokens), (5, 7))
+
+    @override_settings(WRITE_BEHIND_ENABLED=False)
+    def test_hit_is_replayed_without_calling_the_upstream(self):
+        self.prime(f"user:{self.user.id}")
+        with mock.patch('api.ai.get_session') as session, \
+                mock.patch('api.views.completion_cache.replay', wraps=completion_cache.replay) as replay:
+            response = self.send(self.chat)
+            chunks = list(response.streaming_content)
+        session.assert_not_called()
+        replay.assert_called_once()
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), b'a cached answer that spans several replay chunks')
+        self.assertEqual(Message.objects.get(chat=self.chat, role='assistant').content,
+                         'a cached answer that spans several replay chunks')
+        self.assert_hit_logged()
+
+    @override_settings(WRITE_BEHIND_ENABLED=False)
+    async def test_async_hit_is_replayed(self):
+        await sync_to_async(self.prime)(f"user:{self.user.id}")
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with mock.patch('api.ai.get_async_client') as get_client, \
+                mock.patch('api.views.completion_cache.areplay', wraps=completion_cache.areplay) as areplay:
+            response = await self.async_client.post('/api/chat/send/', {
+                'chatId': str(self.chat.id), 'content': 'hello', 'model': 'test/small', 'cache': True,
+            }, content_type='application/json')
+            body = b''.join([chunk async for chunk in response.streaming_content])
+        get_client.assert_not_called()
+        areplay.assert_called_once()
+        self.assertEqual((response['X-Cache'], body), ('HIT', b'a cached answer that spans several replay chunks'))
+        await sync_to_async(self.assert_hit_logged)()
+
+    def test_answers_stay_in_their_workspace(self):
+        first = Workspace.objects.create(name='First', owner=self.user)
+        second = Workspace.objects.create(name='Second', owner=self.user)
+        for workspace in (first, second):
+            WorkspaceMember.objects.create(workspace=workspace, user=self.user, role='OWNER')
+        self.prime(f"ws:{first.id}")
+        chat = Chat.objects.create(user=self.user, title='Chat', workspace=second)
+        with mock.patch('api.ai.get_session') as session, mock.patch('api.views.save_later'):
+            session.return_value.post.return_value = FakeResponse()
+            response = self.send(chat, workspace=second.id)
+            self.assertEqual(b''.join(response.streaming_content), b'hihi')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        session.return_value.post.assert_called_once()
+
+
+@override_settings(CHAT_RATE_LIMITS={'user': {'concurrent_streams': 1}})
+class AsyncSSEProducerTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('sse-async', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Chat')
+        self.limiter = LocalLimiter()
+        limiter = mock.patch('api.limits._limiter', self.limiter)
+        limiter.start()
+        self.addCleanup(limiter.stop)
+
+    async def test_disconnect_before_first_read_still_finishes(self):
+        client = upstream_client(lambda request: sse_response('Hello', ' world'))
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with mock.patch('api.ai.get_async_client', return_value=client), \
+                mock.patch('analytics.pricing.get_price_table') as prices, \
+                mock.patch('api.views.save_later'):
+            prices.return_value.cost.return_value = 0
+            prices.return_value.version = None
+            response = await self.async_client.post('/api/chat/send/?stream=sse', {
+                'chatId': str(self.chat.id), 'content': 'hello', 'model': 'test/sse'}, content_type='application/json')
+            # The client goes away without reading a byte
+            await aiter(response.streaming_content).aclose()
+            await sync_to_async(response.close)()
+
+            generation = get_registry().get(response['Generation-Id'])
+            deadline = time.monotonic() + 5
+            while not generation.done and time.monotonic() < deadline:
+                await generation.await_data(generation.length, 0.5)
+            await asyncio.sleep(0.1)
+        await client.aclose()
+
+        self.assertEqual(generation.text(), 'Hello world')
+        self.assertEqual(self.limiter.stats()['active_streams'], 0)
+        reply = await Message.objects.aget(chat=self.chat, role='assistant')
+        self.assertEqual(reply.content, 'Hello world')
+
+
+def words(text, model):
+    return len(text.split())
+
+
+@mock.patch('api.context.count_text', words)
+class ContextWindowTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('context', password='pw')
+        self.chat = Chat.objects.create(user=user, title='Chat')
+        start = timezone.now() - timezone.timedelta(hours=1)
+        self.messages = Message.objects.bulk_create([
+            Message(chat=self.chat, role='user' if i % 2 == 0 else 'assistant',
+                    content=f'message {i} ' + 'word ' * 8, created_at=start + timezone.timedelta(seconds=i))
+            for i in range(10)
+        ])
+
+    def test_only_the_newest_messages_that_fit_are_sent(self):
+        # test/small: 100 tokens, a quarter kept for the reply; each message costs 10 words + 3
+        self.assertEqual(get_token_budget('test/small'), 75)
+        messages = build_context(self.chat, 'test/small')
+        self.assertEqual([m['content'] for m in messages], [m.content for m in self.messages[-5:]])
+        self.assertEqual(len(build_context(self.chat, 'test/large')), 10)
+
+    def test_unknown_models_get_the_default_window(self):
+        self.assertEqual(get_token_budget('test/unknown'), int(DEFAULT_CONTEXT_LENGTH * 0.75))
+
+    def test_latest_message_is_kept_even_if_it_alone_is_too_long(self):
+        Message.objects.create(chat=self.chat, role='user', content='long ' * 500)
+        messages = build_context(self.chat, 'test/small')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['content'], 'long ' * 500)
+
+    @override_settings(CHAT_CONTEXT_MAX_MESSAGES=3)
+    def test_rows_read_are_capped(self):
+        self.assertEqual(len(build_context(self.chat, 'test/large')), 3)
+
+    def test_summary_stands_in_for_the_dropped_prefix(self):
+        self.chat.summary = 'Earlier: greetings'
+        self.chat.summary_through = self.messages[4].created_at
+        messages = build_context(self.chat, 'test/small')
+        self.assertEqual(messages[0], {'role': 'system', 'content': 'Summary of the earlier conversation:\nEarlier: greetings'})
+        self.assertEqual(len(messages), 6)
+
+        # A summary reaching into the kept messages would repeat them
+        self.chat.summary_through = self.messages[5].created_at
+        self.assertNotEqual(build_context(self.chat, 'test/small')[0]['role'], 'system')
+
+    @override_settings(CHAT_CONTEXT_SUMMARIZE=True)
+    def test_summary_is_scheduled_for_the_dropped_prefix(self):
+        with mock.patch('api.context.schedule_summary') as schedule:
+            build_context(self.chat, 'test/large')
+            schedule.assert_not_called()
+            build_context(self.chat, 'test/small')
+            schedule.assert_called_once_with(self.chat.id, self.messages[5].created_at, 'test/small')
+
+            # Already summarized up to the kept tail
+            schedule.reset_mock()
+            self.chat.summary_through = self.messages[5].created_at
+            build_context(self.chat, 'test/small')
+            schedule.assert_not_called()
+
+    def test_summary_folds_in_only_new_messages_before_the_cutoff(self):
+        self.chat.summary_through = self.messages[1].created_at
+        self.chat.save()
+        with mock.patch('api.context.complete_chat', return_value=' Summary ') as complete:
+            self.assertTrue(summarize_prefix(self.chat.id, self.messages[5].created_at, 'test/small'))
+        prompt = complete.call_args.args[0][0]['content']
+        self.assertNotIn('message 1 ', prompt)
+        self.assertIn('message 2 ', prompt)
+        self.assertIn('message 4 ', prompt)
+        self.assertNotIn('message 5 ', prompt)
+        self.chat.refresh_from_db()
+        self.assertEqual((self.chat.summary, self.chat.summary_through), ('Summary', self.messages[4].created_at))
+
+    def test_summary_worker_queues_a_chat_once(self):
+        worker = SummaryWorker(max_pending=1)
+        with mock.patch.object(worker, '_ensure_started'):
+            self.assertTrue(worker.submit('a', None, 'test/small'))
+            self.assertFalse(worker.submit('a', None, 'test/small'))
+            self.assertFalse(worker.submit('b', None, 'test/small'))  # queue full
+        self.assertEqual(worker.stats()['dropped'], 1)
+        self.assertEqual(worker.stats()['pending'], 1)
+
+
+class FakeEncoder:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+class TokenCountTests(SimpleTestCase):
+    messages = [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hello there"}]
+
+    def setUp(self):
+        patcher = mock.patch('api.tokens.get_encoder', return_value=None)
+        self.get_encoder = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_families(self):
+        self.assertEqual(tokens.get_family('openai/gpt-4o-mini'), 'o200k_base')
+        self.assertEqual(tokens.get_family('openai/gpt-3.5-turbo'), 'cl100k_base')
+        self.assertEqual(tokens.get_family('anthropic/claude-3.5-sonnet'), tokens.DEFAULT_FAMILY)
+
+    def test_estimate_without_a_tokenizer(self):
+        # Short words and symbols are a token each, longer words one per 4 characters
+        self.assertEqual(tokens.estimate_tokens('hi, internationalization!'), 2 + 5 + 1)
+        self.assertEqual(tokens.count_text('', 'test/model'), 0)
+        # 3 per message plus 3 for the reply
+        self.assertEqual(tokens.count_messages(self.messages, 'test/model'), 3 + (3 + 3) + (3 + 4))
+
+    def test_tokenizer_counts_when_available(self):
+        self.get_encoder.return_value = FakeEncoder()
+        self.assertEqual(tokens.count_text('one two three', 'test/model'), 3)
+
+    def test_upstream_usage_wins(self):
+        self.assertEqual(tokens.resolve_usage(self.messages, 'reply', 'test/model',
+                                              {'prompt_tokens': 40, 'completion_tokens': 7}), (40, 7))
+        # Whatever the upstream left out is counted locally
+        self.assertEqual(tokens.resolve_usage(self.messages, 'a short reply', 'test/model', {'prompt_tokens': 40}), (40, 5))
+        self.assertEqual(tokens.resolve_usage(self.messages, 'a short reply', 'test/model'), (16, 5))
+
+
+class EncoderLoadTests(SimpleTestCase):
+    def setUp(self):
+        for name, value in (('_encoders', {}), ('_encoder_retry_at', {})):
+            patcher = mock.patch.object(tokens, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_failed_load_is_retried_later(self):
+        encoder = FakeEncoder()
+        now = time.monotonic()
+        with mock.patch('tiktoken.get_encoding', side_effect=[OSError('offline'), encoder]) as load:
+            with mock.patch('api.tokens.time.monotonic', return_value=now):
+                self.assertIsNone(tokens.get_encoder('cl100k_base'))
+                self.assertIsNone(tokens.get_encoder('cl100k_base'))
+            self.assertEqual(load.call_count, 1)
+
+            with mock.patch('api.tokens.time.monotonic', return_value=now + tokens.ENCODER_RETRY_SECONDS + 1):
+                self.assertIs(tokens.get_encoder('cl100k_base'), encoder)
+            self.assertIs(tokens.get_encoder('cl100k_base'), encoder)
+        self.assertEqual(load.call_count, 2)
+
+
+class ModelCatalogTests(TestCase):
+    def setUp(self):
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        self.snapshot_path = Path(snapshot_dir.name, 'models.json')
+        for patcher in (mock.patch('api.models_service._snapshot', None),
+                        mock.patch('api.models_service._snapshot_path', return_value=self.snapshot_path)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.delete_many([models_service.CACHE_KEY, models_service.REFRESH_LOCK_KEY])
+        self.addCleanup(cache.delete_many, [models_service.CACHE_KEY, models_service.REFRESH_LOCK_KEY])
+
+    def fetch(self, *results):
+        return mock.patch('api.models_service.fetch_openrouter_models', side_effect=results)
+
+    def test_cold_start_fetches_and_persists(self):
+        with self.fetch(TEST_MODELS) as fetch:
+            catalog = models_service.get_catalog()
+            self.assertIs(models_service.get_catalog(), catalog)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(catalog['models'], TEST_MODELS)
+        self.assertFalse(catalog['fallback'])
+        self.assertEqual(json.loads(self.snapshot_path.read_text())['etag'], catalog['etag'])
+
+    def test_cold_start_reads_the_disk_snapshot(self):
+        self.snapshot_path.write_text(json.dumps(catalog_snapshot()))
+        with self.fetch() as fetch:
+            self.assertEqual(models_service.get_catalog()['models'], TEST_MODELS)
+        fetch.assert_not_called()
+
+    def test_stale_snapshot_is_served_while_one_refresh_runs(self):
+        stale = catalog_snapshot()
+        stale['fresh_until'] = time.time() - 1
+        models_service._store_snapshot(stale, persist=False)
+        with mock.patch('api.models_service.threading.Thread') as thread:
+            # Both served at once from the stale copy; only the first starts a refresh
+            self.assertIs(models_service.get_catalog(), stale)
+            self.assertIs(models_service.get_catalog(), stale)
+            self.assertEqual(thread.call_count, 1)
+            run = thread.call_args.kwargs['target']
+
+        with self.fetch(TEST_MODELS[:1]):
+            run()
+        self.assertEqual(models_service.get_catalog()['models'], TEST_MODELS[:1])
+        # The single-flight locks were released for the next refresh
+        self.assertTrue(models_service._refresh_lock.acquire(blocking=False))
+        models_service._refresh_lock.release()
+        self.assertIsNone(cache.get(models_service.REFRESH_LOCK_KEY))
+
+    def test_failures_keep_the_last_good_catalog_with_backoff(self):
+        with self.fetch(TEST_MODELS):
+            good = models_service.refresh_catalog()
+        with self.fetch(RuntimeError('down'), RuntimeError('still down')):
+            first = models_service.refresh_catalog()
+            second = models_service.refresh_catalog()
+
+        self.assertEqual(first['models'], TEST_MODELS)
+        self.assertFalse(first['fallback'])
+        self.assertEqual(first['etag'], good['etag'])
+        self.assertEqual(second['failures'], 2)
+        # 30s then 60s, each +/-10%
+        self.assertLess(first['fresh_until'] - time.time(), 33.1)
+        self.assertGreater(second['fresh_until'] - time.time(), 53)
+        # The disk copy stays the last good catalog
+        self.assertEqual(json.loads(self.snapshot_path.read_text())['failures'], 0)
+
+    def test_failed_cold_start_falls_back_to_the_static_list(self):
+        with self.fetch(RuntimeError('down')):
+            catalog = models_service.get_catalog()
+        self.assertTrue(catalog['fallback'])
+        self.assertEqual(catalog['models'], models_service.DEFAULT_MODELS)
+        self.assertFalse(self.snapshot_path.exists())
+        self.assertEqual(models_service.get_models_with_fallback()[1], models_service.FALLBACK_ERROR)
+
+    def test_unchanged_catalog_is_not_modified(self):
+        models_service._store_snapshot(catalog_snapshot(), persist=False)
+        response = self.client.get('/api/models/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"test-catalog"')
+        self.assertEqual(len(response.json()['models']), len(TEST_MODELS))
+
+        response = self.client.get('/api/models/', HTTP_IF_NONE_MATCH='"test-catalog"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/api/models/', HTTP_IF_NONE_MATCH='"old"').status_code, 200)
+
+
+class ModelIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = ModelIndex(TEST_MODELS + [{"id": "test/unpriced", "name": "Unpriced", "description": "Mystery model"}])
+
+    def ids(self, **filters):
+        rows, count = self.index.query(**filters)
+        self.assertEqual(count, len(rows))
+        return [row['id'] for row in rows]
+
+    def test_capability_filters_combine(self):
+        self.assertEqual(self.ids(capabilities=['code']), ['test/large'])
+        self.assertEqual(self.ids(capabilities=['code', 'fast']), [])
+        self.assertEqual(self.ids(capabilities=['free']), ['test/free'])
+
+    def test_price_filter_skips_unpriced_models(self):
+        # USD per 1M prompt tokens; free models count as 0
+        self.assertEqual(self.ids(max_price=0), ['test/free'])
+        self.assertEqual(self.ids(max_price=1, sort='price'), ['test/free', 'test/small'])
+        self.assertEqual(len(self.ids(max_price=1000)), 3)
+
+    def test_min_context(self):
+        self.assertEqual(self.ids(min_context=400, sort='context'), ['test/large', 'test/free'])
+        self.assertEqual(self.ids(min_context=1001), [])
+
+    def test_search_matches_every_term(self):
+        self.assertEqual(self.ids(q='mystery'), ['test/unpriced'])
+        self.assertEqual(self.ids(q='test large'), ['test/large'])
+
+    def test_sorting_and_paging(self):
+        self.assertEqual(self.ids(sort='name'), ['test/free', 'test/large', 'test/small', 'test/unpriced'])
+        # Unpriced models go last when sorting by price
+        self.assertEqual(self.ids(sort='price')[-1], 'test/unpriced')
+        rows, count = self.index.query(sort='name', offset=1, limit=2)
+        self.assertEqual(([row['id'] for row in rows], count), (['test/large', 'test/small'], 4))
+        self.assertNotIn('pricing', rows[0])
+        rows, _ = self.index.query(q='small', include_pricing=True)
+        self.assertEqual(rows[0]['pricing'], TEST_MODELS[0]['pricing'])
+
+    def test_view_filters_server_side(self):
+        with mock.patch('api.models_service._snapshot', catalog_snapshot()):
+            response = self.client.get('/api/models/', {'fast': '1', 'max_price': '5', 'limit': '1'})
+            self.assertEqual(response.json()['count'], 1)
+            self.assertEqual([m['id'] for m in response.json()['models']], ['test/small'])
+            self.assertIsNone(response.json()['next_offset'])
+            self.assertEqual(self.client.get('/api/models/', {'min_context': 'big'}).status_code, 400)
+
+
+class TitleBackendTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('titles', password='pw')
+        self.chats = [Chat.objects.create(user=user, title=f'Chat {i}') for i in range(3)]
+        self.backend = InProcessTitleBackend(max_attempts=2)
+        # Drive the backend by hand instead of from worker threads
+        patcher = mock.patch.object(self.backend, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for chat in self.chats:
+            self.backend.submit(chat.id, f'first message of {chat.title}', chat.title)
+
+    def drain(self):
+        batch = []
+        while not self.backend._queue.empty():
+            batch.append(self.backend._queue.get_nowait())
+        return batch
+
+    def titles(self):
+        titles = dict(Chat.objects.filter(id__in=[c.id for c in self.chats]).values_list('id', 'title'))
+        return [titles[chat.id] for chat in self.chats]
+
+    def test_duplicate_submissions_are_dropped(self):
+        self.assertFalse(self.backend.submit(self.chats[0].id, 'again', 'Chat 0'))
+        self.assertEqual(self.backend.stats()['queue_depth'], 3)
+
+    def test_batch_is_named_in_one_call(self):
+        # The user renames a chat while its title is being generated
+        Chat.objects.filter(id=self.chats[1].id).update(title='Mine')
+        reply = 'Sure:\n```json\n["Alpha", "Beta", 7]\n```'
+        with mock.patch('api.titles.complete_chat', return_value=reply) as complete:
+            self.backend._process(self.drain())
+        complete.assert_called_once()
+        prompt = complete.call_args.args[0][0]['content']
+        self.assertIn('these 3 chats', prompt)
+        self.assertIn('3. "first message of Chat 2"', prompt)
+
+        self.assertEqual(self.titles(), ['Alpha', 'Mine', 'Chat 2'])
+        self.assertEqual(self.backend.stats()['pending'], 0)
+
+    def test_bad_batch_reply_is_rejected(self):
+        for reply in ('["Only one"]', 'no titles here', None):
+            with mock.patch('api.titles.complete_chat', return_value=reply), self.assertRaises(RuntimeError):
+                generate_titles(['a', 'b'], timeout=1)
+
+    def test_failed_batches_are_retried_with_backoff(self):
+        now = time.monotonic()
+        with mock.patch('api.titles.complete_chat', return_value=None), \
+                mock.patch('api.titles.time.monotonic', return_value=now):
+            self.backend._process(self.drain())
+            self.assertEqual(self.backend.stats()['retrying'], 3)
+            self.backend._release_due_retries()
+            self.assertEqual(self.backend.stats()['queue_depth'], 0)
+
+        with mock.patch('api.titles.complete_chat', return_value='["A", "B", "C"]'), \
+                mock.patch('api.titles.time.monotonic', return_value=now + 2):
+            self.backend._release_due_retries()
+            self.assertEqual(self.backend.stats()['queue_depth'], 3)
+            self.backend._process(self.drain())
+        # Retries come back in due order, not submission order
+        self.assertEqual(sorted(self.titles()), ['A', 'B', 'C'])
+        self.assertEqual(self.backend.stats()['generated'], 3)
+
+    def test_gives_up_after_max_attempts(self):
+        with mock.patch('api.titles.complete_chat', side_effect=httpx.ConnectError('down')), \
+                mock.patch('api.titles.time.monotonic', return_value=0):
+            self.backend._process(self.drain())
+        with mock.patch('api.titles.complete_chat', side_effect=httpx.ConnectError('down')), \
+                mock.patch('api.titles.time.monotonic', return_value=10):
+            self.backend._release_due_retries()
+            self.backend._process(self.drain())
+
+        stats = self.backend.stats()
+        self.assertEqual((stats['failed'], stats['retrying'], stats['pending']), (3, 0, 0))
+        self.assertEqual(self.titles(), ['Chat 0', 'Chat 1', 'Chat 2'])
+
+
+class SSEDecoderTests(SimpleTestCase):
+    STREAM = (
+        ': OPENROUTER PROCESSING\n\n'
+        f"data: {json.dumps({'choices': [{'delta': {'content': 'héllo ✓'}}]}, ensure_ascii=False)}\r\n\r\n"
+        f"data: {json.dumps({'choices': [{'delta': {}, 'finish_reason': 'stop'}], 'usage': {'total_tokens': 3}})}\n\n"
+        'data: [DONE]\n\n'
+    ).encode()
+
+    def decode(self, chunks):
+        decoder = SSEDecoder()
+        events = []
+        for chunk in chunks:
+            events += decoder.feed(chunk)
+        return events + decoder.close()
+
+    def summary(self, events):
+        return [(type(event).__name__, getattr(event, 'text', None) or getattr(event, 'reason', None)) for event in events]
+
+    def test_any_split_gives_the_same_events(self):
+        expected = [('ContentEvent', 'héllo ✓'), ('FinishEvent', 'stop'), ('UsageEvent', None), ('DoneEvent', None)]
+        self.assertEqual(self.summary(self.decode([self.STREAM])), expected)
+        # Including splits mid-line and inside multi-byte characters
+        for i in range(1, len(self.STREAM)):
+            self.assertEqual(self.summary(self.decode([self.STREAM[:i], self.STREAM[i:]])), expected, i)
+        self.assertEqual(self.summary(self.decode([bytes([b]) for b in self.STREAM])), expected)
+
+    def test_comments_and_bad_payloads_are_skipped(self):
+        events = self.decode([b': keep-alive\n\nevent: ping\n\ndata: {not json\n\ndata: [1, 2]\n\ndata: [DONE]\n\n'])
+        self.assertEqual(events, [DONE])
+
+    def test_trailing_event_without_blank_line(self):
+        events = self.decode([b'data: {"error": {"message": "rate limited", "code": 429}}'])
+        self.assertEqual((type(events[0]), events[0].message, events[0].code), (ErrorEvent, 'rate limited', 429))
+
+    def test_multiline_data_is_joined(self):
+        events = self.decode([b'data: {"choices": [{"delta":\ndata: {"content": "x"}}]}\n\n'])
+        self.assertEqual(self.summary(events), [('ContentEvent', 'x')])
+
+
+class SingleReadStreamTests(SimpleTestCase):
+    """The whole reply, usage and [DONE] arrive in one read from the upstream."""
+    BODY = SSEDecoderTests.STREAM
+
+    def test_sync_stream_keeps_the_deltas_read_with_done(self):
+        response = FakeResponse()
+        response.iter_content = lambda chunk_size=None: iter([self.BODY])
+        usage = {}
+        with mock.patch('api.ai.get_session') as session:
+            session.return_value.post.return_value = response
+            self.assertEqual(''.join(stream_chat_response([], 'test/one-read', usage)), 'héllo ✓')
+        self.assertEqual((usage['finish_reason'], usage['model']), ('stop', 'test/one-read'))
+
+    async def test_async_stream_keeps_the_deltas_read_with_done(self):
+        client = upstream_client(lambda request: httpx.Response(200, content=self.BODY))
+        usage = {}
+        with mock.patch('api.ai.get_async_client', return_value=client):
+            chunks = [chunk async for chunk in astream_chat_response([], 'test/one-read', usage)]
+        await client.aclose()
+        self.assertEqual(''.join(chunks), 'héllo ✓')
+        self.assertNotIn('error', usage)
+
+
+def fake_branch_stream(messages, model, usage):
+    """Streams two chunks for test/small, one for test/large and fails test/broken before answering."""
+    if model == 'test/broken':
+        usage['error'] = 'upstream unavailable'
+        return
+    for chunk in {'test/small': ['sm', 'all'], 'test/large': ['large']}[model]:
+        yield chunk
+    usage.update(finish_reason='stop', prompt_tokens=10, completion_tokens=len(model))
+
+
+async def fake_branch_astream(messages, model, usage):
+    for chunk in fake_branch_stream(messages, model, usage):
+        yield chunk
+
+
+def parse_sse(body):
+    """(event name, data) pairs of an SSE body, comments skipped."""
+    events = []
+    for frame in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.splitlines() if not line.startswith(':'))
+        if 'data' in fields:
+            events.append((fields.get('event'), json.loads(fields['data'])))
+    return events
+
+
+@override_settings(WRITE_BEHIND_ENABLED=False, CHAT_SSE_COALESCE_MS=0)
+class CompareTests(OfflineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('comparer', password='pw')
+        self.chat = Chat.objects.create(user=self.user, title='Chat')
+        self.client.force_login(self.user)
+        self.limiter = LocalLimiter()
+        for patcher in (mock.patch('api.limits._limiter', self.limiter),
+                        mock.patch('api.compare.stream_chat_response', fake_branch_stream),
+                        mock.patch('api.compare.astream_chat_response', fake_branch_astream)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def compare(self, models):
+        return self.client.post('/api/chat/compare/', {'chatId': str(self.chat.id), 'content': 'hello', 'models': models},
+                                content_type='application/json')
+
+    async def test_branches_are_multiplexed_and_saved_separately(self):
+        # Under ASGI the branches are finalized on the test's thread, inside its transaction
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post('/api/chat/compare/', {
+            'chatId': str(self.chat.id), 'content': 'hello', 'models': ['test/small', 'test/large', 'test/broken'],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        events = parse_sse(b''.join([chunk async for chunk in response.streaming_content]))
+        await sync_to_async(self.check_saved)(events)
+
+    def check_saved(self, events):
+        from analytics.models import UsageLog
+
+        (start_event, start), *rest, (end_event, _) = events
+        self.assertEqual((start_event, start['models']), ('start', ['test/small', 'test/large', 'test/broken']))
+        self.assertEqual(end_event, 'end')
+        texts = {}
+        for event, data in rest:
+            if event is None:
+                texts[data['branch']] = texts.get(data['branch'], '') + data['text']
+        self.assertEqual(texts, {0: 'small', 1: 'large'})
+        done = {data['branch']: data for event, data in rest if event == 'done'}
+        self.assertEqual(done[2]['error'], 'upstream unavailable')
+        # Nothing was saved for the failed branch, so there's no message to point at
+        self.assertIsNone(done[2]['message_id'])
+        self.assertEqual((done[0]['finish_reason'], done[0]['model']), ('stop', 'test/small'))
+
+        # Every answered branch is its own message in the comparison group; the failed one isn't saved
+        replies = Message.objects.filter(chat=self.chat, role='assistant').order_by('branch')
+        self.assertEqual([(m.branch, m.model, m.content) for m in replies], [(0, 'test/small', 'small'), (1, 'test/large', 'large')])
+        self.assertEqual({str(m.id) for m in replies}, {done[0]['message_id'], done[1]['message_id']})
+        self.assertEqual({m.group_id for m in replies}, {uuid.UUID(start['group_id'])})
+
+        logs = UsageLog.objects.order_by('model_name')
+        self.assertEqual([(log.model_name, log.input_tokens, log.output_tokens) for log in logs],
+                         [('test/large', 10, 10), ('test/small', 10, 10)])
+        # The one admission is released once every branch has finished
+        self.assertEqual(self.limiter.stats()['active_streams'], 0)
+
+    def test_frames_merge_chunks_per_branch(self):
+        comparison = Compare('chat', ['test/small', 'test/large'], [], finalize=None)
+        frames = parse_sse(b''.join(comparison._frames([(0, 'a'), (1, 'b'), (0, 'c'), (0, FINISHED)])))
+        self.assertEqual([(event, data.get('text')) for event, data in frames],
+                         [(None, 'ac'), ('done', None), (None, 'b')])
+
+    def test_on_complete_runs_once_after_every_branch(self):
+        finalized, completed = [], []
+        comparison = Compare('chat', ['test/small', 'test/large'], [], finalized.append, lambda: completed.append(len(finalized)))
+        list(comparison.events())
+        self.assertEqual(sorted(branch.text() for branch in finalized), ['large', 'small'])
+        self.assertEqual(completed, [2])
+
+    def test_model_list_is_validated(self):
+        self.assertEqual(self.compare([]).status_code, 400)
+        self.assertEqual(self.compare(['test/small', 7]).status_code, 400)
+        with override_settings(COMPARE_MAX_MODELS=2):
+            self.assertEqual(self.compare(['test/small', 'test/large', 'test/free']).status_code, 400)
+        self.assertFalse(Message.objects.exists())
@@ -0,0 +1,285 @@
+"""
+Chat title generation.
+
+New chats get a heuristic title straight away so the UI never waits. A better
+title is then requested from the model by a small, bounded pool of worker
+threads. The workers take pending chats off a queue, deduplicate them, and
+name several chats in a single upstream call when a burst of chats arrives
+together. If the queue is full the heuristic title is simply kept.
+
+Set TITLE_TASK_BACKEND to a dotted path to run titles elsewhere (e.g.
+"api.titles.ImmediateTitleBackend" to generate inline in tests/commands).
+"""
+import heapq
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from .ai import complete_chat, OPENROUTER_API_KEY
+from .models import Chat
+
+logger = logging.getLogger(__name__)
+
+MAX_TITLE_WORDS = 6
+MAX_TITLE_CHARS = 60
+
+_FILLER_RE = re.compile(
+    r"^(hi|hello|hey)[,!.\s]+|^(can|could|would|will) you( please)?\s+|^please\s+|^i (want|need|would like) (you )?to\s+",
+    re.IGNORECASE,
+)
+_SENTENCE_END_RE = re.compile(r"[.?!\n]")
+
+
+def heuristic_title(content):
+    """Cheap local title: the first clause of the message, without pleasantries."""
+    text = ' '.join((content or '').split())
+    previous = None
+    while text and text != previous:
+        previous = text
+        text = _FILLER_RE.sub('', text).strip()
+    match = _SENTENCE_END_RE.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    words = text.split()[:MAX_TITLE_WORDS]
+    title = ' '.join(words).strip(' ,;:-"\'')[:MAX_TITLE_CHARS]
+    if not title:
+        return "New Chat"
+    return title[0].upper() + title[1:]
+
+
+def clean_title(title):
+    title = ' '.join((title or '').split()).strip().strip('"\'').rstrip('.')
+    return title[:MAX_TITLE_CHARS] or None
+
+
+def title_model():
+    return getattr(settings, 'TITLE_MODEL', 'google/gemini-2.0-flash-exp:free')
+
+
+def generate_titles(contents, timeout):
+    """
+    Ask the model for one title per first message. Returns a list aligned with
+    `contents` (None where no usable title came back); raises on upstream failure.
+    """
+    if len(contents) == 1:
+        prompt = (
+            "Generate a very short, concise title (max 5 words) for a chat that starts with this message: "
+            f"'{contents[0]}'. Return ONLY the title, no quotes or extra text."
+        )
+        reply = complete_chat([{"role": "user", "content": prompt}], title_model(), timeout=timeout)
+        if reply is None:
+            raise RuntimeError("no reply from title model")
+        return [clean_title(reply)]
+
+    numbered = "\n".join(f"{i + 1}. {json.dumps(content[:500])}" for i, content in enumerate(contents))
+    prompt = (
+        f"Generate a very short, concise title (max 5 words) for each of these {len(contents)} chats, "
+        "given the first message of each. Return ONLY a JSON array of strings, one title per chat, "
+        f"in the same order.\n\n{numbered}"
+    )
+    reply = complete_chat([{"role": "user", "content": prompt}], title_model(), timeout=timeout)
+    if reply is None:
+        raise RuntimeError("no reply from title model")
+    try:
+        titles = json.loads(reply[reply.index('['):reply.rindex(']') + 1])
+    except ValueError:
+        raise RuntimeError(f"unparseable batch title reply: {reply[:100]!r}")
+    if not isinstance(titles, list) or len(titles) != len(contents):
+        raise RuntimeError("batch title reply has the wrong length")
+    return [clean_title(t) if isinstance(t, str) else None for t in titles]
+
+
+def apply_title(chat_id, placeholder, title):
+    # Only replace the heuristic title, never one the user has set in the meantime
+    return Chat.objects.filter(id=chat_id, title=placeholder).update(title=title)
+
+
+class TitleTask:
+    __slots__ = ('chat_id', 'content', 'placeholder', 'attempts')
+
+    def __init__(self, chat_id, content, placeholder):
+        self.chat_id = chat_id
+        self.content = content
+        self.placeholder = placeholder
+        self.attempts = 0
+
+
+class InProcessTitleBackend:
+    """Bounded queue served by a fixed pool of daemon worker threads."""
+
+    def __init__(self, workers=2, max_pending=500, batch_size=8, batch_window=0.2, timeout=10, max_attempts=3):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = set()  # chat ids queued, waiting for a retry or in progress
+        self._delayed = []  # heap of (due, id, task) waiting to be retried
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+        self.generated = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, chat_id, content, placeholder):
+        self._ensure_started()
+        with self._lock:
+            if chat_id in self._pending:
+                return False
+            self._pending.add(chat_id)
+        try:
+            self._queue.put_nowait(TitleTask(chat_id, content, placeholder))
+        except queue.Full:
+            self._done(chat_id)
+            self.dropped += 1
+            return False
+        return True
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "retrying": len(self._delayed),
+            "pending": len(self._pending),
+            "generated": self.generated,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def _ensure_started(self):
+        # Re-start after fork (gunicorn preload) since threads don't survive it
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'title-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self):
+        while True:
+            self._release_due_retries()
+            try:
+                batch = [self._queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            finally:
+                close_old_connections()
+
+    def _process(self, batch):
+        try:
+            titles = generate_titles([task.content for task in batch], self.timeout)
+        except Exception as e:
+            logger.warning(f"Title generation failed for {len(batch)} chats: {e}")
+            self._retry(batch)
+            return
+
+        for task, title in zip(batch, titles):
+            if title:
+                try:
+                    apply_title(task.chat_id, task.placeholder, title)
+                    self.generated += 1
+                except Exception as e:
+                    logger.error(f"Error saving title for chat {task.chat_id}: {e}")
+            self._done(task.chat_id)
+
+    def _retry(self, batch):
+        for task in batch:
+            task.attempts += 1
+            if task.attempts >= self.max_attempts:
+                self.failed += 1
+                self._done(task.chat_id)
+                continue
+            # Exponential backoff; workers move the task back onto the queue once it's due
+            with self._lock:
+                heapq.heappush(self._delayed, (time.monotonic() + 2 ** task.attempts, id(task), task))
+
+    def _release_due_retries(self):
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            while self._delayed and self._delayed[0][0] <= now:
+                due.append(heapq.heappop(self._delayed)[2])
+        for task in due:
+            try:
+                self._queue.put_nowait(task)
+            except queue.Full:
+                self.dropped += 1
+                self._done(task.chat_id)
+
+    def _done(self, chat_id):
+        with self._lock:
+            self._pending.discard(chat_id)
+
+
+class ImmediateTitleBackend:
+    """Generates the title inline; for tests and management commands."""
+
+    def __init__(self, timeout=10, **kwargs):
+        self.timeout = timeout
+
+    def submit(self, chat_id, content, placeholder):
+        try:
+            title = generate_titles([content], self.timeout)[0]
+        except Exception as e:
+            logger.warning(f"Title generation failed for chat {chat_id}: {e}")
+            return False
+        if title:
+            apply_title(chat_id, placeholder, title)
+        return True
+
+    def stats(self):
+        return {}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(getattr(settings, 'TITLE_TASK_BACKEND', 'api.titles.InProcessTitleBackend'))
+                _backend = backend_class(
+                    workers=getattr(settings, 'TITLE_WORKERS', 2),
+                    max_pending=getattr(settings, 'TITLE_MAX_PENDING', 500),
+                    batch_size=getattr(settings, 'TITLE_BATCH_SIZE', 8),
+                    timeout=getattr(settings, 'TITLE_TIMEOUT', 10),
+                )
+    return _backend
+
+
+def request_title(chat_id, content, placeholder):
+    """Queue model title generation for a new chat that currently has `placeholder` as its title."""
+    if not OPENROUTER_API_KEY or not getattr(settings, 'TITLE_GENERATION_ENABLED', True):
+        return False
+    return get_backend().submit(chat_id, content, placeholder)
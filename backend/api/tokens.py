@@ -0,0 +1,113 @@
+"""
+Token accounting for prompts and completions.
+
+Each model id is mapped to a tokenizer family. Encoders are loaded lazily on
+first use and memoized; when a tokenizer is unavailable (tiktoken not
+installed, or its BPE files can't be fetched offline) we fall back to a
+regex-based estimate that tracks BPE counts far better than len // 4, and
+try loading it again after ENCODER_RETRY_SECONDS.
+
+Point TIKTOKEN_CACHE_DIR at a pre-seeded directory to get exact counts offline.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead (role markers etc.) and reply priming, as used by chat models
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# (model id prefix or substring, tokenizer family). First match wins.
+MODEL_FAMILIES = [
+    ("openai/gpt-4o", "o200k_base"),
+    ("openai/gpt-4.1", "o200k_base"),
+    ("openai/o1", "o200k_base"),
+    ("openai/o3", "o200k_base"),
+    ("openai/o4", "o200k_base"),
+    ("openai/", "cl100k_base"),
+]
+# Other providers don't publish compatible BPEs; cl100k is a close enough proxy for billing estimates
+DEFAULT_FAMILY = "cl100k_base"
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=256)
+def get_family(model):
+    model = (model or "").lower()
+    for key, family in MODEL_FAMILIES:
+        if model.startswith(key):
+            return family
+    return DEFAULT_FAMILY
+
+
+# How long to use estimates before retrying a tokenizer that failed to load (seconds)
+ENCODER_RETRY_SECONDS = 300
+
+_encoders = {}  # family -> encoder
+_encoder_retry_at = {}  # family -> monotonic time of the next load attempt
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(family):
+    """Load the encoder for a family once; returns None while it can't be loaded."""
+    encoder = _encoders.get(family)
+    if encoder is not None or time.monotonic() < _encoder_retry_at.get(family, 0):
+        return encoder
+    with _encoders_lock:
+        if family in _encoders or time.monotonic() < _encoder_retry_at.get(family, 0):
+            return _encoders.get(family)
+        try:
+            import tiktoken
+            encoder = _encoders[family] = tiktoken.get_encoding(family)
+        except Exception as e:
+            logger.warning(f"Tokenizer '{family}' unavailable, using estimates for {ENCODER_RETRY_SECONDS}s: {e}")
+            _encoder_retry_at[family] = time.monotonic() + ENCODER_RETRY_SECONDS
+            return None
+        _encoder_retry_at.pop(family, None)
+        return encoder
+
+
+def estimate_tokens(text):
+    """Heuristic token count: ~1 token per short word or symbol, long words split every 4 chars."""
+    count = 0
+    for piece in _WORD_RE.findall(text):
+        count += math.ceil(len(piece) / 4) if len(piece) > 4 else 1
+    return count
+
+
+def count_text(text, model):
+    if not text:
+        return 0
+    encoder = get_encoder(get_family(model))
+    if encoder is None:
+        return estimate_tokens(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_messages(messages, model):
+    """Count the prompt tokens for a list of {"role", "content"} messages."""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + count_text(message.get("content", ""), model)
+    return total
+
+
+def resolve_usage(messages, completion, model, usage=None):
+    """
+    Return (input_tokens, output_tokens) for one completion, preferring the
+    upstream-reported usage block and counting locally otherwise.
+    """
+    usage = usage or {}
+    input_tokens = usage.get("prompt_tokens")
+    output_tokens = usage.get("completion_tokens")
+    if input_tokens is None:
+        input_tokens = count_messages(messages, model)
+    if output_tokens is None:
+        output_tokens = count_text(completion, model)
+    return input_tokens, output_tokens
@@ -0,0 +1,331 @@
+"""
+Shared plumbing for every call to OpenRouter.
+
+- One pooled requests.Session per process (sync callers) and one pooled
+  httpx.AsyncClient per event loop (async streaming), with separate connect
+  and read timeouts.
+- RetryPlan: retries with jittered exponential backoff, but only before the
+  first byte of a response has been consumed. It also falls back to alternate
+  models (UPSTREAM_FALLBACK_MODELS) once a model keeps failing.
+- A per-model circuit breaker: after UPSTREAM_BREAKER_THRESHOLD consecutive
+  failures the model is skipped for UPSTREAM_BREAKER_COOLDOWN seconds, then a
+  single trial request decides whether it closes again.
+
+Run `manage.py fake_openrouter` with its failure options to exercise all of
+this locally.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1').rstrip('/')
+
+# Connection pool sizing
+MAX_CONNECTIONS = int(os.getenv('OPENROUTER_MAX_CONNECTIONS', '500'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENROUTER_MAX_KEEPALIVE', '100'))
+KEEPALIVE_EXPIRY = float(os.getenv('OPENROUTER_KEEPALIVE_EXPIRY', '30'))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Worth another attempt (possibly on another model); anything else in 4xx is the request's fault
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+# The model itself is unavailable; skip straight to a fallback
+MODEL_UNAVAILABLE_STATUSES = {404}
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpen(UpstreamError):
+    pass
+
+
+def connect_timeout():
+    return getattr(settings, 'UPSTREAM_CONNECT_TIMEOUT', 5)
+
+
+def read_timeout():
+    return getattr(settings, 'UPSTREAM_READ_TIMEOUT', 60)
+
+
+def headers():
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost:5173", # Client URL
+        "X-Title": "TethrAI",
+    }
+
+
+# Clients
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled requests session (re-created after fork)."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_KEEPALIVE_CONNECTIONS)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+# httpx.AsyncClient is bound to the event loop it was first used on, so we keep
+# one pooled client per loop (a single one under uvicorn/daphne).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the process-wide pooled HTTP client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(connect_timeout(), read=read_timeout()),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def check_status(status, headers, body=''):
+    """Raise UpstreamError for a non-2xx response."""
+    if 200 <= status < 300:
+        return
+    retry_after = None
+    try:
+        retry_after = float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        pass
+    raise UpstreamError(f"Upstream returned {status}: {body[:200]}".rstrip(': '), status=status, retry_after=retry_after)
+
+
+# Circuit breaker
+
+class Trial:
+    """Token for the half-open trial request; only its holder can give it back."""
+    __slots__ = ()
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False  # the outstanding Trial, if any
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """Truthy if a request may go ahead; a Trial token when it is the half-open trial request."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_in_flight:
+                self.trial_in_flight = Trial()
+                return self.trial_in_flight
+            return False
+
+    def release_trial(self, trial):
+        """Give `trial` back without an outcome, so the next request can try."""
+        with self._lock:
+            # A stale token (the trial was settled and granted again since) changes nothing
+            if self.trial_in_flight is trial:
+                self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model):
+    breaker = _breakers.get(model)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(model, CircuitBreaker(
+                getattr(settings, 'UPSTREAM_BREAKER_THRESHOLD', 5),
+                getattr(settings, 'UPSTREAM_BREAKER_COOLDOWN', 30),
+            ))
+    return breaker
+
+
+def breaker_stats():
+    return {model: {"state": b.state, "failures": b.failures} for model, b in _breakers.items() if b.failures}
+
+
+# Retries and fallback
+
+def candidate_models(model):
+    """The requested model followed by its configured fallbacks ("*" applies to every model)."""
+    fallbacks = getattr(settings, 'UPSTREAM_FALLBACK_MODELS', {}) or {}
+    candidates = [model]
+    for alt in list(fallbacks.get(model, [])) + list(fallbacks.get('*', [])):
+        if alt not in candidates:
+            candidates.append(alt)
+    return candidates
+
+
+def backoff(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring a (capped) Retry-After."""
+    cap = getattr(settings, 'UPSTREAM_BACKOFF_MAX', 4)
+    delay = random.uniform(0, min(cap, getattr(settings, 'UPSTREAM_BACKOFF_BASE', 0.5) * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+def is_retryable(error):
+    if isinstance(error, UpstreamError):
+        return error.status is None or error.status in RETRYABLE_STATUSES
+    # Transport failures: connection refused/reset, timeouts, truncated streams
+    return isinstance(error, (requests.RequestException, httpx.HTTPError, OSError))
+
+
+class RetryPlan:
+    """
+    Yields (model, attempt) pairs to try, in order. The caller reports each
+    outcome with `succeeded()` or `failed(error)`, sleeps for `delay` (if
+    non-zero) before each attempt, and calls `close()` when done:
+
+        plan = RetryPlan(model)
+        try:
+            for candidate, attempt in plan:
+                time.sleep(plan.delay)
+                try:
+                    ...
+                except Exception as e:
+                    plan.failed(e)
+                else:
+                    plan.succeeded()
+                    break
+        finally:
+            plan.close()
+
+    An attempt abandoned without an outcome (the client disconnected:
+    GeneratorExit or CancelledError) gives back a half-open trial on close().
+    """
+
+    def __init__(self, model):
+        self.models = candidate_models(model)
+        self.max_retries = getattr(settings, 'UPSTREAM_MAX_RETRIES', 2)
+        self.delay = 0
+        self.error = None
+        self.model = None
+        self.attempt = 0
+        self._done = False
+        self._next_model = False
+        self._trial = None  # (breaker, Trial) when the current attempt holds a half-open trial
+
+    def __iter__(self):
+        try:
+            for model in self.models:
+                breaker = get_breaker(model)
+                self.delay = 0
+                self._next_model = False
+                for attempt in range(self.max_retries + 1):
+                    allowed = breaker.allow()
+                    if not allowed:
+                        self.error = self.error or CircuitOpen(f"Circuit open for {model}")
+                        break
+                    self._trial = (breaker, allowed) if isinstance(allowed, Trial) else None
+                    self.model = model
+                    self.attempt = attempt
+                    yield model, attempt
+                    if self._done:
+                        return
+                    if self._next_model:
+                        break
+                if model != self.models[-1]:
+                    logger.warning(f"Upstream model {model} failed, falling back ({self.error})")
+        finally:
+            self.close()
+
+    def close(self):
+        """Release a half-open trial held by an attempt that never reported an outcome."""
+        if self._trial is not None:
+            breaker, trial = self._trial
+            breaker.release_trial(trial)
+            self._trial = None
+
+    def succeeded(self):
+        self._trial = None
+        get_breaker(self.model).record_success()
+        self._done = True
+
+    def failed(self, error, started=False):
+        """Record a failed attempt. With `started`, output was already sent, so nothing is retried."""
+        held, self._trial = self._trial, None
+        self.error = error
+        retryable = is_retryable(error)
+        status = getattr(error, 'status', None)
+        if retryable or status in MODEL_UNAVAILABLE_STATUSES:
+            get_breaker(self.model).record_failure()
+        else:
+            # Bad request / auth: the breaker isn't at fault, but don't hold the half-open trial either
+            if held is not None:
+                breaker, trial = held
+                breaker.release_trial(trial)
+        if started or not (retryable or status in MODEL_UNAVAILABLE_STATUSES):
+            self._done = True
+        elif status in MODEL_UNAVAILABLE_STATUSES:
+            self._next_model = True
+        else:
+            self.delay = backoff(self.attempt, getattr(error, 'retry_after', None))
+
+    def error_message(self):
+        return str(self.error) if self.error else "Upstream request failed"
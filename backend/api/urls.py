@@ -7,7 +7,16 @@ urlpatterns = [
     path('auth/me/', views.user_view, name='me'),
     path('auth/register/', views.register_view, name='register'),
     path('chat/send/', views.chat_send, name='chat_send'),
+    path('chat/compare/', views.chat_compare, name='chat_compare'),
+    path('chat/stream/<str:generation_id>/', views.chat_stream, name='chat_stream'),
     path('chat/history/', views.chat_history, name='chat_history'),
     path('chat/<uuid:chat_id>/', views.get_chat, name='get_chat'),
+    path('batches/', views.batch_jobs, name='batch_jobs'),
+    path('batches/<uuid:job_id>/', views.batch_job, name='batch_job'),
+    path('batches/<uuid:job_id>/results/', views.batch_results, name='batch_results'),
+    path('batches/<uuid:job_id>/stream/', views.batch_stream, name='batch_stream'),
+    path('batches/<uuid:job_id>/cancel/', views.batch_cancel, name='batch_cancel'),
+    path('export/<str:dataset>/', views.export_data, name='export_data'),
     path('models/', views.get_models, name='get_models'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
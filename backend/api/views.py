@@ -1,26 +1,47 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
-from django.http import StreamingHttpResponse
+from django.conf import settings
+from django.http import StreamingHttpResponse, HttpResponseNotModified
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import async_to_sync, sync_to_async
 from django.views.decorators.csrf import csrf_exempt
-from .models import Chat, Message
-from .serializers import UserSerializer, ChatSerializer, MessageSerializer
-from .ai import stream_chat_response
+from django.db import close_old_connections
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Substr
+from .models import Chat, Message, BatchJob, BatchResult
+from .serializers import UserSerializer, ChatDetailSerializer, ChatListSerializer, MessageSerializer, saved_message_ids
+from .serializers import BatchJobSerializer, BatchResultSerializer
+from .pagination import ChatCursorPagination, MessageCursorPagination, BatchJobCursorPagination, BatchResultCursorPagination
+from teams.access import IsWorkspaceMember, has_chat_access
+from tethrai_backend.db_routers import read_replica
+from .ai import stream_chat_response, astream_chat_response, DEFAULT_MODEL
+from .batches import Call, get_runner as get_batch_runner
+from .context import build_context, get_token_budget, get_summary_worker
+from .compare import Compare
+from .limits import admit, get_limiter, retry_after_header, RateLimited
+from .generations import get_registry as get_generations, sse_events, asse_events, sse_response, format_event, parse_offset, EventStreamRenderer, track_producer
+from .titles import heuristic_title, request_title, get_backend as get_title_backend
+from .tokens import resolve_usage
+from .writebehind import save_later, get_queue
+from . import completion_cache, upstream
+from knowledge_base.prompt_templates import get_cache as get_template_cache
+import asyncio
+import csv
+import io
 import json
+import logging
+import threading
+import time
 import uuid
 
-# Pricing Dict (Cost per 1k tokens)
-# Note: These are rough estimates for MVP
-MODEL_PRICING = {
-    'openai/gpt-3.5-turbo': {'input': 0.0005, 'output': 0.0015},
-    'openai/gpt-4': {'input': 0.03, 'output': 0.06},
-    'google/gemini-pro': {'input': 0.000125, 'output': 0.000375},
-    'anthropic/claude-3-opus': {'input': 0.015, 'output': 0.075},
-}
+logger = logging.getLogger(__name__)
 
-DEFAULT_PRICING = {'input': 0.001, 'output': 0.002}
+# Characters of the last message shown in the chat list
+PREVIEW_LENGTH = 100
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -54,8 +75,13 @@ def register_view(request):
     login(request, user)
     return Response(UserSerializer(user).data)
 
+def wants_sse(request):
+    return request.query_params.get('stream') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+
+
 @api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer])
 def chat_send(request):
     chat_id = request.data.get('chatId')
     content = request.data.get('content')
@@ -65,190 +91,624 @@ def chat_send(request):
         return Response({"error": "Content is required"}, status=400)
         
     
-    # Resolve Workspace Context
-    workspace_id = request.query_params.get('workspace')
-    final_workspace = None
-    if workspace_id:
-        try:
-            from teams.models import WorkspaceMember, Workspace
-            if WorkspaceMember.objects.filter(workspace_id=workspace_id, user=request.user).exists():
-                final_workspace = Workspace.objects.get(id=workspace_id)
-        except Exception as e:
-            print(f"Error resolving workspace: {e}")
+    # Resolve Workspace Context (membership already checked by IsWorkspaceMember)
+    final_workspace_id = request.query_params.get('workspace') or None
 
-    # Get or create chat
+    # Rate, concurrency and budget limits, checked before anything is written
+    try:
+        admission = admit(request.user.id, final_workspace_id)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+
+    try:
+        response = _chat_send(request, admission, chat_id, content, model, final_workspace_id)
+    except Exception:
+        admission.release()
+        raise
+    if not response.streaming:
+        # Rejected before streaming started
+        admission.release()
+    return response
+
+def _rate_limited_response(e):
+    """429 for a RateLimited admission, with Retry-After when the limit says when to retry."""
+    retry_after = retry_after_header(e.retry_after)
+    return Response({"error": str(e), "retry_after": retry_after and int(retry_after)}, status=429,
+                    headers={'Retry-After': retry_after} if retry_after else None)
+
+def _get_or_create_chat(request, chat_id, content, workspace_id):
+    """Returns (chat, None), or (None, error response) when the chat is missing or not accessible."""
     if chat_id:
         try:
             chat = Chat.objects.get(id=chat_id)
             
             # Access Verification
-            has_access = (chat.user == request.user)
-            if not has_access and chat.workspace:
-                 from teams.models import WorkspaceMember
-                 has_access = WorkspaceMember.objects.filter(workspace=chat.workspace, user=request.user).exists()
-            
-            if not has_access:
-                 return Response({"error": "Access denied"}, status=403)
+            if not has_chat_access(request, chat):
+                 return None, Response({"error": "Access denied"}, status=403)
 
         except Chat.DoesNotExist:
-            return Response({"error": "Chat not found"}, status=404)
-    else:
-        chat = Chat.objects.create(user=request.user, title=content[:30], workspace=final_workspace)
-        chat_id = str(chat.id)
+            return None, Response({"error": "Chat not found"}, status=404)
+        return chat, None
+    return Chat.objects.create(user=request.user, title=heuristic_title(content), workspace_id=workspace_id), None
+
+def _log_usage(request, admission, workspace_id, messages, full_response, served_model, usage, cache_status='BYPASS'):
+    """
+    Charge a finished reply's tokens to its admission and queue its UsageLog.
+    Replies served from the completion cache (cache_status 'HIT') cost nothing
+    upstream, so they aren't charged and their price is logged as saved_cost.
+    """
+    cached = cache_status == 'HIT'
+    try:
+        # Whole prompt (all context messages) + completion; upstream usage wins when reported
+        input_tokens, output_tokens = resolve_usage(messages, full_response, served_model, usage)
+        if not cached:
+            admission.charge_tokens(input_tokens + output_tokens)
+
+        # Prices from the model catalog, versioned so the log can be recomputed later
+        from analytics.pricing import get_price_table
+        from analytics.models import UsageLog
+        prices = get_price_table()
+        cost = prices.cost(served_model, input_tokens, output_tokens)
+        usage_log = UsageLog(
+            user=request.user,
+            workspace_id=workspace_id,
+            model_name=served_model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost_estimate=0 if cached else cost,
+            price_version_id=prices.version,
+            cache_status=cache_status,
+            saved_cost=cost if cached else 0,
+        )
+    except Exception as e:
+        logger.error(f"Error logging usage for {served_model}: {e}")
+        return
+    save_later(usage_log)
+
+def _chat_send(request, admission, chat_id, content, model, final_workspace_id):
+    # Get or create chat
+    chat, error = _get_or_create_chat(request, chat_id, content, final_workspace_id)
+    if error:
+        return error
+    chat_id = str(chat.id)
+    is_new_chat = not request.data.get('chatId')
 
     # Save user message
     Message.objects.create(chat=chat, role='user', content=content)
     
-    # Prepare messages for AI
-    messages = []
-    # Add system prompt if needed
-    # messages.append({"role": "system", "content": "You are a helpful assistant."})
-    
-    # Get recent history (optional, for context)
-    recent_messages = chat.messages.all().order_by('created_at')
-    for msg in recent_messages:
-        messages.append({"role": msg.role, "content": msg.content})
+    # Prepare messages for AI: only the recent tail that fits the model's context window
+    messages = build_context(chat, model)
+
+    # Opt-in completion cache, scoped so answers are only replayed within the same workspace (or user)
+    cache_key = None
+    cached = None
+    if request.data.get('cache', getattr(settings, 'COMPLETION_CACHE_DEFAULT', False)):
+        scope = f"ws:{chat.workspace_id}" if chat.workspace_id else f"user:{request.user.id}"
+        cache_key = completion_cache.make_key(scope, model, messages)
+        cached = completion_cache.get_cache().get(cache_key)
         
+    def finalize(full_response):
+        if usage.get('error') and not full_response:
+            # The upstream failed before answering: nothing to save or bill
+            return
+
+        # Save assistant message after stream. Written straight away so the next
+        # turn's context and get_chat see the reply; only the usage log goes behind.
+        # May differ from the requested model when a fallback served the request
+        served_model = usage.get('model') or model
+        Message.objects.create(chat=chat, role='assistant', content=full_response, model=served_model)
+        
+        # Post-stream processing: usage logging
+        _log_usage(request, admission, final_workspace_id, messages, full_response, served_model, usage,
+                   cache_status='HIT' if cached else 'MISS' if cache_key else 'BYPASS')
+
+        # The key names the requested model, so a fallback's answer isn't stored under it
+        if cache_key and not cached and not usage.get('error') and served_model == model:
+            completion_cache.get_cache().set(cache_key, full_response, {
+                key: usage[key] for key in ('prompt_tokens', 'completion_tokens') if key in usage
+            })
+
+    # Filled from the final SSE chunk when the upstream reports usage (plus finish_reason / error)
+    usage = {}
+    if cached:
+        usage.update(cached.usage)
+
     # Stream response
     def generate():
-        full_response = ""
-        for chunk in stream_chat_response(messages, model):
-            full_response += chunk
-            yield chunk
-        
-        # Save assistant message after stream
-        Message.objects.create(chat=chat, role='assistant', content=full_response)
-        
-        # Post-stream processing: Logging
+        parts = []
         try:
-            # 1. Estimate Tokens
-            # Simple char-count estimation (1 token ~= 4 chars)
-            input_tokens = len(content) // 4  # content is user prompt from outer scope
-            output_tokens = len(full_response) // 4
-            
-            # 2. Calculate Cost
-            pricing = MODEL_PRICING.get(model, DEFAULT_PRICING)
-            input_cost = (input_tokens / 1000) * pricing['input']
-            output_cost = (output_tokens / 1000) * pricing['output']
-            total_cost = input_cost + output_cost
-            
-            
-            # 3. Get Workspace Context
-            # Already resolved in outer scope as final_workspace
-            
-            # 4. Create Log
-            from analytics.models import UsageLog
-            UsageLog.objects.create(
-                user=request.user,
-                workspace=final_workspace,
-                model_name=model,
-                input_tokens=input_tokens,
-                output_tokens=output_tokens,
-                cost_estimate=total_cost
-            )
-            
-        except Exception as e:
-            print(f"Error logging usage: {e}")
-        
-    response = StreamingHttpResponse(generate(), content_type='text/plain')
-    response['Chat-Id'] = chat_id
+            chunks = completion_cache.replay(cached.text) if cached else stream_chat_response(messages, model, usage)
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            if usage.get('error'):
+                # Shown to the user, but not saved as part of the reply
+                yield f"Error: {usage['error']}"
+            finalize(''.join(parts))
+        finally:
+            admission.release()
+
+    async def agenerate():
+        # Under ASGI the stream is awaited on the event loop instead of pinning a worker thread
+        parts = []
+        try:
+            chunks = completion_cache.areplay(cached.text) if cached else astream_chat_response(messages, model, usage)
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            if usage.get('error'):
+                yield f"Error: {usage['error']}"
+            await sync_to_async(finalize, thread_sensitive=True)(''.join(parts))
+        finally:
+            admission.release()
 
-    # Generate title in background if it's a new chat (or title is default)
-    if len(messages) <= 2:  # User message + (optional) system prompt
-        def generate_title():
+    is_asgi = isinstance(request._request, ASGIRequest)
+    if wants_sse(request):
+        # The upstream is consumed independently of this connection so clients can resume
+        generation = get_generations().create(request.user.id, chat.id)
+
+        def produce():
             try:
-                import requests
-                import os
-                
-                API_KEY = os.getenv('OPENROUTER_API_KEY')
-                if not API_KEY:
-                    return
+                chunks = completion_cache.replay(cached.text) if cached else stream_chat_response(messages, model, usage)
+                for chunk in chunks:
+                    generation.append(chunk)
+            finally:
+                generation.finish(usage.get('finish_reason'), usage.get('error'))
+                try:
+                    finalize(generation.text())
+                finally:
+                    admission.release()
+                    close_old_connections()
+
+        async def aproduce():
+            try:
+                chunks = completion_cache.areplay(cached.text) if cached else astream_chat_response(messages, model, usage)
+                async for chunk in chunks:
+                    generation.append(chunk)
+            finally:
+                generation.finish(usage.get('finish_reason'), usage.get('error'))
+                try:
+                    await sync_to_async(finalize, thread_sensitive=True)(generation.text())
+                finally:
+                    admission.release()
+
+        async def astart():
+            track_producer(asyncio.create_task(aproduce()))
+
+        if is_asgi:
+            # Started from the view rather than the first read, so a client that drops
+            # before reading still gets its generation finished and its slot released
+            async_to_sync(astart)()
+            response = sse_response(asse_events(generation))
+        else:
+            thread = threading.Thread(target=produce, name='generation-producer', daemon=True)
+            track_producer(thread)
+            thread.start()
+            response = sse_response(sse_events(generation))
+        response['Generation-Id'] = generation.id
+    else:
+        stream = agenerate() if is_asgi else generate()
+        response = StreamingHttpResponse(stream, content_type='text/plain')
+        # Also free the slot if the client goes away before the stream is ever iterated
+        response._resource_closers.append(admission.release)
+    response['Chat-Id'] = chat_id
+    if cache_key:
+        response['X-Cache'] = 'HIT' if cached else 'MISS'
 
-                headers = {
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://tethrai.com", 
-                    "X-Title": "TethrAI"
-                }
-                
-                prompt = f"Generate a very short, concise title (max 5 words) for a chat that starts with this message: '{content}'. Return ONLY the title, no quotes or extra text."
-                
-                data = {
-                    "model": "google/gemini-2.0-flash-exp:free",
-                    "messages": [{"role": "user", "content": prompt}]
-                }
-                
-                resp = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=data)
-                if resp.status_code == 200:
-                    title = resp.json()['choices'][0]['message']['content'].strip().strip('"')
-                    chat.title = title
-                    chat.save()
-            except Exception as e:
-                print(f"Error generating title: {e}")
-
-        import threading
-        threading.Thread(target=generate_title).start()
+    # Replace the heuristic title with a generated one in the background if it's a new chat
+    if is_new_chat:
+        request_title(chat.id, content, chat.title)
+
+    return response
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer])
+def chat_compare(request):
+    """
+    Send one message to several models at once: {"content", "models": [...], "chatId"}.
+    All replies stream back in one SSE response, tagged by branch (see api.compare).
+    """
+    content = request.data.get('content')
+    models = request.data.get('models')
+    if not content:
+        return Response({"error": "Content is required"}, status=400)
+    if not isinstance(models, list) or not models or not all(isinstance(model, str) and model for model in models):
+        return Response({"error": "models must be a non-empty list of model ids"}, status=400)
+    models = list(dict.fromkeys(models))
+    max_models = getattr(settings, 'COMPARE_MAX_MODELS', 4)
+    if len(models) > max_models:
+        return Response({"error": f"At most {max_models} models can be compared at once"}, status=400)
+
+    final_workspace_id = request.query_params.get('workspace') or None
+
+    # One admission for the whole comparison; every branch's tokens are charged to it
+    try:
+        admission = admit(request.user.id, final_workspace_id)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+
+    try:
+        response = _chat_compare(request, admission, request.data.get('chatId'), content, models, final_workspace_id)
+    except Exception:
+        admission.release()
+        raise
+    if not response.streaming:
+        admission.release()
+    return response
+
+def _chat_compare(request, admission, chat_id, content, models, final_workspace_id):
+    chat, error = _get_or_create_chat(request, chat_id, content, final_workspace_id)
+    if error:
+        return error
+
+    Message.objects.create(chat=chat, role='user', content=content)
+    # The same context goes to every model, so fit it to the smallest context window
+    messages = build_context(chat, min(models, key=get_token_budget))
+
+    def finalize(branch):
+        usage = branch.usage
+        full_response = branch.text()
+        if usage.get('error') and not full_response:
+            return False
+        served_model = usage.get('model') or branch.model
+        Message.objects.create(
+            id=branch.message_id, chat=chat, role='assistant', content=full_response,
+            group_id=comparison.group_id, branch=branch.index, model=served_model,
+        )
+        _log_usage(request, admission, final_workspace_id, messages, full_response, served_model, usage)
+        return True
+
+    comparison = Compare(chat.id, models, messages, finalize, on_complete=admission.release)
+    is_asgi = isinstance(request._request, ASGIRequest)
+    response = sse_response(comparison.aevents() if is_asgi else comparison.events())
+    # Also free the slot if the client goes away before the stream is ever iterated
+    response._resource_closers.append(admission.release)
+    response['Chat-Id'] = str(chat.id)
+
+    if not chat_id:
+        request_title(chat.id, content, chat.title)
 
     return response
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer])
+def chat_stream(request, generation_id):
+    """Resume an SSE generation after the offset in Last-Event-ID (or ?offset=)."""
+    generation = get_generations().get(generation_id)
+    if generation is None or generation.user_id != request.user.id:
+        return Response({"error": "Generation not found or expired"}, status=404)
+    offset = parse_offset(request.headers.get('Last-Event-ID') or request.query_params.get('offset'))
+    if isinstance(request._request, ASGIRequest):
+        return sse_response(asse_events(generation, offset))
+    return sse_response(sse_events(generation, offset))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+@read_replica
 def chat_history(request):
     workspace_id = request.query_params.get('workspace')
     
     if workspace_id:
-        # Verify Membership for Collaboration
-        from teams.models import WorkspaceMember
-        if not WorkspaceMember.objects.filter(workspace_id=workspace_id, user=request.user).exists():
-             return Response({"error": "Access denied"}, status=403)
-
         # Shared: Return ALL chats in this workspace (collaboration mode)
         chats = Chat.objects.filter(workspace_id=workspace_id).order_by('-updated_at')
     else:
         # Personal view - show PRIVATE chats (no workspace)
         chats = Chat.objects.filter(user=request.user, workspace__isnull=True).order_by('-updated_at')
-        
-    serializer = ChatSerializer(chats, many=True)
-    return Response(serializer.data)
+
+    # Preview of the newest message, resolved in the same query
+    last_message = Message.objects.filter(chat=OuterRef('pk')).order_by('-created_at').annotate(
+        preview=Substr('content', 1, PREVIEW_LENGTH)
+    ).values('preview')[:1]
+    chats = chats.only('id', 'title', 'created_at', 'updated_at').annotate(last_message=Subquery(last_message))
+
+    paginator = ChatCursorPagination()
+    page = paginator.paginate_queryset(chats, request)
+    serializer = ChatListSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@read_replica
 def get_chat(request, chat_id):
     try:
         chat = Chat.objects.get(id=chat_id)
         
         # Access Verification
-        has_access = (chat.user == request.user)
-        if not has_access and chat.workspace:
-             from teams.models import WorkspaceMember
-             has_access = WorkspaceMember.objects.filter(workspace=chat.workspace, user=request.user).exists()
-        
-        if not has_access:
+        if not has_chat_access(request, chat):
              return Response({"error": "Access denied"}, status=403)
 
-        serializer = ChatSerializer(chat)
-        return Response(serializer.data)
+        # Newest window of messages; `messages_next` points at the older ones
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(Message.objects.filter(chat_id=chat.id), request)
+        messages = list(reversed(page))
+
+        serializer = ChatDetailSerializer(chat, context={
+            'request': request,
+            'messages': messages,
+            'saved_message_ids': saved_message_ids(request.user, chat),
+        })
+        data = serializer.data
+        data['messages_next'] = paginator.get_next_link()
+        return Response(data)
     except Chat.DoesNotExist:
         return Response({"error": "Chat not found"}, status=404)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_models(request):
-    """Get available OpenRouter models with fallback to default list."""
-    from .models_service import get_models_with_fallback
+    """
+    Get available OpenRouter models with fallback to default list.
+
+    Optional filters: vision/fast/code/free=1, max_price (USD per 1M prompt
+    tokens), min_context, q (search), sort (name|context|price), limit/offset,
+    pricing=1 to include raw pricing.
+    """
+    from .models_service import get_catalog, get_model_index, FALLBACK_ERROR
+    from .model_index import CAPABILITIES
     
     try:
-        models, error_msg = get_models_with_fallback()
+        catalog = get_catalog()
+        etag = f'"{catalog["etag"]}"'
+        # Filtered responses differ per query string; the catalog etag still identifies the data
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        params = request.query_params
+        try:
+            max_price = float(params['max_price']) if params.get('max_price') else None
+            min_context = int(params['min_context']) if params.get('min_context') else None
+            limit = min(int(params['limit']), 500) if params.get('limit') else None
+            offset = max(int(params.get('offset', 0)), 0)
+        except ValueError:
+            return Response({"error": "Invalid numeric filter", "models": []}, status=400)
+
+        models, count = get_model_index().query(
+            capabilities=[cap for cap in CAPABILITIES if params.get(cap) in ('1', 'true')],
+            max_price=max_price,
+            min_context=min_context,
+            q=params.get('q', '').strip() or None,
+            sort=params.get('sort'),
+            offset=offset,
+            limit=limit,
+            include_pricing=params.get('pricing') in ('1', 'true'),
+        )
         
         response_data = {
             "models": models,
-            "error": error_msg  # Will be None if API succeeded
+            "count": count,
+            "next_offset": offset + limit if limit is not None and offset + limit < count else None,
+            # Will be None if API succeeded
+            "error": FALLBACK_ERROR if catalog.get("fallback") else None,
         }
         
-        return Response(response_data)
+        response = Response(response_data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=60'
+        return response
         
     except Exception as e:
         return Response({
             "error": f"Failed to retrieve models: {str(e)}",
             "models": []
         }, status=500)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Internal counters for this worker process."""
+    return Response({
+        "write_behind": get_queue().stats(),
+        "completion_cache": completion_cache.get_cache().stats(),
+        "titles": get_title_backend().stats(),
+        "summaries": get_summary_worker().stats(),
+        "upstream_breakers": upstream.breaker_stats(),
+        "rate_limits": get_limiter().stats(),
+        "templates": get_template_cache().stats(),
+        "batches": get_batch_runner().stats(),
+    })
+
+
+def _batch_jobs(request):
+    workspace_id = request.query_params.get('workspace') or None
+    return BatchJob.objects.filter(user=request.user, workspace_id=workspace_id)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+def batch_jobs(request):
+    """
+    GET lists the user's batch jobs. POST starts one:
+    {"template_id": <library item> | "prompt": "...", "inputs": [{...}] | "csv": "...",
+     "models": ["..."], "strict": false}
+    Every input is rendered into the prompt and sent to every model. Returns
+    202 with the job; follow it at /stream/ and read the rows at /results/.
+    """
+    if request.method == 'GET':
+        paginator = BatchJobCursorPagination()
+        page = paginator.paginate_queryset(_batch_jobs(request), request)
+        return paginator.get_paginated_response(BatchJobSerializer(page, many=True).data)
+
+    from knowledge_base.access import visible_items
+    from knowledge_base.prompt_templates import MissingVariables, Template, compile_template, get_template
+
+    template_item = None
+    if request.data.get('template_id'):
+        template_item = visible_items(request).filter(id=request.data['template_id']).first()
+        if template_item is None:
+            return Response({"error": "Template not found"}, status=404)
+        prompt = template_item.content
+        template = get_template(template_item)
+    elif request.data.get('prompt'):
+        prompt = request.data['prompt']
+        template = Template(compile_template(prompt))
+    else:
+        return Response({"error": "template_id or prompt is required"}, status=400)
+
+    if 'csv' in request.data:
+        inputs = list(csv.DictReader(io.StringIO(str(request.data['csv']))))
+    else:
+        inputs = request.data.get('inputs') or [{}]
+    if not isinstance(inputs, list) or not all(isinstance(values, dict) for values in inputs):
+        return Response({"error": "inputs must be a list of objects"}, status=400)
+    models = request.data.get('models') or [request.data.get('model') or DEFAULT_MODEL]
+    if not isinstance(models, list) or not all(isinstance(model, str) and model for model in models):
+        return Response({"error": "models must be a list of model ids"}, status=400)
+    models = list(dict.fromkeys(models))
+
+    max_calls = getattr(settings, 'BATCH_MAX_CALLS', 1000)
+    if len(inputs) * len(models) > max_calls:
+        return Response({"error": f"At most {max_calls} calls (inputs x models) per batch"}, status=400)
+
+    workspace_id = request.query_params.get('workspace') or None
+    try:
+        admission = admit(request.user.id, workspace_id)
+    except RateLimited as e:
+        return _rate_limited_response(e)
+
+    try:
+        strict = bool(request.data.get('strict', False))
+        calls = []
+        for index, values in enumerate(inputs):
+            try:
+                text, error = template.render(values, strict), ''
+            except MissingVariables as e:
+                text, error = '', str(e)
+            calls.extend(Call(index, model, text, error) for model in models)
+
+        job = BatchJob.objects.create(
+            user=request.user, workspace_id=workspace_id, template=template_item, prompt=prompt,
+            model_names=models, inputs=inputs, total=len(calls),
+        )
+        get_batch_runner().start(job, calls, admission)
+    except Exception:
+        admission.release()
+        raise
+    return Response(BatchJobSerializer(job).data, status=202)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+def batch_job(request, job_id):
+    job = _batch_jobs(request).filter(id=job_id).first()
+    if job is None:
+        return Response({"error": "Batch not found"}, status=404)
+    return Response(BatchJobSerializer(job).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+def batch_results(request, job_id):
+    """The job's results so far, in input order (?model= to pick one model)."""
+    if not _batch_jobs(request).filter(id=job_id).exists():
+        return Response({"error": "Batch not found"}, status=404)
+    results = BatchResult.objects.filter(job_id=job_id)
+    if request.query_params.get('model'):
+        results = results.filter(model=request.query_params['model'])
+    paginator = BatchResultCursorPagination()
+    page = paginator.paginate_queryset(results, request)
+    return paginator.get_paginated_response(BatchResultSerializer(page, many=True).data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+def batch_cancel(request, job_id):
+    """Stop dispatching the job's remaining calls; calls already running still finish."""
+    jobs = _batch_jobs(request).filter(id=job_id)
+    jobs.filter(status__in=['PENDING', 'RUNNING']).update(status='CANCELLED')
+    job = jobs.first()
+    if job is None:
+        return Response({"error": "Batch not found"}, status=404)
+    return Response(BatchJobSerializer(job).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer])
+def batch_stream(request, job_id):
+    """
+    Server-sent "progress" events with the job's counters whenever they
+    change, and a final "done" event. Reads the job row, so any worker can
+    serve it.
+    """
+    if not _batch_jobs(request).filter(id=job_id).exists():
+        return Response({"error": "Batch not found"}, status=404)
+    interval = getattr(settings, 'BATCH_PROGRESS_INTERVAL', 0.5)
+
+    def read_job():
+        return BatchJobSerializer(BatchJob.objects.get(id=job_id)).data
+
+    def frames(data, last):
+        """Events for the job's current state; returns (frames, state)."""
+        state = (data['status'], data['completed'], data['failed'])
+        out = [format_event(data, event="progress")] if state != last else []
+        if data['finished_at']:
+            out.append(format_event(data, event="done"))
+        return out, state
+
+    def events():
+        last = None
+        try:
+            while True:
+                data = read_job()
+                out, last = frames(data, last)
+                yield from out
+                if data['finished_at']:
+                    return
+                time.sleep(interval)
+        finally:
+            close_old_connections()
+
+    async def aevents():
+        # Under ASGI a sync iterator would be collected whole before anything is sent
+        last = None
+        while True:
+            data = await sync_to_async(read_job, thread_sensitive=True)()
+            out, last = frames(data, last)
+            for frame in out:
+                yield frame
+            if data['finished_at']:
+                return
+            await asyncio.sleep(interval)
+
+    if isinstance(request._request, ASGIRequest):
+        return sse_response(aevents())
+    return sse_response(events())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+def export_data(request, dataset):
+    """
+    Stream the chats, library or usage of a workspace (?workspace=, admins
+    only) or the user's personal data as NDJSON; usage also as
+    ?output=parquet. See api.exports for the record format.
+    """
+    from teams.access import get_access
+    from . import exports
+
+    if dataset not in exports.DATASETS:
+        return Response({"error": f"Unknown dataset '{dataset}'"}, status=404)
+    workspace_id = request.query_params.get('workspace') or None
+    if workspace_id and not get_access(request).is_admin(workspace_id):
+        return Response({"error": "Only workspace admins can export workspace data"}, status=403)
+
+    scope = f"workspace-{workspace_id}" if workspace_id else request.user.username
+    if request.query_params.get('output') == 'parquet':
+        if dataset != 'usage':
+            return Response({"error": "Parquet export is only available for usage"}, status=400)
+        if not exports.PARQUET_AVAILABLE:
+            return Response({"error": "Parquet export requires pyarrow on the server"}, status=501)
+        chunks = exports.iter_usage_parquet(request.user.id, workspace_id)
+        content_type, filename = 'application/vnd.apache.parquet', f"{scope}-usage.parquet"
+    else:
+        chunks = exports.iter_ndjson(dataset, request.user.id, workspace_id)
+        content_type, filename = 'application/x-ndjson', f"{scope}-{dataset}.ndjson"
+    if isinstance(request._request, ASGIRequest):
+        chunks = exports.aiter_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
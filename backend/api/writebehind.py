@@ -0,0 +1,372 @@
+"""
+Write-behind persistence for rows produced after a chat stream finishes.
+
+Usage logs are handed to a background worker instead of being inserted inside
+the response iterator. (Assistant messages are written synchronously, since the
+next turn reads them straight back.) The worker flushes them with
+bulk_create once a batch fills up or a short window elapses. Every record is
+first appended to an on-disk spool, so rows queued by a process that dies are
+replayed by the next process that starts.
+
+Each process writes its own spool, named by pid and a random id (containers
+often restart with the same pid) and locked for as long as the process lives.
+Spools are only ever appended to or truncated by the process that created
+them; the others are replayed when a worker starts (see start()).
+
+Replays are idempotent: records carry a unique key (UsageLog.request_id, or
+the primary key, e.g. Message.id) and rows whose key is already in the table
+are skipped.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import django.dispatch
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows: owners are found by pid instead
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Sent after each bulk insert with sender=<model class> and objects=<list of instances>.
+# `objects` holds only the rows that insert added (replayed duplicates are left
+# out), read back from the database so their pk is set.
+objects_flushed = django.dispatch.Signal()
+
+# Field assigned a fresh UUID when missing, so a replayed record can't be inserted twice
+IDEMPOTENCY_KEYS = {
+    'analytics.usagelog': 'request_id',
+}
+
+
+class WriteBehindQueue:
+    def __init__(self, spool_dir, batch_size=100, flush_interval=0.5, fsync=False, compact_bytes=1024 * 1024):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.max_attempts = 5
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._unflushed = {}  # seq -> record, everything in the spool not yet committed
+        self._seq = 0
+        self._spool = None
+        self._spool_path = None
+        self._thread = None
+        self._pid = None
+
+        self.flushed_total = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    # Public API
+
+    def start(self):
+        """Start the worker and replay spools left by dead processes."""
+        self._ensure_started()
+
+    def enqueue(self, instance):
+        """Queue an unsaved model instance for insertion."""
+        self._ensure_started()
+        record = self._serialize(instance)
+        with self._lock:
+            self._seq += 1
+            record['seq'] = self._seq
+            self._unflushed[self._seq] = record
+            self._append_to_spool(record)
+        self._queue.put(record)
+
+    def flush(self, timeout=5):
+        """Block until everything queued so far has been written (used at shutdown)."""
+        deadline = time.monotonic() + timeout
+        while self._unflushed and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "unflushed": len(self._unflushed),
+            "flushed_total": self.flushed_total,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+    # Worker
+
+    def _ensure_started(self):
+        # Re-start after fork (gunicorn preload) since threads don't survive it
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._spool is not None:
+                # Inherited across fork: the parent's spool stays the parent's
+                self._spool.close()
+            self._pid = os.getpid()
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            self._spool_path = self.spool_dir / f"spool-{self._pid}-{uuid.uuid4().hex[:12]}.jsonl"
+            # Exclusive create, so a file another process left behind is never adopted,
+            # and locked before it gets a name other workers would replay
+            creating = self._spool_path.with_suffix('.new')
+            self._spool = open(creating, 'x', encoding='utf-8')
+            if fcntl is not None:
+                fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            creating.rename(self._spool_path)
+            if self._thread is None:
+                # Give the worker a chance to drain on clean interpreter exit
+                atexit.register(self.flush)
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+        self._replay_orphaned_spools()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            self._insert(batch)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Write-behind flush failed ({len(batch)} records): {e}")
+            self._retry_individually(batch)
+            return
+        finally:
+            close_old_connections()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.flushed_total += len(batch)
+        self._commit(batch)
+
+    def _insert(self, batch):
+        by_model = defaultdict(list)
+        for record in batch:
+            by_model[record['model']].append(record)
+
+        flushed = []
+        with transaction.atomic():
+            for label, records in by_model.items():
+                model = apps.get_model(label)
+                objs = [self._deserialize(model, record) for record in records]
+                flushed.append((model, self._insert_new(model, objs)))
+
+        for model, objs in flushed:
+            if objs:
+                objects_flushed.send(sender=model, objects=objs)
+
+    def _insert_new(self, model, objs):
+        """Insert the objects whose key isn't in the table yet; returns them as saved rows."""
+        key = IDEMPOTENCY_KEYS.get(model._meta.label_lower, model._meta.pk.attname)
+        existing = set(model.objects.filter(**{f'{key}__in': [getattr(obj, key) for obj in objs]})
+                       .values_list(key, flat=True))
+        new = [obj for obj in objs if getattr(obj, key) not in existing]
+        if not new:
+            return []
+        model.objects.bulk_create(new, ignore_conflicts=True)
+        # ignore_conflicts leaves pk unset, so read the rows back for the receivers
+        return list(model.objects.filter(**{f'{key}__in': [getattr(obj, key) for obj in new]}))
+
+    def _retry_individually(self, batch):
+        # Isolate bad records so one row (e.g. its chat was deleted) can't block the rest
+        done = []
+        for record in batch:
+            try:
+                self._insert([record])
+                done.append(record)
+            except Exception as e:
+                record['attempts'] = record.get('attempts', 0) + 1
+                if record['attempts'] >= self.max_attempts:
+                    logger.error(f"Dropping write-behind record after {record['attempts']} attempts: {record} ({e})")
+                    done.append(record)
+                else:
+                    self._queue.put(record)
+            finally:
+                close_old_connections()
+        self.flushed_total += len(done)
+        self._commit(done)
+        if len(done) < len(batch):
+            time.sleep(1)
+
+    # Spool
+
+    def _append_to_spool(self, record):
+        self._spool.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+        self._spool.flush()
+        if self.fsync:
+            os.fsync(self._spool.fileno())
+
+    def _commit(self, batch):
+        with self._lock:
+            for record in batch:
+                self._unflushed.pop(record['seq'], None)
+            if not self._unflushed:
+                self._spool.truncate(0)
+                self._spool.seek(0)
+            elif self._spool.tell() > self.compact_bytes:
+                # Rewrite the spool with only the records still pending
+                self._spool.truncate(0)
+                self._spool.seek(0)
+                for record in self._unflushed.values():
+                    self._append_to_spool(record)
+
+    def _replay_orphaned_spools(self):
+        for path in self.spool_dir.glob('spool-*.jsonl'):
+            if path == self._spool_path:
+                continue
+            claimed = self._claim(path)
+            if claimed is None:
+                continue
+
+            count = 0
+            with open(claimed, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line from a crash
+                    with self._lock:
+                        self._seq += 1
+                        record['seq'] = self._seq
+                        self._unflushed[self._seq] = record
+                        self._append_to_spool(record)
+                    self._queue.put(record)
+                    count += 1
+            claimed.unlink()
+            if count:
+                logger.warning(f"Replaying {count} write-behind records from {path.name}")
+
+    def _claim(self, path):
+        """Move another process's spool aside for replay if that process is gone; returns the new path or None."""
+        parts = path.stem.split('-')
+        try:
+            pid = int(parts[1])
+        except (IndexError, ValueError):
+            return None
+        try:
+            f = open(path, encoding='utf-8')
+        except OSError:
+            return None  # claimed by another worker in the meantime
+        with f:
+            if fcntl is not None and len(parts) > 2:
+                # Live owners hold a lock on their spool, whatever their pid
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            elif pid != os.getpid() and _pid_alive(pid):
+                # A spool with our pid isn't ours, so it belongs to an earlier process
+                # (e.g. before a container restart); others are live while their pid is
+                return None
+            # Renamed while locked so two starting workers don't both replay it
+            claimed = path.with_name(f"replay-{self._spool_path.stem}-{path.name}")
+            try:
+                path.rename(claimed)
+            except OSError:
+                return None
+        return claimed
+
+    # Serialization
+
+    def _serialize(self, instance):
+        label = instance._meta.label_lower
+        key = IDEMPOTENCY_KEYS.get(label)
+        if key and getattr(instance, key) is None:
+            setattr(instance, key, uuid.uuid4())
+
+        fields = {}
+        for field in instance._meta.concrete_fields:
+            value = field.value_from_object(instance)
+            if field.primary_key and value is None:
+                continue
+            fields[field.attname] = value
+        return {'model': label, 'fields': json.loads(json.dumps(fields, cls=DjangoJSONEncoder))}
+
+    def _deserialize(self, model, record):
+        values = {}
+        for attname, value in record['fields'].items():
+            field = model._meta.get_field(attname)
+            values[attname] = field.to_python(value) if value is not None else None
+        return model(**values)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_default_queue = None
+_default_lock = threading.Lock()
+
+
+def get_queue():
+    global _default_queue
+    if _default_queue is None:
+        with _default_lock:
+            if _default_queue is None:
+                _default_queue = WriteBehindQueue(
+                    spool_dir=getattr(settings, 'WRITE_BEHIND_SPOOL_DIR', settings.BASE_DIR / 'spool'),
+                    batch_size=getattr(settings, 'WRITE_BEHIND_BATCH_SIZE', 100),
+                    flush_interval=getattr(settings, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.5),
+                    fsync=getattr(settings, 'WRITE_BEHIND_FSYNC', False),
+                )
+    return _default_queue
+
+
+def start():
+    """Start this process's write-behind worker, replaying what dead workers left in the spool."""
+    if getattr(settings, 'WRITE_BEHIND_ENABLED', True):
+        get_queue().start()
+
+
+def save_later(*instances):
+    """
+    Persist model instances via the write-behind queue, or immediately when
+    WRITE_BEHIND_ENABLED is off (tests, management commands).
+    """
+    if not getattr(settings, 'WRITE_BEHIND_ENABLED', True):
+        for instance in instances:
+            instance.save()
+            objects_flushed.send(sender=type(instance), objects=[instance])
+        return
+    q = get_queue()
+    for instance in instances:
+        q.enqueue(instance)
@@ -0,0 +1,78 @@
+"""
+Production server config: gunicorn managing uvicorn workers running the ASGI app.
+
+    gunicorn -c gunicorn.conf.py
+
+Chat streams are awaited on each worker's event loop, so a worker holds
+thousands of open streams and the worker count only needs to match the CPU
+cores. On SIGTERM a worker stops accepting connections, waits up to
+GUNICORN_GRACEFUL_TIMEOUT for open streams, then drains detached SSE
+generations and the write-behind queue (tethrai_backend.asgi).
+
+Workspace access, rate limits and budgets are kept in the Django cache, which
+is per process unless REDIS_URL (or CACHE_DIR) configures a shared one, so
+the default is a single worker until it does. Resumable SSE generations and
+the completion cache always live in each worker: with several workers, route
+a client to the same one (sticky sessions) for resume to work.
+
+GUNICORN_WORKER_CLASS=gthread runs the WSGI app instead (one thread per open
+stream; size GUNICORN_THREADS accordingly).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+shared_cache = bool(os.getenv('REDIS_URL') or os.getenv('CACHE_DIR'))
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() if shared_cache else 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+
+if worker_class == 'gthread':
+    wsgi_app = 'tethrai_backend.wsgi:application'
+else:
+    wsgi_app = 'tethrai_backend.asgi:application'
+
+# Streams can stay open for minutes; the worker heartbeat is independent of request length
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '120'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+backlog = 2048
+
+# Recycle workers now and then to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Background threads (write-behind, title workers) are started lazily per process,
+# so preloading is safe, but keep it off so code reloads per worker on restart
+preload_app = False
+
+
+def post_worker_init(worker):
+    # gthread workers: replay write-behind spools left by dead workers before serving
+    # (uvicorn workers do this in the ASGI lifespan startup instead)
+    if worker_class != 'gthread':
+        return
+    from api.writebehind import start
+
+    start()
+
+
+def worker_exit(server, worker):
+    # gthread workers: let detached SSE producer threads finish and flush their writes
+    # (uvicorn workers do this in the ASGI lifespan shutdown instead)
+    if worker_class != 'gthread':
+        return
+    from django.conf import settings
+    from api.generations import drain_producers
+    from api.writebehind import get_queue
+    from tethrai_backend.health import start_draining
+
+    start_draining()
+    left = drain_producers(getattr(settings, 'SHUTDOWN_DRAIN_TIMEOUT', 60))
+    if left:
+        server.log.warning(f"Worker {worker.pid} exiting with {left} generations still running")
+    get_queue().flush()
@@ -0,0 +1,24 @@
+from django.db.models import Q
+
+from teams.access import get_access
+from .models import LibraryItem
+
+
+def visible_items(request):
+    """
+    Library items the user can see: their own (private or otherwise, in any
+    workspace) plus, with ?workspace=, the items shared with that workspace or
+    with one of the user's sub-teams there.
+
+    LibraryItem.audience holds the one audience each item is shared with, so
+    this stays two indexed lookups on a single table: no joins and no DISTINCT.
+    """
+    visible = Q(user=request.user)
+    workspace_id = request.query_params.get('workspace')
+    if workspace_id:
+        access = get_access(request)
+        if access.is_member(workspace_id):
+            audiences = [f"ws:{int(workspace_id)}"]
+            audiences += [f"sub:{subteam_id}" for subteam_id in access.subteam_ids(workspace_id)]
+            visible |= Q(audience__in=audiences)
+    return LibraryItem.objects.filter(visible)
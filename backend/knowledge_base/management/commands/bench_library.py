@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from knowledge_base.models import LibraryItem, Tag
+from knowledge_base.views import LibraryItemViewSet
+from teams.models import Workspace, WorkspaceMember, SubTeam
+
+
+class LegacyLibraryItemViewSet(LibraryItemViewSet):
+    """The listing as it was: OR over a sub-team subquery, DISTINCT, lazy tags, unpaginated."""
+    pagination_class = None
+
+    def get_queryset(self):
+        user = self.request.user
+        workspace_id = self.request.query_params.get('workspace')
+        subteam_ids = user.subteams.filter(workspace_id=workspace_id).values_list('id', flat=True)
+        query = Q(user=user) | Q(workspace_id=workspace_id, visibility='WORKSPACE') | Q(
+            subteam_id__in=subteam_ids, visibility='SUBTEAM')
+        return LibraryItem.objects.filter(query).distinct().order_by('-created_at')
+
+
+class UnpaginatedLibraryItemViewSet(LibraryItemViewSet):
+    """The new query without pagination, to separate the two effects."""
+    pagination_class = None
+
+
+class Command(BaseCommand):
+    help = "Benchmark the library listing for a workspace member across workspace sizes (data is rolled back)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000', help="Library items per workspace")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'items':>7} {'visible':>8} {'variant':<24} {'queries':>8} {'p50':>9} {'rows':>6}")
+        for size in [int(x) for x in options['sizes'].split(',') if x]:
+            with transaction.atomic():
+                viewer, workspace, visible = self.populate(size)
+                for name, viewset in (('legacy (full list)', LegacyLibraryItemViewSet),
+                                      ('audience (full list)', UnpaginatedLibraryItemViewSet),
+                                      ('audience (first page)', LibraryItemViewSet)):
+                    queries, p50, rows = self.measure(viewset, viewer, workspace, options['repeat'])
+                    self.stdout.write(f"{size:>7} {visible:>8} {name:<24} {queries:>8} {p50:>7.1f}ms {rows:>6}")
+                transaction.set_rollback(True)
+
+    def populate(self, size):
+        rng = random.Random(size)
+        suffix = f"{size}-{rng.random():.8f}"
+        users = [User(username=f"bench-lib-{suffix}-{i}") for i in range(20)]
+        User.objects.bulk_create(users)
+        users = list(User.objects.filter(username__startswith=f"bench-lib-{suffix}-"))
+        viewer = users[0]
+        workspace = Workspace.objects.create(name=f"bench {suffix}", owner=viewer)
+        WorkspaceMember.objects.bulk_create([WorkspaceMember(workspace=workspace, user=u) for u in users])
+        subteams = [SubTeam.objects.create(workspace=workspace, name=f"team {i}") for i in range(10)]
+        for subteam in subteams[:2]:
+            subteam.members.add(viewer)
+        tags = Tag.objects.bulk_create([Tag(name=f"bench-{suffix}-{i}") for i in range(20)])
+
+        items = []
+        for i in range(size):
+            owner = rng.choice(users)
+            visibility = rng.choices(['WORKSPACE', 'SUBTEAM', 'PRIVATE'], [4, 3, 3])[0]
+            subteam = rng.choice(subteams) if visibility == 'SUBTEAM' else None
+            items.append(LibraryItem(
+                user=owner, title=f"Item {i}", content="prompt text " * 20, workspace=workspace,
+                subteam=subteam, visibility=visibility,
+                # bulk_create skips save(), so set the audience like save() would
+                audience=LibraryItem.audience_for(visibility, workspace.id, subteam and subteam.id, owner.id),
+            ))
+        items = LibraryItem.objects.bulk_create(items, batch_size=2000)
+        Through = LibraryItem.tags.through
+        Through.objects.bulk_create([
+            Through(libraryitem_id=item.id, tag_id=tag.id) for item in items for tag in rng.sample(tags, 2)
+        ], batch_size=5000)
+
+        visible = sum(
+            1 for item in items
+            if item.user_id == viewer.id or item.visibility == 'WORKSPACE'
+            or (item.visibility == 'SUBTEAM' and item.subteam_id in {s.id for s in subteams[:2]})
+        )
+        return viewer, workspace, visible
+
+    def measure(self, viewset, user, workspace, repeat):
+        factory = APIRequestFactory()
+        view = viewset.as_view({'get': 'list'})
+        timings = []
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        for _ in range(repeat):
+            request = factory.get('/api/knowledge/library/', {'workspace': workspace.id})
+            force_authenticate(request, user=user)
+            queries[0] = 0
+            with connection.execute_wrapper(count):
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - start) * 1000)
+        data = response.data
+        rows = len(data['results'] if isinstance(data, dict) else data)
+        return queries[0], statistics.median(timings), rows
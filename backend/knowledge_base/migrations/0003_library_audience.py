@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, CharField, Value, When
+from django.db.models.functions import Cast, Concat
+
+
+def fill_audience(apps, schema_editor):
+    LibraryItem = apps.get_model('knowledge_base', 'LibraryItem')
+    LibraryItem.objects.update(audience=Case(
+        When(visibility='WORKSPACE', workspace__isnull=False,
+             then=Concat(Value('ws:'), Cast('workspace_id', CharField()))),
+        When(visibility='SUBTEAM', subteam__isnull=False,
+             then=Concat(Value('sub:'), Cast('subteam_id', CharField()))),
+        default=Concat(Value('user:'), Cast('user_id', CharField())),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_chat_message_indexes'),
+        ('knowledge_base', '0002_libraryitem_subteam_libraryitem_visibility_and_more'),
+        ('teams', '0003_workspace_monthly_budget'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libraryitem',
+            name='audience',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(fill_audience, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='libraryitem',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='library_owner_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='libraryitem',
+            index=models.Index(fields=['audience', '-created_at', '-id'], name='library_audience_recent'),
+        ),
+    ]
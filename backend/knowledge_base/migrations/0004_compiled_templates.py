@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:32
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of knowledge_base.prompt_templates as of this migration, so later
+# changes to the template syntax don't change what this backfill did
+VARIABLE_RE = re.compile(r"\{\{\s*([A-Za-z_][\w.\-]*)\s*\}\}")
+
+
+def compile_existing(apps, schema_editor):
+    LibraryItem = apps.get_model('knowledge_base', 'LibraryItem')
+    last_id = 0
+    while True:
+        items = list(LibraryItem.objects.filter(id__gt=last_id).order_by('id').only('id', 'content')[:1000])
+        if not items:
+            break
+        for item in items:
+            item.compiled = VARIABLE_RE.split(item.content or '')
+            item.variables = list(dict.fromkeys(item.compiled[1::2]))
+        LibraryItem.objects.bulk_update(items, ['compiled', 'variables'])
+        last_id = items[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge_base', '0003_library_audience'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libraryitem',
+            name='compiled',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(compile_existing, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from api.models import Message
+from .prompt_templates import compile_template, variable_names
 # Late import to prevent circular dependency if using strings, but direct import is fine if apps are loaded
 # Using string references for 'teams.Workspace' etc is safer.
 
@@ -29,6 +30,8 @@ class LibraryItem(models.Model):
     content = models.TextField(help_text="Stores the prompt text or template content.")
     item_type = models.CharField(max_length=20, choices=ITEM_TYPES, default='PROMPT')
     variables = models.JSONField(default=list, blank=True, help_text="Extracted {{variables}} for Templates")
+    # Content split into literals and variable names (knowledge_base.prompt_templates), set on save
+    compiled = models.JSONField(default=list, blank=True, editable=False)
     original_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='saved_items')
     tags = models.ManyToManyField(Tag, blank=True, related_name='items')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -38,6 +41,33 @@ class LibraryItem(models.Model):
     workspace = models.ForeignKey('teams.Workspace', on_delete=models.CASCADE, null=True, blank=True, related_name='library_items')
     subteam = models.ForeignKey('teams.SubTeam', on_delete=models.SET_NULL, null=True, blank=True, related_name='library_items')
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='PRIVATE')
+    # Who besides the owner can list the item: "ws:<id>", "sub:<id>" or "user:<owner id>".
+    # Derived from the fields above on save (querysets that .update() them must set it too,
+    # and call search.indexing.reindex_library_items).
+    audience = models.CharField(max_length=32, editable=False, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='library_owner_recent'),
+            models.Index(fields=['audience', '-created_at', '-id'], name='library_audience_recent'),
+        ]
+
+    @staticmethod
+    def audience_for(visibility, workspace_id, subteam_id, user_id):
+        if visibility == 'WORKSPACE' and workspace_id:
+            return f"ws:{workspace_id}"
+        if visibility == 'SUBTEAM' and subteam_id:
+            return f"sub:{subteam_id}"
+        return f"user:{user_id}"
+
+    def save(self, *args, **kwargs):
+        self.audience = self.audience_for(self.visibility, self.workspace_id, self.subteam_id, self.user_id)
+        self.compiled = compile_template(self.content)
+        self.variables = variable_names(self.compiled)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'audience', 'compiled', 'variables'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.title} ({self.get_item_type_display()})"
@@ -0,0 +1,112 @@
+"""
+{{variable}} templates for library items.
+
+A template is parsed once, when the item is saved, into its literal text and
+placeholder names (LibraryItem.compiled, see `compile_template`). Rendering
+only joins those parts with the values, so filling a template many times,
+e.g. once per row of a CSV, never parses it again. Recently used templates
+are also kept in a small in-process LRU (TEMPLATE_CACHE_SIZE) so repeated
+renders skip rebuilding them from the stored JSON.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+# {{ name }}; names may contain dots and dashes ({{customer.name}}, {{due-date}})
+VARIABLE_RE = re.compile(r"\{\{\s*([A-Za-z_][\w.\-]*)\s*\}\}")
+
+
+class MissingVariables(ValueError):
+    def __init__(self, names):
+        super().__init__(f"Missing variables: {', '.join(names)}")
+        self.names = names
+
+
+def compile_template(content):
+    """
+    Split `content` into alternating literals and variable names:
+    ["Dear ", "name", ", your order ", "order_id", " shipped."]
+    (even indexes are literal text, odd indexes are names).
+    """
+    return VARIABLE_RE.split(content or '')
+
+
+def variable_names(compiled):
+    """Distinct variable names, in order of first appearance."""
+    return list(dict.fromkeys(compiled[1::2]))
+
+
+class Template:
+    __slots__ = ('head', 'slots', 'variables')
+
+    def __init__(self, compiled):
+        self.head = compiled[0] if compiled else ''
+        # (variable name, literal text that follows it)
+        self.slots = tuple(zip(compiled[1::2], compiled[2::2]))
+        self.variables = variable_names(compiled)
+
+    def render(self, values, strict=False):
+        """
+        Fill in `values`. Missing variables raise MissingVariables when
+        `strict`, otherwise their placeholder is left in the text.
+        """
+        if strict:
+            missing = [name for name in self.variables if values.get(name) is None]
+            if missing:
+                raise MissingVariables(missing)
+        out = [self.head]
+        for name, literal in self.slots:
+            value = values.get(name)
+            out.append(f"{{{{{name}}}}}" if value is None else str(value))
+            out.append(literal)
+        return ''.join(out)
+
+
+class TemplateCache:
+    """LRU of Template objects keyed by item id and last update."""
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, item):
+        key = (item.pk, item.updated_at)
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        # Items saved before templates were compiled have no stored representation yet
+        template = Template(item.compiled or compile_template(item.content))
+        with self._lock:
+            self._entries[key] = template
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return template
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TemplateCache(getattr(settings, 'TEMPLATE_CACHE_SIZE', 512))
+    return _cache
+
+
+def get_template(item):
+    return get_cache().get(item)
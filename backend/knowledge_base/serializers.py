@@ -24,7 +24,8 @@ class LibraryItemSerializer(serializers.ModelSerializer):
             'variables', 'original_message', 'tags', 'tag_ids',
             'created_at', 'updated_at', 'is_template'
         ]
-        read_only_fields = ['user', 'created_at', 'updated_at']
+        # variables are extracted from the content on save
+        read_only_fields = ['user', 'variables', 'created_at', 'updated_at']
 
     def get_is_template(self, obj):
         return obj.item_type == 'TEMPLATE'
@@ -0,0 +1,17 @@
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from teams.models import SubTeam
+
+from .models import LibraryItem
+
+
+@receiver(post_delete, sender=SubTeam)
+def subteam_deleted(sender, instance, **kwargs):
+    # on_delete=SET_NULL cleared the items' subteam with an UPDATE that skipped save(),
+    # so their audience still names the deleted sub-team; with no sub-team it's the owner's
+    LibraryItem.objects.filter(audience=f"sub:{instance.id}").update(
+        audience=Concat(Value('user:'), Cast('user_id', CharField()))
+    )
@@ -1,3 +1,121 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from teams.models import SubTeam, Workspace, WorkspaceMember
+
+from .models import LibraryItem
+
+
+class LibraryAudienceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.member = User.objects.create_user('member', password='pw')
+        self.workspace = Workspace.objects.create(name='Team', owner=self.owner)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.owner, role='OWNER')
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.member)
+        self.subteam = SubTeam.objects.create(workspace=self.workspace, name='Design')
+        self.subteam.members.add(self.member)
+
+    def item(self, visibility, subteam=None, title='Item'):
+        return LibraryItem.objects.create(user=self.owner, title=title, content='text', workspace=self.workspace,
+                                          subteam=subteam, visibility=visibility)
+
+    def test_audience_follows_visibility(self):
+        self.assertEqual(self.item('WORKSPACE').audience, f"ws:{self.workspace.id}")
+        self.assertEqual(self.item('SUBTEAM', self.subteam).audience, f"sub:{self.subteam.id}")
+        self.assertEqual(self.item('PRIVATE', self.subteam).audience, f"user:{self.owner.id}")
+        # Shared with a sub-team but no sub-team set: only the owner
+        self.assertEqual(self.item('SUBTEAM').audience, f"user:{self.owner.id}")
+
+    def test_audience_is_saved_with_update_fields(self):
+        item = self.item('PRIVATE')
+        item.visibility = 'WORKSPACE'
+        item.save(update_fields=['visibility'])
+        item.refresh_from_db()
+        self.assertEqual(item.audience, f"ws:{self.workspace.id}")
+
+    def test_deleted_subteam_falls_back_to_the_owner(self):
+        item = self.item('SUBTEAM', self.subteam)
+        # on_delete=SET_NULL updates the item without calling save()
+        self.subteam.delete()
+        item.refresh_from_db()
+        self.assertIsNone(item.subteam_id)
+        self.assertEqual(item.audience, f"user:{self.owner.id}")
+
+    def list_titles(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get('/api/knowledge/library/', {'workspace': self.workspace.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()['results']]
+
+    def test_listing_shows_shared_items_only(self):
+        self.item('WORKSPACE', title='workspace')
+        self.item('SUBTEAM', self.subteam, title='design')
+        self.item('SUBTEAM', SubTeam.objects.create(workspace=self.workspace, name='Finance'), title='finance')
+        self.item('PRIVATE', title='private')
+        self.assertEqual(sorted(self.list_titles(self.member)), ['design', 'workspace'])
+        self.assertEqual(len(self.list_titles(self.owner)), 4)
+
+    def test_cursor_pages_cover_every_item_once(self):
+        titles = [f'item {i}' for i in range(5)]
+        for title in titles:
+            self.item('WORKSPACE', title=title)
+
+        self.client.force_login(self.member)
+        seen = []
+        url = f'/api/knowledge/library/?workspace={self.workspace.id}&limit=2'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen += [item['title'] for item in page['results']]
+            url = page['next']
+        # Newest first, ties on created_at broken by id
+        self.assertEqual(seen, titles[::-1])
+
+
+class TemplateRenderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.item = LibraryItem.objects.create(user=self.user, title='Letter', item_type='TEMPLATE',
+                                               content='Dear {{ name }}, order {{order_id}} for {{name}} shipped.')
+        self.client.force_login(self.user)
+
+    def render(self, **data):
+        response = self.client.post(f'/api/knowledge/library/{self.item.id}/render/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_compiled_on_save(self):
+        self.assertEqual(self.item.compiled, ['Dear ', 'name', ', order ', 'order_id', ' for ', 'name', ' shipped.'])
+        self.assertEqual(self.item.variables, ['name', 'order_id'])
+
+    def test_extra_variables_are_ignored(self):
+        data = self.render(variables={'name': 'Ada', 'order_id': 7, 'unused': 'x'})
+        self.assertEqual(data['results'], [{'text': 'Dear Ada, order 7 for Ada shipped.'}])
+        self.assertEqual(data['variables'], ['name', 'order_id'])
+
+    def test_missing_variables_keep_their_placeholder(self):
+        data = self.render(variables={'name': 'Ada'})
+        self.assertEqual(data['results'], [{'text': 'Dear Ada, order {{order_id}} for Ada shipped.'}])
+
+    def test_strict_reports_missing_variables_per_input(self):
+        data = self.render(inputs=[{'name': 'Ada', 'order_id': 1}, {'name': 'Bob'}, {}], strict=True)
+        self.assertEqual(data['results'], [
+            {'text': 'Dear Ada, order 1 for Ada shipped.'},
+            {'error': 'Missing variables: order_id', 'missing': ['order_id']},
+            {'error': 'Missing variables: name, order_id', 'missing': ['name', 'order_id']},
+        ])
+
+    def test_csv_rows_are_rendered(self):
+        data = self.render(csv='name,order_id\nAda,1\nBob,2\n')
+        self.assertEqual([result['text'] for result in data['results']], [
+            'Dear Ada, order 1 for Ada shipped.', 'Dear Bob, order 2 for Bob shipped.',
+        ])
+
+    def test_edited_template_is_not_served_from_the_cache(self):
+        self.render(variables={'name': 'Ada'})
+        self.item.content = 'Hi {{name}}'
+        self.item.save()
+        self.assertEqual(self.render(variables={'name': 'Ada'})['results'], [{'text': 'Hi Ada'}])
@@ -1,50 +1,63 @@
+import csv
+import io
+
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from .models import LibraryItem, Tag
 from .serializers import LibraryItemSerializer, TagSerializer
+from .prompt_templates import get_template, MissingVariables
 from api.models import Message
+from api.pagination import LibraryCursorPagination
+from teams.access import IsWorkspaceMember
+from .access import visible_items
+from tethrai_backend.db_routers import read_replica
 
 class LibraryItemViewSet(viewsets.ModelViewSet):
     serializer_class = LibraryItemSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsWorkspaceMember]
+    pagination_class = LibraryCursorPagination
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = LibraryItem.objects.all()
+        return visible_items(self.request).prefetch_related('tags').order_by('-created_at', '-id')
 
-        # 1. Always include private items owned by user
-        # We will build a complex query using Q objects
-        from django.db.models import Q
-        
-        # Base filter: Own items
-        base_query = Q(user=user)
+    @read_replica
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
-        # 2. Check for active workspace context
-        workspace_id = self.request.query_params.get('workspace')
-        
-        if workspace_id:
-            # Verify membership
-            from teams.models import WorkspaceMember
-            is_member = WorkspaceMember.objects.filter(workspace_id=workspace_id, user=user).exists()
-            
-            if is_member:
-                # Include Workspace-visible items
-                workspace_query = Q(workspace_id=workspace_id, visibility='WORKSPACE')
-                
-                # Include Subteam-visible items (if user is in that subteam)
-                # First, get user's subteams in this workspace
-                user_subteam_ids = user.subteams.filter(workspace_id=workspace_id).values_list('id', flat=True)
-                subteam_query = Q(subteam_id__in=user_subteam_ids, visibility='SUBTEAM')
-                
-                # Combine
-                final_query = base_query | workspace_query | subteam_query
-                return queryset.filter(final_query).distinct().order_by('-created_at')
+    @action(detail=True, methods=['post'], url_path='render')
+    def render_template(self, request, pk=None):
+        """
+        Fill the item's {{variables}}. Send {"variables": {...}} for one result,
+        or {"inputs": [{...}, ...]} or {"csv": "<header row>\n<rows>"} for many.
+        With "strict": true, results missing a variable get an error instead of
+        keeping the placeholder.
+        """
+        item = self.get_object()
+        template = get_template(item)
+        strict = bool(request.data.get('strict', False))
+
+        if 'csv' in request.data:
+            inputs = list(csv.DictReader(io.StringIO(str(request.data['csv']))))
+        elif 'inputs' in request.data:
+            inputs = request.data['inputs']
+        else:
+            inputs = [request.data.get('variables') or {}]
+
+        if not isinstance(inputs, list) or not all(isinstance(values, dict) for values in inputs):
+            return Response({"error": "inputs must be a list of objects"}, status=status.HTTP_400_BAD_REQUEST)
+        max_inputs = getattr(settings, 'TEMPLATE_RENDER_MAX_INPUTS', 1000)
+        if len(inputs) > max_inputs:
+            return Response({"error": f"At most {max_inputs} inputs per request"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Default: Only return own items (Private or otherwise, but since we only see WORKSPACE items if workspace_id is set...)
-        # Actually, if I created an item with visibility=WORKSPACE but I am viewing "My Library" (no workspace set), 
-        # I should still see it because I own it.
-        return queryset.filter(base_query).order_by('-created_at')
+        results = []
+        for values in inputs:
+            try:
+                results.append({"text": template.render(values, strict)})
+            except MissingVariables as e:
+                results.append({"error": str(e), "missing": e.names})
+        return Response({"variables": template.variables, "results": results})
 
     @action(detail=False, methods=['post'], url_path='star')
     def toggle_star(self, request):
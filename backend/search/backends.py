@@ -0,0 +1,147 @@
+"""
+Full-text query backends over SearchDocument.
+
+Both backends take the same access filter (built by `access_filter`) and
+return ranked rows with a highlighted snippet. Pick one explicitly with
+SEARCH_BACKEND, otherwise it follows the default database vendor.
+"""
+import datetime
+import html
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+# Control characters used as highlight markers inside the database, swapped
+# for <mark> tags only after the surrounding text has been HTML-escaped
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def render_snippet(snippet):
+    return html.escape(snippet or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def access_filter(user_id, workspace_id=None, subteam_ids=(), kind=None):
+    """
+    SQL fragment (against alias `d`) mirroring what the chat and library
+    listings show in the same scope: personal scope is the user's private
+    chats and own library items; a workspace scope adds every chat in the
+    workspace and the library items shared with it or the user's sub-teams.
+    """
+    if workspace_id:
+        message_sql = "d.workspace_id = %s"
+        message_params = [workspace_id]
+        library_sql = "(d.user_id = %s OR (d.workspace_id = %s AND d.visibility = 'WORKSPACE')"
+        library_params = [user_id, workspace_id]
+        if subteam_ids:
+            library_sql += " OR (d.subteam_id IN ({}) AND d.visibility = 'SUBTEAM')".format(
+                ', '.join(['%s'] * len(subteam_ids))
+            )
+            library_params += list(subteam_ids)
+        library_sql += ")"
+    else:
+        message_sql = "d.user_id = %s AND d.workspace_id IS NULL"
+        message_params = [user_id]
+        library_sql = "d.user_id = %s"
+        library_params = [user_id]
+
+    clauses, params = [], []
+    if kind in (None, 'message'):
+        clauses.append(f"(d.kind = 'message' AND {message_sql})")
+        params += message_params
+    if kind in (None, 'library'):
+        clauses.append(f"(d.kind = 'library' AND {library_sql})")
+        params += library_params
+    return '(' + ' OR '.join(clauses) + ')', params
+
+
+class SearchBackend:
+    def search(self, query, filter_sql, filter_params, limit, offset):
+        """
+        Return a list of dicts: kind, object_id, chat_id, title, snippet,
+        rank (higher is better), created_at.
+        """
+        raise NotImplementedError
+
+    def _fetch(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            columns = [col[0] for col in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            row['snippet'] = render_snippet(row['snippet'])
+            # SQLite hands back raw strings for these columns
+            if row['chat_id'] is not None and not isinstance(row['chat_id'], uuid.UUID):
+                row['chat_id'] = uuid.UUID(str(row['chat_id']))
+            if isinstance(row['created_at'], str):
+                row['created_at'] = parse_datetime(row['created_at'])
+            if row['created_at'] is not None and timezone.is_naive(row['created_at']):
+                row['created_at'] = timezone.make_aware(row['created_at'], datetime.timezone.utc)
+        return rows
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """FTS5 index maintained by triggers (see search/migrations/0002)."""
+
+    @staticmethod
+    def build_match(query):
+        # Quote every term so user input can't hit FTS5 query syntax; the last
+        # term is a prefix match so results update while typing
+        terms = [term.replace('"', '""') for term in query.split()]
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def search(self, query, filter_sql, filter_params, limit, offset):
+        match = self.build_match(query)
+        if match is None:
+            return []
+        sql = f"""
+            SELECT d.kind, d.object_id, d.chat_id, d.title, d.created_at,
+                   snippet(search_fts, 1, %s, %s, '…', 24) AS snippet,
+                   -bm25(search_fts, 2.0, 1.0) AS rank
+            FROM search_fts
+            JOIN search_searchdocument d ON d.id = search_fts.rowid
+            WHERE search_fts MATCH %s AND {filter_sql}
+            ORDER BY rank DESC
+            LIMIT %s OFFSET %s
+        """
+        return self._fetch(sql, [MARK_START, MARK_END, match, *filter_params, limit, offset])
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Generated tsvector column with a GIN index (see search/migrations/0002)."""
+
+    def search(self, query, filter_sql, filter_params, limit, offset):
+        if not query.strip():
+            return []
+        sql = f"""
+            SELECT d.kind, d.object_id, d.chat_id, d.title, d.created_at,
+                   ts_headline('english', d.body, q,
+                               'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=35, MinWords=15') AS snippet,
+                   ts_rank(d.search_vector, q) AS rank
+            FROM search_searchdocument d, websearch_to_tsquery('english', %s) q
+            WHERE d.search_vector @@ q AND {filter_sql}
+            ORDER BY rank DESC
+            LIMIT %s OFFSET %s
+        """
+        return self._fetch(sql, [MARK_START, MARK_END, query, *filter_params, limit, offset])
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS[connection.vendor]()
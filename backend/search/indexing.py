@@ -0,0 +1,95 @@
+"""Keeps SearchDocument rows in step with messages and library items."""
+from django.db import transaction
+
+from .models import SearchDocument
+
+
+def message_documents(messages):
+    """Build documents for messages; chat ownership/workspace is read in one query."""
+    from api.models import Chat
+
+    chat_ids = {message.chat_id for message in messages}
+    chats = {chat['id']: chat for chat in Chat.objects.filter(id__in=chat_ids).values('id', 'user_id', 'workspace_id')}
+    documents = []
+    for message in messages:
+        chat = chats.get(message.chat_id)
+        if chat is None or not message.content:
+            continue
+        documents.append(SearchDocument(
+            kind='message',
+            object_id=str(message.id),
+            body=message.content,
+            user_id=chat['user_id'],
+            workspace_id=chat['workspace_id'],
+            chat_id=message.chat_id,
+            created_at=message.created_at,
+        ))
+    return documents
+
+
+def library_document(item):
+    return SearchDocument(
+        kind='library',
+        object_id=str(item.id),
+        title=item.title,
+        body=item.content,
+        user_id=item.user_id,
+        workspace_id=item.workspace_id,
+        subteam_id=item.subteam_id,
+        visibility=item.visibility,
+        created_at=item.created_at,
+    )
+
+
+def index_messages(messages, batch_size=500):
+    # Messages never change after they're written, so existing documents are left alone
+    SearchDocument.objects.bulk_create(message_documents(messages), batch_size=batch_size, ignore_conflicts=True)
+
+
+def index_library_item(item):
+    document = library_document(item)
+    with transaction.atomic():
+        SearchDocument.objects.filter(kind='library', object_id=document.object_id).delete()
+        document.save()
+
+
+def reindex_library_items(item_ids):
+    """
+    Re-read library items from their table, for changes that bypass save()
+    (queryset .update(), on_delete=SET_NULL). Missing items are dropped.
+    """
+    from knowledge_base.models import LibraryItem
+
+    object_ids = [str(pk) for pk in item_ids]
+    if not object_ids:
+        return
+    documents = [library_document(item) for item in LibraryItem.objects.filter(id__in=object_ids)]
+    with transaction.atomic():
+        SearchDocument.objects.filter(kind='library', object_id__in=object_ids).delete()
+        SearchDocument.objects.bulk_create(documents)
+
+
+def remove(kind, object_ids):
+    SearchDocument.objects.filter(kind=kind, object_id__in=[str(pk) for pk in object_ids]).delete()
+
+
+def rebuild(batch_size=2000):
+    """Re-index everything from the source tables. Returns the number of documents."""
+    from api.models import Message
+    from knowledge_base.models import LibraryItem
+
+    SearchDocument.objects.all().delete()
+    batch = []
+    for message in Message.objects.only('id', 'chat_id', 'content', 'created_at').iterator(chunk_size=batch_size):
+        batch.append(message)
+        if len(batch) >= batch_size:
+            index_messages(batch)
+            batch = []
+    if batch:
+        index_messages(batch)
+
+    SearchDocument.objects.bulk_create(
+        (library_document(item) for item in LibraryItem.objects.iterator(chunk_size=batch_size)),
+        batch_size=batch_size,
+    )
+    return SearchDocument.objects.count()
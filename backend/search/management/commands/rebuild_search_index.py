@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from search import indexing
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from all messages and library items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = indexing.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} documents"))
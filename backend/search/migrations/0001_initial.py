@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('message', 'Message'), ('library', 'Library Item')], max_length=10)),
+                ('object_id', models.CharField(max_length=36)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('body', models.TextField()),
+                ('workspace_id', models.BigIntegerField(blank=True, null=True)),
+                ('subteam_id', models.BigIntegerField(blank=True, null=True)),
+                ('visibility', models.CharField(blank=True, max_length=10)),
+                ('chat_id', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat_id'], name='search_sear_chat_id_ba616e_idx')],
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+"""
+Index the messages and library items written before search existed.
+
+Rows are read through the historical models, so this matches
+search.indexing.rebuild() at the time of the migration; afterwards the
+signals keep the index current. Documents already present are kept, so the
+migration can follow a manual `rebuild_search_index`.
+"""
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+
+def backfill(apps, schema_editor):
+    Chat = apps.get_model('api', 'Chat')
+    Message = apps.get_model('api', 'Message')
+    LibraryItem = apps.get_model('knowledge_base', 'LibraryItem')
+    SearchDocument = apps.get_model('search', 'SearchDocument')
+
+    chats = {chat['id']: chat for chat in Chat.objects.values('id', 'user_id', 'workspace_id')}
+    batch = []
+    for message in Message.objects.exclude(content='').only('id', 'chat_id', 'content', 'created_at').iterator(chunk_size=BATCH_SIZE):
+        chat = chats.get(message.chat_id)
+        if chat is None:
+            continue
+        batch.append(SearchDocument(
+            kind='message', object_id=str(message.id), body=message.content,
+            user_id=chat['user_id'], workspace_id=chat['workspace_id'], chat_id=message.chat_id,
+            created_at=message.created_at,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            SearchDocument.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+
+    for item in LibraryItem.objects.iterator(chunk_size=BATCH_SIZE):
+        batch.append(SearchDocument(
+            kind='library', object_id=str(item.id), title=item.title, body=item.content,
+            user_id=item.user_id, workspace_id=item.workspace_id, subteam_id=item.subteam_id,
+            visibility=item.visibility, created_at=item.created_at,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            SearchDocument.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SearchDocument.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_fulltext_index'),
+        ('api', '0002_chat_workspace'),
+        ('knowledge_base', '0002_libraryitem_subteam_libraryitem_visibility_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
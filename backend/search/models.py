@@ -0,0 +1,37 @@
+from django.db import models
+from django.contrib.auth.models import User
+
+
+class SearchDocument(models.Model):
+    """
+    One searchable row per chat message or library item, with the fields
+    needed to apply access rules without joining back to the source tables.
+    The full-text index itself lives in a database-specific structure over
+    this table (FTS5 on SQLite, a tsvector column on Postgres).
+    """
+    KIND_CHOICES = [
+        ('message', 'Message'),
+        ('library', 'Library Item'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.CharField(max_length=36)
+    title = models.CharField(max_length=255, blank=True)
+    body = models.TextField()
+
+    # Access fields (chat owner / library item owner, and the sharing scope)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    workspace_id = models.BigIntegerField(null=True, blank=True)
+    subteam_id = models.BigIntegerField(null=True, blank=True)
+    visibility = models.CharField(max_length=10, blank=True)
+    chat_id = models.UUIDField(null=True, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+        indexes = [
+            models.Index(fields=['chat_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id}"
@@ -0,0 +1,52 @@
+import logging
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import Message
+from api.writebehind import objects_flushed
+from knowledge_base.models import LibraryItem
+from teams.models import SubTeam
+
+from . import indexing
+from .models import SearchDocument
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        indexing.index_messages([instance])
+
+
+@receiver(objects_flushed, sender=Message)
+def messages_flushed(sender, objects, **kwargs):
+    try:
+        indexing.index_messages(objects)
+    except Exception as e:
+        # The index can be rebuilt with `manage.py rebuild_search_index`
+        logger.error(f"Search indexing failed for {len(objects)} messages: {e}")
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    indexing.remove('message', [instance.id])
+
+
+@receiver(post_save, sender=LibraryItem)
+def library_item_saved(sender, instance, **kwargs):
+    indexing.index_library_item(instance)
+
+
+@receiver(post_delete, sender=LibraryItem)
+def library_item_deleted(sender, instance, **kwargs):
+    indexing.remove('library', [instance.id])
+
+
+@receiver(post_delete, sender=SubTeam)
+def subteam_deleted(sender, instance, **kwargs):
+    # Its library items had subteam set to NULL by an UPDATE, without save() or post_save
+    indexing.reindex_library_items(
+        SearchDocument.objects.filter(kind='library', subteam_id=instance.id).values_list('object_id', flat=True)
+    )
@@ -0,0 +1,83 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from api.models import Chat, Message
+from knowledge_base.models import LibraryItem
+from teams.models import SubTeam, Workspace, WorkspaceMember
+
+from .models import SearchDocument
+
+
+class SearchAccessTests(TestCase):
+    """Every search returns only rows the caller could open through the chat and library views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='pw')
+        cls.bob = User.objects.create_user('bob', password='pw')
+        cls.carol = User.objects.create_user('carol', password='pw')
+
+        cls.workspace = Workspace.objects.create(name='Shared', owner=cls.bob)
+        WorkspaceMember.objects.create(workspace=cls.workspace, user=cls.bob, role='OWNER')
+        WorkspaceMember.objects.create(workspace=cls.workspace, user=cls.alice)
+        cls.subteam = SubTeam.objects.create(workspace=cls.workspace, name='Design')
+        cls.subteam.members.add(cls.alice, cls.bob)
+        other_subteam = SubTeam.objects.create(workspace=cls.workspace, name='Finance')
+        other_subteam.members.add(cls.bob)
+
+        cls.foreign = Workspace.objects.create(name='Foreign', owner=cls.carol)
+        WorkspaceMember.objects.create(workspace=cls.foreign, user=cls.carol, role='OWNER')
+
+        def message(user, workspace, content):
+            chat = Chat.objects.create(user=user, title='Chat', workspace=workspace)
+            return str(Message.objects.create(chat=chat, role='user', content=content).id)
+
+        def item(user, workspace, visibility, subteam=None):
+            return str(LibraryItem.objects.create(user=user, title='kiwi', content='kiwi notes', workspace=workspace,
+                                                  subteam=subteam, visibility=visibility).id)
+
+        cls.alice_private = message(cls.alice, None, 'kiwi from alice')
+        cls.bob_private = message(cls.bob, None, 'kiwi from bob')
+        cls.shared_chat = message(cls.bob, cls.workspace, 'kiwi in the workspace')
+        cls.foreign_chat = message(cls.carol, cls.foreign, 'kiwi elsewhere')
+
+        cls.subteam_item = item(cls.bob, cls.workspace, 'SUBTEAM', cls.subteam)
+        cls.other_subteam_item = item(cls.bob, cls.workspace, 'SUBTEAM', other_subteam)
+        cls.bob_item = item(cls.bob, cls.workspace, 'PRIVATE')
+        cls.workspace_item = item(cls.bob, cls.workspace, 'WORKSPACE')
+        cls.foreign_item = item(cls.carol, cls.foreign, 'WORKSPACE')
+
+    def setUp(self):
+        # Cached workspace access would outlive the rolled-back membership changes of other tests
+        cache.clear()
+
+    def search(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get('/api/search/', {'q': 'kiwi', **params})
+        self.assertEqual(response.status_code, 200)
+        return {result['id'] for result in response.json()['results']}
+
+    def test_personal_scope_is_own_private_chats_and_items(self):
+        self.assertEqual(self.search(self.alice), {self.alice_private})
+        self.assertEqual(self.search(self.bob), {self.bob_private, self.subteam_item, self.other_subteam_item,
+                                                 self.bob_item, self.workspace_item})
+
+    def test_workspace_scope_adds_shared_chats_and_items(self):
+        self.assertEqual(self.search(self.alice, workspace=self.workspace.id),
+                         {self.shared_chat, self.subteam_item, self.workspace_item})
+
+    def test_type_filter(self):
+        self.assertEqual(self.search(self.alice, workspace=self.workspace.id, type='message'), {self.shared_chat})
+
+    def test_other_workspaces_are_refused(self):
+        self.client.force_login(self.alice)
+        response = self.client.get('/api/search/', {'q': 'kiwi', 'workspace': self.foreign.id})
+        self.assertEqual(response.status_code, 403)
+
+    def test_deleted_subteam_is_reindexed(self):
+        # on_delete=SET_NULL updates the items without calling save()
+        self.subteam.delete()
+        self.assertIsNone(SearchDocument.objects.get(kind='library', object_id=self.subteam_item).subteam_id)
+        self.assertEqual(self.search(self.alice, workspace=self.workspace.id), {self.shared_chat, self.workspace_item})
+        self.assertIn(self.subteam_item, self.search(self.bob))
@@ -0,0 +1,64 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from teams.access import IsWorkspaceMember, get_access
+from .backends import get_backend, access_filter
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _int_param(request, name, default, maximum=None):
+    try:
+        value = max(0, int(request.query_params.get(name, default)))
+    except (TypeError, ValueError):
+        value = default
+    return min(value, maximum) if maximum else value
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsWorkspaceMember])
+def search_view(request):
+    """
+    Ranked full-text search over chat messages and library items visible in
+    the current scope. Params: q, workspace, type (message|library), limit, offset.
+    """
+    query = request.query_params.get('q', '').strip()
+    kind = request.query_params.get('type')
+    if kind not in (None, 'message', 'library'):
+        return Response({"error": "type must be 'message' or 'library'"}, status=400)
+    limit = _int_param(request, 'limit', DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE) or DEFAULT_PAGE_SIZE
+    offset = _int_param(request, 'offset', 0)
+
+    if not query:
+        return Response({"results": [], "next_offset": None})
+
+    workspace_id = request.query_params.get('workspace')
+    subteam_ids = get_access(request).subteam_ids(workspace_id) if workspace_id else []
+    filter_sql, filter_params = access_filter(
+        request.user.id,
+        workspace_id=int(workspace_id) if workspace_id else None,
+        subteam_ids=subteam_ids,
+        kind=kind,
+    )
+
+    # Fetch one extra row to know whether there's a next page
+    rows = get_backend().search(query, filter_sql, filter_params, limit + 1, offset)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = [{
+        "type": row['kind'],
+        "id": row['object_id'],
+        "chat_id": row['chat_id'],
+        "title": row['title'],
+        "snippet": row['snippet'],
+        "rank": row['rank'],
+        "created_at": row['created_at'],
+    } for row in rows]
+
+    return Response({
+        "results": results,
+        "next_offset": offset + limit if has_more else None,
+    })
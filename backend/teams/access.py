@@ -0,0 +1,106 @@
+"""
+Workspace access resolution shared by every workspace-scoped endpoint.
+
+A user's memberships (workspace -> role) and sub-team ids are loaded in two
+queries, memoized on the request and cached in the Django cache. Signals in
+teams.signals drop the cached entry whenever a membership or sub-team roster
+changes. With a per-process cache (LocMemCache, used when REDIS_URL and
+CACHE_DIR are unset) other workers only notice after
+WORKSPACE_ACCESS_CACHE_TTL, which is why gunicorn.conf.py runs a single
+worker until a shared cache is configured.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import permissions
+
+from .models import WorkspaceMember, SubTeam
+
+
+def _cache_key(user_id):
+    return f"teams:access:{user_id}"
+
+
+def _to_id(workspace_id):
+    try:
+        return int(workspace_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class WorkspaceAccess:
+    def __init__(self, roles, subteams):
+        self.roles = roles          # {workspace_id: role}
+        self.subteams = subteams    # {workspace_id: [subteam_id, ...]}
+
+    @property
+    def workspace_ids(self):
+        return list(self.roles)
+
+    def is_member(self, workspace_id):
+        return _to_id(workspace_id) in self.roles
+
+    def role(self, workspace_id):
+        return self.roles.get(_to_id(workspace_id))
+
+    def is_admin(self, workspace_id):
+        return self.role(workspace_id) in ('OWNER', 'ADMIN')
+
+    def subteam_ids(self, workspace_id):
+        return self.subteams.get(_to_id(workspace_id), [])
+
+
+def load_access(user_id):
+    roles = dict(WorkspaceMember.objects.filter(user_id=user_id).values_list('workspace_id', 'role'))
+    subteams = {}
+    for subteam_id, workspace_id in SubTeam.objects.filter(members__id=user_id).values_list('id', 'workspace_id'):
+        subteams.setdefault(workspace_id, []).append(subteam_id)
+    return WorkspaceAccess(roles, subteams)
+
+
+def get_access(request):
+    """Resolve the current user's workspace access, once per request."""
+    # Memoize on the underlying HttpRequest so DRF and plain views share it
+    http_request = getattr(request, '_request', request)
+    access = getattr(http_request, '_workspace_access', None)
+    if access is not None:
+        return access
+
+    user_id = request.user.id
+    data = cache.get(_cache_key(user_id))
+    if data is None:
+        access = load_access(user_id)
+        cache.set(
+            _cache_key(user_id),
+            {'roles': access.roles, 'subteams': access.subteams},
+            getattr(settings, 'WORKSPACE_ACCESS_CACHE_TTL', 60),
+        )
+    else:
+        access = WorkspaceAccess(data['roles'], data['subteams'])
+
+    http_request._workspace_access = access
+    return access
+
+
+def invalidate_access(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+def has_chat_access(request, chat):
+    """Owners always see their chats; workspace chats are visible to all members."""
+    if chat.user_id == request.user.id:
+        return True
+    return bool(chat.workspace_id) and get_access(request).is_member(chat.workspace_id)
+
+
+class IsWorkspaceMember(permissions.BasePermission):
+    """
+    Allows the request when it has no ?workspace= parameter, or when the user
+    is a member of the workspace it names.
+    """
+    message = "Access denied"
+
+    def has_permission(self, request, view):
+        workspace_id = request.query_params.get('workspace')
+        if not workspace_id:
+            return True
+        return request.user.is_authenticated and get_access(request).is_member(workspace_id)
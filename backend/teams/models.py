@@ -9,6 +9,8 @@ class Workspace(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_workspaces')
     invite_token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Spend cap in USD per calendar month (UTC); chat requests are refused once it's reached
+    monthly_budget = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     def save(self, *args, **kwargs):
         # Auto-generate slug if missing
@@ -0,0 +1,29 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .access import invalidate_access
+from .models import WorkspaceMember, SubTeam
+
+
+@receiver(post_save, sender=WorkspaceMember)
+@receiver(post_delete, sender=WorkspaceMember)
+def membership_changed(sender, instance, **kwargs):
+    invalidate_access(instance.user_id)
+
+
+@receiver(pre_delete, sender=SubTeam)
+def subteam_deleted(sender, instance, **kwargs):
+    invalidate_access(*instance.members.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=SubTeam.members.through)
+def subteam_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # user.subteams.add(...): the instance is the user
+        invalidate_access(instance.id)
+    elif action == 'pre_clear':
+        invalidate_access(*instance.members.values_list('id', flat=True))
+    else:
+        invalidate_access(*pk_set)
@@ -1,3 +1,72 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from . import access
+from .models import SubTeam, Workspace, WorkspaceMember
+
+
+class WorkspaceAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.member = User.objects.create_user('member', password='pw')
+        self.workspace = Workspace.objects.create(name='Team', owner=self.owner)
+        WorkspaceMember.objects.create(workspace=self.workspace, user=self.owner, role='OWNER')
+        self.membership = WorkspaceMember.objects.create(workspace=self.workspace, user=self.member, role='ADMIN')
+        self.subteam = SubTeam.objects.create(workspace=self.workspace, name='Design')
+
+    def resolve(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return access.get_access(request)
+
+    def history(self, user):
+        self.client.force_login(user)
+        return self.client.get('/api/chat/history/', {'workspace': self.workspace.id})
+
+    def test_roles_and_subteams_are_resolved(self):
+        self.subteam.members.add(self.member)
+        outsider = User.objects.create_user('outsider', password='pw')
+
+        member = self.resolve(self.member)
+        self.assertTrue(member.is_member(str(self.workspace.id)))
+        self.assertTrue(member.is_admin(self.workspace.id))
+        self.assertEqual(member.subteam_ids(self.workspace.id), [self.subteam.id])
+        self.assertFalse(self.resolve(outsider).is_member(self.workspace.id))
+        self.assertFalse(member.is_member('not-an-id'))
+
+    def test_access_is_loaded_once_and_cached(self):
+        with mock.patch('teams.access.load_access', wraps=access.load_access) as load:
+            self.assertEqual(self.history(self.member).status_code, 200)
+            self.assertEqual(self.history(self.member).status_code, 200)
+        self.assertEqual(load.call_count, 1)
+
+    def test_removed_member_loses_access(self):
+        self.assertEqual(self.history(self.member).status_code, 200)
+        self.membership.delete()
+        self.assertEqual(self.history(self.member).status_code, 403)
+
+    def test_demoted_admin_loses_admin_actions(self):
+        self.client.force_login(self.member)
+        url = f'/api/teams/workspaces/{self.workspace.id}/regenerate-invite/'
+        self.assertEqual(self.client.post(url).status_code, 200)
+
+        self.membership.role = 'MEMBER'
+        self.membership.save()
+        self.assertEqual(self.client.post(url).status_code, 403)
+        response = self.client.post('/api/teams/subteams/', {'workspace': self.workspace.id, 'name': 'Ops'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_subteam_roster_changes_are_picked_up(self):
+        self.assertEqual(self.resolve(self.member).subteam_ids(self.workspace.id), [])
+        self.subteam.members.add(self.member)
+        self.assertEqual(self.resolve(self.member).subteam_ids(self.workspace.id), [self.subteam.id])
+        self.member.subteams.remove(self.subteam)
+        self.assertEqual(self.resolve(self.member).subteam_ids(self.workspace.id), [])
+        self.subteam.members.add(self.member)
+        self.resolve(self.member)
+        self.subteam.delete()
+        self.assertEqual(self.resolve(self.member).subteam_ids(self.workspace.id), [])
@@ -1,5 +1,6 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.utils.text import slugify
@@ -7,6 +8,7 @@ import uuid
 
 from .models import Workspace, WorkspaceMember, SubTeam
 from .serializers import WorkspaceSerializer, SubTeamSerializer, WorkspaceMemberSerializer
+from .access import get_access
 
 class WorkspaceViewSet(viewsets.ModelViewSet):
     serializer_class = WorkspaceSerializer
@@ -52,8 +54,7 @@ class WorkspaceViewSet(viewsets.ModelViewSet):
     def regenerate_invite(self, request, pk=None):
         workspace = self.get_object()
         # Check permissions
-        membership = WorkspaceMember.objects.filter(workspace=workspace, user=request.user).first()
-        if not membership or membership.role not in ['OWNER', 'ADMIN']:
+        if not get_access(request).is_admin(workspace.id):
             return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
             
         workspace.invite_token = uuid.uuid4()
@@ -71,7 +72,6 @@ class SubTeamViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # Ensure user is admin/owner of the workspace
         workspace = serializer.validated_data.get('workspace')
-        membership = WorkspaceMember.objects.filter(workspace=workspace, user=self.request.user).first()
-        if not membership or membership.role not in ['OWNER', 'ADMIN']:
-             raise permissions.PermissionDenied("You must be an admin to create subteams.")
+        if not workspace or not get_access(self.request).is_admin(workspace.id):
+             raise PermissionDenied("You must be an admin to create subteams.")
         serializer.save()
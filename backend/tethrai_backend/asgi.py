@@ -7,10 +7,49 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethrai_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+logger = logging.getLogger(__name__)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    """
+    Django doesn't speak the lifespan protocol, so handle it here. On startup
+    the write-behind worker replays spools left by workers that died. On shutdown
+    the server has already stopped accepting connections and waited for open
+    ones; we then let detached SSE producers finish and flush the write-behind
+    queue so no reply or usage log is lost.
+    """
+    from asgiref.sync import sync_to_async
+    from django.conf import settings
+    from api.generations import adrain_producers
+    from api.writebehind import get_queue, start as start_write_behind
+    from tethrai_backend.health import start_draining
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await sync_to_async(start_write_behind, thread_sensitive=False)()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            start_draining()
+            left = await adrain_producers(getattr(settings, 'SHUTDOWN_DRAIN_TIMEOUT', 60))
+            if left:
+                logger.warning(f"Shutting down with {left} generations still running")
+            await sync_to_async(get_queue().flush, thread_sensitive=False)()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
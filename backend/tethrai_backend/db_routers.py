@@ -0,0 +1,79 @@
+"""
+Read replica routing.
+
+Writes always go to "default". Reads go to the "replica" alias (when it is
+configured) only inside views decorated with @read_replica: the read-heavy
+listing endpoints where a little replication lag is harmless. Everything
+else, including background threads, reads from the primary.
+
+A client that has just written (any unsafe request) is pinned to the primary
+for DATABASE_REPLICA_PIN_SECONDS via a cookie, so a chat that was just sent
+doesn't vanish from the history because the replica hasn't caught up.
+"""
+import contextvars
+import functools
+
+from django.conf import settings
+from django.http import HttpRequest
+
+REPLICA = 'replica'
+PIN_COOKIE = 'db_pin'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def replica_available():
+    return REPLICA in settings.DATABASES
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_available():
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def _find_request(args):
+    for arg in args:
+        if isinstance(arg, HttpRequest) or hasattr(arg, '_request'):
+            return arg
+    return None
+
+
+def read_replica(view):
+    """Serve the view's reads from the replica unless the client recently wrote."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request = _find_request(args)
+        if request is not None and request.COOKIES.get(PIN_COOKIE):
+            return view(*args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    """Marks clients that just wrote so their next reads stay on the primary."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and replica_available():
+            seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
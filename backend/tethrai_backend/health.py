@@ -0,0 +1,52 @@
+"""
+Liveness and readiness probes, and the draining state used on shutdown.
+
+/healthz only says the process is serving requests. /readyz also checks the
+database and cache and turns 503 once the worker starts draining, so load
+balancers stop sending it new chats while in-flight streams finish.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import connections
+from django.http import JsonResponse
+
+_draining_since = None
+
+
+def start_draining():
+    global _draining_since
+    if _draining_since is None:
+        _draining_since = time.monotonic()
+
+
+def is_draining():
+    return _draining_since is not None
+
+
+async def healthz(request):
+    # Async so it answers from the event loop even while sync views are busy
+    return JsonResponse({"status": "ok"})
+
+
+def readyz(request):
+    checks = {}
+    try:
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = f"error: {e}"
+    try:
+        cache.set('readyz', 1, 5)
+        checks['cache'] = 'ok'
+    except Exception as e:
+        checks['cache'] = f"error: {e}"
+
+    ready = not is_draining() and all(value == 'ok' for value in checks.values())
+    from api.generations import active_producers
+    return JsonResponse({
+        "status": "ready" if ready else "draining" if is_draining() else "unavailable",
+        "checks": checks,
+        "active_generations": active_producers(),
+    }, status=200 if ready else 503)
@@ -4,6 +4,7 @@ Django settings for tethrai_backend project.
 
 from pathlib import Path
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'knowledge_base',
     'teams',
     'analytics',
+    'search',
 ]
 
 MIDDLEWARE = [
@@ -54,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tethrai_backend.db_routers.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'tethrai_backend.urls'
@@ -79,12 +82,80 @@ WSGI_APPLICATION = 'tethrai_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL when POSTGRES_DB is set (requires psycopg), SQLite otherwise.
+
+def postgres_database(host):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB'),
+        'USER': os.getenv('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': host,
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
-}
+    if os.getenv('POSTGRES_POOL', 'False') == 'True':
+        # psycopg's connection pool (pip install "psycopg[pool]"); replaces persistent connections
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('POSTGRES_POOL_MAX_SIZE', '20')),
+            'timeout': float(os.getenv('POSTGRES_POOL_TIMEOUT', '10')),
+        }
+    else:
+        # Keep connections open between requests (per worker thread)
+        database['CONN_MAX_AGE'] = int(os.getenv('POSTGRES_CONN_MAX_AGE', '600'))
+    return database
+
+
+if os.getenv('POSTGRES_DB'):
+    DATABASES = {'default': postgres_database(os.getenv('POSTGRES_HOST', 'localhost'))}
+    if os.getenv('POSTGRES_REPLICA_HOST'):
+        # Read-only endpoints decorated with @read_replica (tethrai_backend.db_routers)
+        DATABASES['replica'] = postgres_database(os.getenv('POSTGRES_REPLICA_HOST'))
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+                # Take the write lock when the transaction starts instead of failing on upgrade
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+    if os.getenv('SQLITE_WAL', 'True') != 'True':
+        # journal_mode is stored in the file, so switching back has to be explicit
+        DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=DELETE;'
+    else:
+        # Readers no longer block the writer (and vice versa); NORMAL sync is safe under WAL
+        DATABASES['default']['OPTIONS']['init_command'] = (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA temp_store=MEMORY;'
+            'PRAGMA cache_size=-20000;'
+            'PRAGMA mmap_size=134217728;'
+        )
+
+# Cache
+# Workspace access (teams.access), rate limits (api.limits.CacheLimiter) and budget
+# running sums (analytics.budgets) live here. Without REDIS_URL or CACHE_DIR each
+# process has its own LocMemCache, which is only correct with a single worker.
+
+if os.getenv('REDIS_URL'):
+    # Requires the redis package
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}}
+elif os.getenv('CACHE_DIR'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.getenv('CACHE_DIR')}}
+SHARED_CACHE = bool(os.getenv('REDIS_URL') or os.getenv('CACHE_DIR'))
+
+DATABASE_ROUTERS = ['tethrai_backend.db_routers.ReplicaRouter']
+# How long a client that just wrote keeps reading from the primary
+DATABASE_REPLICA_PIN_SECONDS = 5
 
 
 # Password validation
@@ -165,3 +236,106 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
 }
+
+# Upstream (OpenRouter) resilience, see api.upstream
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '60'))  # max silence between chunks
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))  # per model, before the first byte only
+UPSTREAM_BACKOFF_BASE = 0.5  # seconds
+UPSTREAM_BACKOFF_MAX = 4
+UPSTREAM_BREAKER_THRESHOLD = 5  # consecutive failures that open a model's circuit
+UPSTREAM_BREAKER_COOLDOWN = 30  # seconds before a trial request is let through
+# {"model id": ["fallback", ...], "*": [...]} e.g. '{"*": ["openai/gpt-4o-mini"]}'
+UPSTREAM_FALLBACK_MODELS = json.loads(os.getenv('UPSTREAM_FALLBACK_MODELS', '{}'))
+
+# Chat context window
+# Upper bound on history rows read per turn; the model's context_length further trims this.
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv('CHAT_CONTEXT_MAX_MESSAGES', '200'))
+# Fraction of the context window kept free for the completion.
+CHAT_CONTEXT_COMPLETION_RESERVE = 0.25
+# Summarize history that no longer fits instead of silently dropping it (costs an extra upstream call).
+CHAT_CONTEXT_SUMMARIZE = os.getenv('CHAT_CONTEXT_SUMMARIZE', 'False') == 'True'
+CHAT_CONTEXT_SUMMARY_MODEL = os.getenv('CHAT_CONTEXT_SUMMARY_MODEL', '')
+CHAT_CONTEXT_SUMMARY_WORKERS = 1
+CHAT_CONTEXT_SUMMARY_MAX_PENDING = 100  # chats waiting; further passes are skipped until a later turn
+
+# Write-behind persistence of usage logs (assistant messages are saved synchronously)
+# When disabled, rows are saved synchronously at the end of the stream.
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'True') == 'True'
+WRITE_BEHIND_SPOOL_DIR = Path(os.getenv('WRITE_BEHIND_SPOOL_DIR', BASE_DIR / 'spool'))
+WRITE_BEHIND_BATCH_SIZE = 100
+WRITE_BEHIND_FLUSH_INTERVAL = 0.5  # seconds
+WRITE_BEHIND_FSYNC = os.getenv('WRITE_BEHIND_FSYNC', 'False') == 'True'
+
+# Workspace access cache (teams.access). Invalidated on membership changes;
+# the TTL bounds staleness for other processes when the cache isn't shared.
+WORKSPACE_ACCESS_CACHE_TTL = 60
+
+# OpenRouter model catalog (api.models_service). Last good snapshot, read on cold start.
+MODEL_CATALOG_SNAPSHOT_PATH = Path(os.getenv('MODEL_CATALOG_SNAPSHOT_PATH', BASE_DIR / 'var' / 'openrouter_models.json'))
+
+# Completion cache (api.completion_cache), per process. Clients opt in per request with
+# "cache": true; COMPLETION_CACHE_DEFAULT turns it on for every chat_send.
+COMPLETION_CACHE_DEFAULT = os.getenv('COMPLETION_CACHE_DEFAULT', 'False') == 'True'
+COMPLETION_CACHE_TTL = int(os.getenv('COMPLETION_CACHE_TTL', '3600'))
+COMPLETION_CACHE_MAX_ENTRIES = 10000
+COMPLETION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# SSE output mode for chat_send (api.generations): token coalescing window and
+# how long finished generations stay resumable via Last-Event-ID.
+CHAT_SSE_COALESCE_MS = 50
+CHAT_SSE_COALESCE_CHARS = 1024
+CHAT_GENERATION_TTL = 300  # seconds
+
+# Chat gateway limits (api.limits), per user and per workspace. A missing or
+# zero entry means unlimited. Tokens are prompt + completion as logged.
+CHAT_RATE_LIMITS = {
+    'user': {
+        'requests_per_minute': int(os.getenv('CHAT_USER_REQUESTS_PER_MINUTE', '30')),
+        'tokens_per_minute': int(os.getenv('CHAT_USER_TOKENS_PER_MINUTE', '200000')),
+        'concurrent_streams': int(os.getenv('CHAT_USER_CONCURRENT_STREAMS', '4')),
+    },
+    'workspace': {
+        'requests_per_minute': int(os.getenv('CHAT_WORKSPACE_REQUESTS_PER_MINUTE', '300')),
+        'tokens_per_minute': int(os.getenv('CHAT_WORKSPACE_TOKENS_PER_MINUTE', '2000000')),
+        'concurrent_streams': int(os.getenv('CHAT_WORKSPACE_CONCURRENT_STREAMS', '40')),
+    },
+}
+# Shared between workers through the cache when one is configured, per process otherwise
+CHAT_RATE_LIMIT_BACKEND = os.getenv(
+    'CHAT_RATE_LIMIT_BACKEND', 'api.limits.CacheLimiter' if SHARED_CACHE else 'api.limits.LocalLimiter'
+)
+
+# Monthly spend budgets (analytics.budgets). Workspaces set Workspace.monthly_budget;
+# this applies to personal chats (None = unlimited).
+PERSONAL_MONTHLY_BUDGET = os.getenv('PERSONAL_MONTHLY_BUDGET') or None
+BUDGET_SPEND_TTL = 600  # seconds the cached month-to-date spend is trusted
+
+# Chat title generation (api.titles): bounded worker pool, batched upstream calls
+TITLE_MODEL = os.getenv('TITLE_MODEL', 'google/gemini-2.0-flash-exp:free')
+TITLE_TASK_BACKEND = os.getenv('TITLE_TASK_BACKEND', 'api.titles.InProcessTitleBackend')
+TITLE_WORKERS = 2
+TITLE_MAX_PENDING = 500
+TITLE_BATCH_SIZE = 8
+TITLE_TIMEOUT = 10  # seconds per upstream call
+
+# Seconds a stopping worker waits for detached SSE generations (see asgi.py, gunicorn.conf.py)
+SHUTDOWN_DRAIN_TIMEOUT = int(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '60'))
+
+# Library {{variable}} templates (knowledge_base.prompt_templates)
+TEMPLATE_CACHE_SIZE = 512  # compiled templates kept per process
+TEMPLATE_RENDER_MAX_INPUTS = 1000  # variable sets per batch render request
+
+# Compare mode (api.compare): models answering one message side by side
+COMPARE_MAX_MODELS = int(os.getenv('COMPARE_MAX_MODELS', '4'))
+
+# Batch prompt jobs (api.batches)
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '16'))  # upstream calls in flight per process, all jobs
+BATCH_MODEL_CONCURRENCY = int(os.getenv('BATCH_MODEL_CONCURRENCY', '4'))  # per model, all jobs
+BATCH_MAX_CALLS = 1000  # inputs x models per job
+BATCH_FLUSH_SIZE = 20  # results written per bulk insert
+BATCH_CALL_TIMEOUT = 60
+BATCH_PROGRESS_INTERVAL = 0.5  # seconds between progress checks on the SSE stream
+
+# Full-text search backend (search.backends). Defaults to the one matching the database vendor.
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND') or None
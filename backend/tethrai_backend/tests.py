@@ -0,0 +1,88 @@
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.request import Request
+
+from api.models import Chat
+
+from . import db_routers, health
+from .db_routers import PIN_COOKIE, REPLICA, ReplicaPinMiddleware, ReplicaRouter, read_replica
+
+
+def read_alias():
+    return ReplicaRouter().db_for_read(Chat)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_routers, 'replica_available', return_value=True)
+        self.replica_available = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def test_reads_use_the_replica_only_inside_decorated_views(self):
+        view = read_replica(lambda request: read_alias())
+        self.assertEqual(view(self.factory.get('/')), REPLICA)
+        self.assertEqual(read_alias(), 'default')
+        self.assertEqual(ReplicaRouter().db_for_write(Chat), 'default')
+
+        self.replica_available.return_value = False
+        self.assertEqual(view(self.factory.get('/')), 'default')
+
+    def test_pinned_clients_read_from_the_primary(self):
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(read_replica(lambda request: read_alias())(request), 'default')
+
+        # Viewset methods get (self, request) with a DRF request
+        method = read_replica(lambda viewset, request: read_alias())
+        self.assertEqual(method(object(), Request(request)), 'default')
+        self.assertEqual(method(object(), Request(self.factory.get('/'))), REPLICA)
+
+    def test_replica_is_reset_when_the_view_raises(self):
+        @read_replica
+        def view(request):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            view(self.factory.get('/'))
+        self.assertEqual(read_alias(), 'default')
+
+    @override_settings(DATABASE_REPLICA_PIN_SECONDS=7)
+    def test_writes_pin_the_client(self):
+        middleware = ReplicaPinMiddleware(lambda request: HttpResponse())
+        self.assertNotIn(PIN_COOKIE, middleware(self.factory.get('/')).cookies)
+
+        cookie = middleware(self.factory.post('/')).cookies[PIN_COOKIE]
+        self.assertEqual((cookie.value, cookie['max-age']), ('1', 7))
+        self.assertTrue(cookie['httponly'])
+
+        # Without a replica there's nothing to pin away from
+        self.replica_available.return_value = False
+        self.assertNotIn(PIN_COOKIE, middleware(self.factory.delete('/')).cookies)
+
+
+class ReadinessTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(health, '_draining_since', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ready_until_draining(self):
+        self.assertEqual(self.client.get('/healthz').json(), {"status": "ok"})
+        response = self.client.get('/readyz')
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'ready'))
+
+        health.start_draining()
+        response = self.client.get('/readyz')
+        self.assertEqual((response.status_code, response.json()['status']), (503, 'draining'))
+        # Still alive while in-flight streams finish
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+
+    def test_failed_check_is_unavailable(self):
+        with mock.patch('tethrai_backend.health.cache.set', side_effect=ConnectionError('redis down')):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'unavailable')
+        self.assertEqual(response.json()['checks'], {'database': 'ok', 'cache': 'error: redis down'})
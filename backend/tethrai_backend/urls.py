@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
+from .health import healthz, readyz
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -7,4 +8,7 @@ urlpatterns = [
     path('api/knowledge/', include('knowledge_base.urls')),
     path('api/teams/', include('teams.urls')),
     path('api/analytics/', include('analytics.urls')),
+    path('api/search/', include('search.urls')),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
 ]
@@ -16,6 +16,15 @@ export interface Chat {
 	created_at: string;
 	updated_at: string;
 	messages: Message[];
+	messages_next?: string | null;
+}
+
+export interface ChatListItem {
+	id: string;
+	title: string;
+	created_at: string;
+	updated_at: string;
+	last_message: string | null;
 }
 
 export interface ModelCapabilities {
@@ -35,9 +44,15 @@ export interface AIModel {
 
 import { useTeamStore } from "./teams";
 
+// Paginated endpoints return absolute "next" links; we only need their cursor
+function cursorFrom(link: string | null | undefined) {
+	return link ? new URL(link).searchParams.get("cursor") : null;
+}
+
 export const useChatStore = defineStore("chat", () => {
 	const currentChat = ref<Chat | null>(null);
-	const chatHistory = ref<Chat[]>([]);
+	const chatHistory = ref<ChatListItem[]>([]);
+	const historyCursor = ref<string | null>(null);
 	const isStreaming = ref(false);
 	
 	// Model management state
@@ -138,15 +153,21 @@ export const useChatStore = defineStore("chat", () => {
 		}
 	}
 
-	async function getChatHistory() {
+	async function getChatHistory(loadMore = false) {
 		try {
             const teamStore = useTeamStore();
-            let url = "/api/chat/history/";
+            const params: Record<string, string> = {};
             if (teamStore.currentWorkspace) {
-                url += `?workspace=${teamStore.currentWorkspace.id}`;
+                params.workspace = String(teamStore.currentWorkspace.id);
+            }
+            if (loadMore && historyCursor.value) {
+                params.cursor = historyCursor.value;
             }
-			const response = await axios.get(url);
-			chatHistory.value = response.data;
+			const response = await axios.get("/api/chat/history/", { params });
+			chatHistory.value = loadMore
+				? [...chatHistory.value, ...response.data.results]
+				: response.data.results;
+			historyCursor.value = cursorFrom(response.data.next);
 		} catch (error) {
 			console.error("Get chat history failed", error);
 		}
@@ -161,6 +182,19 @@ export const useChatStore = defineStore("chat", () => {
 		}
 	}
 
+	async function loadOlderMessages() {
+		const chat = currentChat.value;
+		const cursor = cursorFrom(chat?.messages_next);
+		if (!chat || !cursor) return;
+		try {
+			const response = await axios.get(`/api/chat/${chat.id}/`, { params: { cursor } });
+			chat.messages = [...response.data.messages, ...chat.messages];
+			chat.messages_next = response.data.messages_next;
+		} catch (error) {
+			console.error("Load older messages failed", error);
+		}
+	}
+
 	function clearCurrentChat() {
 		currentChat.value = null;
 	}
@@ -216,6 +250,7 @@ export const useChatStore = defineStore("chat", () => {
 	return {
 		currentChat,
 		chatHistory,
+		historyCursor,
 		isStreaming,
 		availableModels,
 		selectedModel,
@@ -225,6 +260,7 @@ export const useChatStore = defineStore("chat", () => {
 		sendMessage,
 		getChatHistory,
 		loadChat,
+		loadOlderMessages,
 		clearCurrentChat,
 		fetchModels,
 		retryFetchModels,
@@ -24,8 +24,15 @@ export interface LibraryItem {
 
 import { useTeamStore } from "./teams";
 
+// The listing is cursor paginated; "next" is an absolute link carrying the cursor
+function cursorFrom(link: string | null | undefined) {
+    return link ? new URL(link).searchParams.get("cursor") : null;
+}
+
 export const useLibraryStore = defineStore("library", () => {
     const items = ref<LibraryItem[]>([]);
+    const nextCursor = ref<string | null>(null);
+    const hasMore = computed(() => nextCursor.value !== null);
     const isLoading = ref(false);
     const searchQuery = ref("");
     const activeTab = ref<'ALL' | 'PROMPT' | 'TEMPLATE'>('ALL');
@@ -50,16 +57,22 @@ export const useLibraryStore = defineStore("library", () => {
         return result;
     });
 
-    async function fetchItems() {
+    async function fetchItems(loadMore = false) {
         const teamStore = useTeamStore();
-        isLoading.value = true;
+        isLoading.value = !loadMore;
         try {
-            let url = "/api/knowledge/library/";
+            const params: Record<string, string> = {};
             if (teamStore.currentWorkspace) {
-                url += `?workspace=${teamStore.currentWorkspace.id}`;
+                params.workspace = String(teamStore.currentWorkspace.id);
+            }
+            if (loadMore && nextCursor.value) {
+                params.cursor = nextCursor.value;
             }
-            const response = await axios.get(url);
-            items.value = response.data;
+            const response = await axios.get("/api/knowledge/library/", { params });
+            items.value = loadMore
+                ? [...items.value, ...response.data.results]
+                : response.data.results;
+            nextCursor.value = cursorFrom(response.data.next);
         } catch (error) {
             console.error("Failed to fetch library items", error);
         } finally {
@@ -97,6 +110,7 @@ export const useLibraryStore = defineStore("library", () => {
         searchQuery,
         activeTab,
         filteredItems,
+        hasMore,
         fetchItems,
         updateItem,
         deleteItem